@@ -120,13 +120,14 @@ class AssistantAgent(AssistantUtils):
                                               streaming=assistant_llm.auto_llm.streaming)
 
     @staticmethod
-    def parse_tool_params(tool: GptsTools) -> Dict:
+    def parse_tool_params(tool: GptsTools, session_id: str = None) -> Dict:
         """
         解析预置工具的初始化参数
+        session_id: 代码解释器的会话id, 同一个会话内的多次执行共用解释器进程和变量
         """
         # 特殊处理下bisheng_code_interpreter的参数
         if tool.tool_key == 'bisheng_code_interpreter':
-            return {'minio': settings.get_knowledge().get('minio', {})}
+            return {'minio': settings.get_knowledge().get('minio', {}), 'session_id': session_id or None}
         if not tool.extra:
             return {}
         params = json.loads(tool.extra)
@@ -136,12 +137,13 @@ class AssistantAgent(AssistantUtils):
     @staticmethod
     def sync_init_preset_tools(tool_list: List[GptsTools],
                                llm: BaseLanguageModel = None,
-                               callbacks: Callbacks = None):
+                               callbacks: Callbacks = None,
+                               session_id: str = None):
         """
         初始化预置工具列表
         """
         tool_name_param = {
-            tool.tool_key: AssistantAgent.parse_tool_params(tool)
+            tool.tool_key: AssistantAgent.parse_tool_params(tool, session_id)
             for tool in tool_list
         }
         tool_langchain = load_tools(tool_params=tool_name_param, llm=llm, callbacks=callbacks)
@@ -152,7 +154,7 @@ class AssistantAgent(AssistantUtils):
         初始化预置工具列表
         """
         tool_name_param = {
-            tool.tool_key: AssistantAgent.parse_tool_params(tool)
+            tool.tool_key: AssistantAgent.parse_tool_params(tool, self.chat_id)
             for tool in tool_list
         }
         tool_langchain = load_tools(tool_params=tool_name_param, llm=self.llm, callbacks=callbacks)
@@ -314,11 +316,13 @@ class AssistantAgent(AssistantUtils):
     @staticmethod
     async def init_tools_by_tool_ids(tool_ids: List[int],
                                      llm: BaseLanguageModel,
-                                     callbacks: Callbacks = None, ):
+                                     callbacks: Callbacks = None,
+                                     session_id: str = None):
         tools = []
         preset_tools, personal_tools, mcp_tools = AssistantAgent.parse_tools_type(tool_ids)
         if preset_tools:
-            tool_langchain = AssistantAgent.sync_init_preset_tools(preset_tools, llm, callbacks)
+            tool_langchain = AssistantAgent.sync_init_preset_tools(preset_tools, llm, callbacks,
+                                                                   session_id)
             logger.info('act=build_preset_tools size={} return_tools={}', len(preset_tools),
                         len(tool_langchain))
             tools += tool_langchain
@@ -350,7 +354,9 @@ class AssistantAgent(AssistantUtils):
             else:
                 flow_links.append(link)
         if tool_ids:
-            tools = await self.init_tools_by_tool_ids(tool_ids, self.llm, callbacks)
+            # 同一个会话内代码解释器的多次调用共用解释器进程, 可以使用之前执行留下的变量
+            tools = await self.init_tools_by_tool_ids(tool_ids, self.llm, callbacks,
+                                                      session_id=self.chat_id)
 
         # flow + knowledge
         flow_data = FlowDao.get_flow_by_ids([link.flow_id for link in flow_links if link.flow_id])
@@ -1,16 +1,22 @@
 import json
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Any, Dict, List, Optional
 
 import requests
 from bisheng.api.errcode.knowledge import KnowledgeSimilarError
+from bisheng.api.services.assistant_base import AssistantUtils
 from bisheng.api.services.handler.impl.xls_split_handle import XlsSplitHandle
 from bisheng.api.services.handler.impl.xlsx_split_handle import XlsxSplitHandle
 from bisheng.api.services.llm import LLMService
 from bisheng.api.utils import md5_hash
 from bisheng.api.v1.schemas import FileProcessBase
+from bisheng.cache.parse_cache import get_parse_cache
 from bisheng.cache.redis import redis_client
+from bisheng.cache.title_cache import get_title_cache
 from bisheng.cache.utils import file_download
 from bisheng.database.base import session_getter
 from bisheng.database.models.knowledge import Knowledge, KnowledgeDao
@@ -23,8 +29,9 @@ from bisheng.interface.initialize.loading import instantiate_vectorstore
 from bisheng.settings import settings
 from bisheng.utils.embedding import decide_embeddings
 from bisheng.utils.minio_client import MinioClient
+from bisheng.utils.pipeline import PipelineStage, StagePipeline
 from bisheng_langchain.document_loaders import ElemUnstructuredLoader
-from bisheng_langchain.rag.extract_info import extract_title
+from bisheng_langchain.rag.extract_info import extract_title, title_extract_prompt_version
 from bisheng_langchain.text_splitter import ElemCharacterTextSplitter
 from langchain.embeddings.base import Embeddings
 from langchain.schema.document import Document
@@ -106,13 +113,23 @@ class KnowledgeUtils:
     @classmethod
     def delete_preview_cache(cls, cache_key, chunk_index: int = None):
         if chunk_index is None:
-            redis_client.delete(cache_key)
-            redis_client.delete(f'{cache_key}_parse_type')
-            redis_client.delete(f'{cache_key}_file_path')
-            redis_client.delete(f'{cache_key}_partitions')
+            redis_client.mdelete(cache_key, f'{cache_key}_parse_type', f'{cache_key}_file_path',
+                                 f'{cache_key}_partitions')
         else:
             redis_client.hdel(cache_key, chunk_index)
 
+    @classmethod
+    def get_preview_chunks(cls, cache_key) -> Optional[tuple]:
+        """ 获取用户预览编辑过的分块, 返回 texts, metadatas, 没有缓存返回None """
+        all_chunk_info = cls.get_preview_cache(cache_key)
+        if not all_chunk_info:
+            return None
+        texts, metadatas = [], []
+        for key, val in all_chunk_info.items():
+            texts.append(val['text'])
+            metadatas.append(val['metadata'])
+        return texts, metadatas
+
     @classmethod
     def get_preview_cache(cls, cache_key, chunk_index: int = None) -> dict:
         if chunk_index is None:
@@ -262,6 +279,41 @@ def decide_knowledge_llm() -> Any:
     return LLMService.get_bisheng_llm(model_id=knowledge_llm.extract_title_model_id, cache=False)
 
 
+class FileIngestTask:
+    """ 单个知识文件在入库流水线中的上下文 """
+
+    def __init__(self, db_file: KnowledgeFile, preview_cache_key: str = None):
+        self.db_file = db_file
+        self.preview_cache_key = preview_cache_key
+        self.filepath: Optional[str] = None
+        self.documents: List[Document] = []
+        self.parse_type: str = ParseType.LOCAL.value
+        self.partitions: Any = []
+        self.texts: List[str] = []
+        self.metadatas: List[dict] = []
+        self.vectors: Optional[List[List[float]]] = None
+        # 分块已经从预览缓存或者解析缓存中获取, 不需要再总结标题和切分
+        self.chunks_ready = False
+        self.chunk_cache_key: Optional[str] = None
+
+
+# 入库流水线每个阶段的默认并发数, 可通过知识库配置中的 ingest_pipeline 覆盖
+default_ingest_pipeline_conf = {
+    'download': 2,
+    'parse': 2,
+    'title': 4,
+    'split': 1,
+    'embed': 2,
+    'store': 1,
+}
+
+
+def get_ingest_pipeline_conf() -> Dict[str, int]:
+    conf = default_ingest_pipeline_conf.copy()
+    conf.update(settings.get_knowledge().get('ingest_pipeline') or {})
+    return conf
+
+
 def addEmbedding(collection_name: str,
                  index_name: str,
                  knowledge_id: int,
@@ -274,7 +326,7 @@ def addEmbedding(collection_name: str,
                  callback: str = None,
                  extra_meta: str = None,
                  preview_cache_keys: List[str] = None):
-    """  将文件加入到向量和es库内  """
+    """  将文件加入到向量和es库内, 下载->解析->总结标题->切分->向量化->入库 各阶段并发执行  """
 
     logger.info('start process files')
     minio_client = MinioClient()
@@ -286,54 +338,133 @@ def addEmbedding(collection_name: str,
     logger.info('start init ElasticKeywordsSearch')
     es_client = decide_vectorstores(index_name, 'ElasticKeywordsSearch', embeddings)
 
+    # 获取文档总结标题的llm, 所有文件共用
+    llm, llm_error = None, None
+    try:
+        llm = decide_knowledge_llm()
+    except Exception as e:
+        logger.exception('knowledge_llm_error:')
+        llm_error = Exception(f'文档知识库总结模型已失效，请前往模型管理-系统模型设置中进行配置。{str(e)}')
+
+    text_splitter = ElemCharacterTextSplitter(separators=separator,
+                                              separator_rule=separator_rule,
+                                              chunk_size=chunk_size,
+                                              chunk_overlap=chunk_overlap,
+                                              is_separator_regex=True)
+    parse_cache = get_parse_cache()
+    split_params = get_split_params(separator, separator_rule, chunk_size, chunk_overlap)
+
+    def download_stage(task: FileIngestTask) -> FileIngestTask:
+        logger.info(f'process_file_begin file_id={task.db_file.id} file_name={task.db_file.file_name}')
+        task.filepath = download_knowledge_file(minio_client, task.db_file)
+        if not vector_client:
+            raise ValueError('vector db not found, please check your milvus config')
+        if not es_client:
+            raise ValueError('es not found, please check your es config')
+        return task
+
+    def parse_stage(task: FileIngestTask) -> FileIngestTask:
+        # 预览时已经解析过的文件会命中解析缓存, 同时恢复uns转换后的pdf文件
+        file_md5 = parse_cache.file_md5(task.filepath)
+        task.documents, task.parse_type, task.partitions = load_file_documents(
+            task.filepath, task.db_file.file_name, file_md5)
+
+        # 用户预览编辑过的分块直接入库, 不需要再总结标题和切分
+        if task.preview_cache_key:
+            preview_chunks = KnowledgeUtils.get_preview_chunks(task.preview_cache_key)
+            if preview_chunks:
+                logger.info(f'get_preview_cache file={task.db_file.id} file_name={task.db_file.file_name}')
+                task.texts, task.metadatas = preview_chunks
+                task.chunks_ready = True
+                return task
+
+        task.chunk_cache_key = parse_cache.chunk_key(
+            parse_cache.parse_key(file_md5, task.db_file.file_name, get_parse_params()), split_params)
+        cached_chunks = parse_cache.get(task.chunk_cache_key)
+        if cached_chunks:
+            logger.info(f'get_parse_cache file={task.db_file.id} file_name={task.db_file.file_name}')
+            task.texts, task.metadatas = restore_cached_chunks(cached_chunks, task.db_file.file_name)
+            task.chunks_ready = True
+        return task
+
+    def title_stage(task: FileIngestTask) -> FileIngestTask:
+        if task.chunks_ready:
+            return task
+        if llm_error:
+            raise llm_error
+        extract_documents_title(llm, task.documents, task.db_file.file_name)
+        return task
+
+    def split_stage(task: FileIngestTask) -> FileIngestTask:
+        if task.chunks_ready:
+            texts, metadatas = task.texts, task.metadatas
+        else:
+            texts, metadatas = split_file_documents(text_splitter, task.documents,
+                                                    task.db_file.file_name)
+            parse_cache.set(task.chunk_cache_key, {'texts': texts, 'metadatas': metadatas})
+        task.texts, task.metadatas = prepare_file_chunks(minio_client, task.db_file, task.filepath,
+                                                         texts, metadatas, task.parse_type,
+                                                         task.partitions, extra_meta)
+        # 解析后的原始内容不再需要, 释放内存
+        task.documents = []
+        task.partitions = []
+        return task
+
+    def embed_stage(task: FileIngestTask) -> FileIngestTask:
+        logger.info(f'embed_texts file={task.db_file.id} file_name={task.db_file.file_name}')
+        task.vectors = embeddings.embed_documents(task.texts)
+        return task
+
+    def store_stage(task: FileIngestTask) -> FileIngestTask:
+        add_text_into_vector(vector_client, es_client, task.db_file, task.texts, task.metadatas,
+                             vectors=task.vectors)
+        logger.info(f'add_complete file={task.db_file.id} file_name={task.db_file.file_name}')
+        if task.preview_cache_key:
+            KnowledgeUtils.delete_preview_cache(task.preview_cache_key)
+        return task
+
+    def on_file_done(task: FileIngestTask, error: Optional[Exception]):
+        db_file = task.db_file
+        if error is None:
+            db_file.status = KnowledgeFileStatus.SUCCESS.value
+        else:
+            logger.error(f'process_file_fail file_id={db_file.id} file_name={db_file.file_name}')
+            db_file.status = KnowledgeFileStatus.FAILED.value
+            db_file.remark = str(error)[:500]
+        logger.info(f'process_file_end file_id={db_file.id} file_name={db_file.file_name}')
+        KnowledgeFileDao.update(db_file)
+        if callback:
+            inp = {
+                'file_name': db_file.file_name,
+                'file_status': db_file.status,
+                'file_id': db_file.id,
+                'error_msg': db_file.remark
+            }
+            requests.post(url=callback, json=inp, timeout=3)
+
+    tasks = []
     for index, db_file in enumerate(knowledge_files):
         # 尝试从缓存中获取文件的分块
         preview_cache_key = None
         if preview_cache_keys:
             preview_cache_key = preview_cache_keys[index] if index < len(
                 preview_cache_keys) else None
-        try:
-            logger.info(f'process_file_begin file_id={db_file.id} file_name={db_file.file_name}')
-            add_file_embedding(vector_client,
-                               es_client,
-                               minio_client,
-                               db_file,
-                               separator,
-                               separator_rule,
-                               chunk_size,
-                               chunk_overlap,
-                               extra_meta=extra_meta,
-                               preview_cache_key=preview_cache_key)
-            db_file.status = KnowledgeFileStatus.SUCCESS.value
-        except Exception as e:
-            logger.exception(
-                f'process_file_fail file_id={db_file.id} file_name={db_file.file_name}')
-            db_file.status = KnowledgeFileStatus.FAILED.value
-            db_file.remark = str(e)[:500]
-        finally:
-            logger.info(f'process_file_end file_id={db_file.id} file_name={db_file.file_name}')
-            KnowledgeFileDao.update(db_file)
-            if callback:
-                inp = {
-                    'file_name': db_file.file_name,
-                    'file_status': db_file.status,
-                    'file_id': db_file.id,
-                    'error_msg': db_file.remark
-                }
-                requests.post(url=callback, json=inp, timeout=3)
-
-
-def add_file_embedding(vector_client,
-                       es_client,
-                       minio_client,
-                       db_file: KnowledgeFile,
-                       separator: List[str],
-                       separator_rule: List[str],
-                       chunk_size: int,
-                       chunk_overlap: int,
-                       extra_meta: str = None,
-                       preview_cache_key: str = None):
-    # download original file
+        tasks.append(FileIngestTask(db_file, preview_cache_key))
+
+    pipeline_conf = get_ingest_pipeline_conf()
+    # 阶段并发数不超过文件数
+    max_workers = max(1, len(tasks))
+    stages = [
+        PipelineStage(name, func, workers=min(pipeline_conf.get(name, 1), max_workers))
+        for name, func in [('download', download_stage), ('parse', parse_stage),
+                           ('title', title_stage), ('split', split_stage), ('embed', embed_stage),
+                           ('store', store_stage)]
+    ]
+    StagePipeline(stages, on_done=on_file_done, thread_name_prefix='ingest').run(tasks)
+
+
+def download_knowledge_file(minio_client, db_file: KnowledgeFile) -> str:
+    """ 下载知识库文件的原始文件, 返回本地路径 """
     logger.info(f'start download original file={db_file.id} file_name={db_file.file_name}')
     if db_file.object_name.startswith('tmp'):
         file_url = minio_client.get_share_link(db_file.object_name, minio_client.tmp_bucket)
@@ -348,16 +479,19 @@ def add_file_embedding(vector_client,
     else:
         file_url = minio_client.get_share_link(db_file.object_name)
         filepath, _ = file_download(file_url)
-
-    if not vector_client:
-        raise ValueError('vector db not found, please check your milvus config')
-    if not es_client:
-        raise ValueError('es not found, please check your es config')
-
-    # extract text from file
-    texts, metadatas, parse_type, partitions = read_chunk_text(filepath, db_file.file_name,
-                                                               separator, separator_rule,
-                                                               chunk_size, chunk_overlap)
+    return filepath
+
+
+def prepare_file_chunks(minio_client,
+                        db_file: KnowledgeFile,
+                        filepath: str,
+                        texts: List[str],
+                        metadatas: List[dict],
+                        parse_type: str,
+                        partitions: Any,
+                        extra_meta: str = None,
+                        preview_cache_key: str = None) -> (List[str], List[dict]):
+    """ 处理切分后的分块: 使用预览缓存、校验长度、拼接元数据, 并上传溯源需要的文件 """
     if len(texts) == 0:
         raise ValueError('文件解析为空')
     # 缓存中有数据则用缓存中的数据去入库，因为是用户在界面编辑过的
@@ -393,25 +527,53 @@ def add_file_embedding(vector_client,
             'knowledge_id': f'{db_file.knowledge_id}',
             'extra': extra_meta or ''
         })
+    return texts, metadatas
 
-    logger.info(f'add_vectordb file={db_file.id} file_name={db_file.file_name}')
-    # 存入milvus
-    vector_client.add_texts(texts=texts, metadatas=metadatas)
 
-    logger.info(f'add_es file={db_file.id} file_name={db_file.file_name}')
-    # 存入es
-    es_client.add_texts(texts=texts, metadatas=metadatas)
+def add_file_embedding(vector_client,
+                       es_client,
+                       minio_client,
+                       db_file: KnowledgeFile,
+                       separator: List[str],
+                       separator_rule: List[str],
+                       chunk_size: int,
+                       chunk_overlap: int,
+                       extra_meta: str = None,
+                       preview_cache_key: str = None):
+    # download original file
+    filepath = download_knowledge_file(minio_client, db_file)
+
+    if not vector_client:
+        raise ValueError('vector db not found, please check your milvus config')
+    if not es_client:
+        raise ValueError('es not found, please check your es config')
+
+    # extract text from file
+    texts, metadatas, parse_type, partitions = read_chunk_text(filepath, db_file.file_name,
+                                                               separator, separator_rule,
+                                                               chunk_size, chunk_overlap)
+    texts, metadatas = prepare_file_chunks(minio_client, db_file, filepath, texts, metadatas,
+                                           parse_type, partitions, extra_meta, preview_cache_key)
+
+    add_text_into_vector(vector_client, es_client, db_file, texts, metadatas)
 
     logger.info(f'add_complete file={db_file.id} file_name={db_file.file_name}')
     if preview_cache_key:
         KnowledgeUtils.delete_preview_cache(preview_cache_key)
 
 
-def add_text_into_vector(vector_client, es_client, db_file: KnowledgeFile, texts: List[str],
-                         metadatas: List[dict]):
+def add_text_into_vector(vector_client,
+                         es_client,
+                         db_file: KnowledgeFile,
+                         texts: List[str],
+                         metadatas: List[dict],
+                         vectors: List[List[float]] = None):
     logger.info(f'add_vectordb file={db_file.id} file_name={db_file.file_name}')
-    # 存入milvus
-    vector_client.add_texts(texts=texts, metadatas=metadatas)
+    # 存入milvus, 已经向量化过的不再重复向量化
+    if vectors is not None:
+        vector_client.add_texts(texts=texts, metadatas=metadatas, embeddings=vectors)
+    else:
+        vector_client.add_texts(texts=texts, metadatas=metadatas)
 
     logger.info(f'add_es file={db_file.id} file_name={db_file.file_name}')
     # 存入es
@@ -457,7 +619,82 @@ def read_chunk_text(input_file, file_name, separator: List[str], separator_rule:
                                               chunk_size=chunk_size,
                                               chunk_overlap=chunk_overlap,
                                               is_separator_regex=True)
-    # 加载文档内容
+    parse_cache = get_parse_cache()
+    file_md5 = parse_cache.file_md5(input_file)
+    documents, parse_type, partitions = load_file_documents(input_file, file_name, file_md5)
+
+    chunk_key = parse_cache.chunk_key(parse_cache.parse_key(file_md5, file_name, get_parse_params()),
+                                      get_split_params(separator, separator_rule, chunk_size, chunk_overlap))
+    cached_chunks = parse_cache.get(chunk_key)
+    if cached_chunks:
+        logger.info(f'get_parse_cache file_name={file_name}')
+        raw_texts, metadatas = restore_cached_chunks(cached_chunks, file_name)
+        return raw_texts, metadatas, parse_type, partitions
+
+    extract_documents_title(llm, documents, file_name)
+    raw_texts, metadatas = split_file_documents(text_splitter, documents, file_name)
+    parse_cache.set(chunk_key, {'texts': raw_texts, 'metadatas': metadatas})
+    return raw_texts, metadatas, parse_type, partitions
+
+
+def get_parse_params() -> dict:
+    """ 影响文件解析结果的参数 """
+    return {'unstructured_api_url': settings.get_knowledge().get('unstructured_api_url') or ''}
+
+
+def get_split_params(separator: List[str], separator_rule: List[str], chunk_size: int,
+                     chunk_overlap: int) -> dict:
+    """ 影响切分结果的参数, 总结的标题会写入分块的metadata, 影响标题的模型、提示词和截断长度也需要作为参数 """
+    return {
+        'separator': separator,
+        'separator_rule': separator_rule,
+        'chunk_size': chunk_size,
+        'chunk_overlap': chunk_overlap,
+        'title_model_id': LLMService.get_knowledge_llm().extract_title_model_id,
+        'title_prompt_version': title_extract_prompt_version,
+        'title_max_tokens': get_title_extract_conf()['max_tokens'],
+    }
+
+
+def restore_cached_chunks(cached_chunks: dict, file_name: str) -> (List[str], List[dict]):
+    """ 缓存的分块可能来自同内容但不同名的文件, 需要替换metadata中的文件名 """
+    metadatas = cached_chunks['metadatas']
+    for metadata in metadatas:
+        metadata['source'] = file_name
+    return cached_chunks['texts'], metadatas
+
+
+def load_file_documents(input_file, file_name, file_md5: str = None) -> (List[Document], str, Any):
+    """ 加载文档内容, 返回 documents, parse_type, partitions, 相同内容和解析参数的文件只解析一次 """
+    parse_cache = get_parse_cache()
+    if file_md5 is None:
+        file_md5 = parse_cache.file_md5(input_file)
+    parse_key = parse_cache.parse_key(file_md5, file_name, get_parse_params())
+    cached = parse_cache.get(parse_key)
+    if cached:
+        logger.info(f'get_parse_cache file_name={file_name}')
+        # uns解析时会把文件转为pdf, 溯源依赖转换后的文件
+        if cached['converted_file'] is not None:
+            with open(input_file, 'wb') as f:
+                f.write(cached['converted_file'])
+        return cached['documents'], cached['parse_type'], cached['partitions']
+
+    documents, parse_type, partitions = parse_file_documents(input_file, file_name)
+    converted_file = None
+    if parse_type == ParseType.UNS.value and parse_cache.file_md5(input_file) != file_md5:
+        with open(input_file, 'rb') as f:
+            converted_file = f.read()
+    parse_cache.set(parse_key, {
+        'documents': documents,
+        'parse_type': parse_type,
+        'partitions': partitions,
+        'converted_file': converted_file,
+    })
+    return documents, parse_type, partitions
+
+
+def parse_file_documents(input_file, file_name) -> (List[Document], str, Any):
+    """ 解析文档内容, 返回 documents, parse_type, partitions """
     logger.info(f'start_file_loader file_name={file_name}')
     parse_type = ParseType.LOCAL.value
     # excel 文件的处理单独出来
@@ -477,18 +714,100 @@ def read_chunk_text(input_file, file_name, separator: List[str], separator_rule:
         parse_type = ParseType.UNS.value
         partitions = loader.partitions
         partitions = parse_partitions(partitions)
+    return documents, parse_type, partitions
+
+
+# 总结标题的默认配置, 可通过知识库配置中的 title_extract 覆盖
+default_title_extract_conf = {
+    # 同一个模型同时进行中的总结请求数, 进程内所有入库任务共享
+    'concurrency': 4,
+    # 发给模型的文档内容的最大token数
+    'max_tokens': 3000,
+}
+
+_title_semaphores: Dict[Any, threading.BoundedSemaphore] = {}
+_title_semaphores_lock = threading.Lock()
 
-    logger.info(f'start_extract_title file_name={file_name}')
-    if llm:
-        t = time.time()
-        for one in documents:
-            # 配置了相关llm的话，就对文档做总结
-            title = extract_title(llm, one.page_content)
-            # remove <think>.*</think> tag content
-            title = re.sub('<think>.*</think>', '', title, flags=re.S).strip()
-            one.metadata['title'] = title
-        logger.info('file_extract_title=success timecost={}', time.time() - t)
 
+def get_title_extract_conf() -> Dict[str, int]:
+    conf = default_title_extract_conf.copy()
+    conf.update(settings.get_knowledge().get('title_extract') or {})
+    return conf
+
+
+def get_title_semaphore(model_id: Any, concurrency: int) -> threading.BoundedSemaphore:
+    """
+    每个模型一个信号量, 限制所有文件同时调用此模型总结标题的请求数
+    并发数也作为key, 修改配置后使用新的信号量, 已在执行的请求继续使用旧的信号量
+    """
+    key = (model_id, concurrency)
+    with _title_semaphores_lock:
+        if key not in _title_semaphores:
+            _title_semaphores[key] = threading.BoundedSemaphore(max(1, concurrency))
+        return _title_semaphores[key]
+
+
+@lru_cache(maxsize=1)
+def get_title_tokenizer():
+    return AssistantUtils.cl100k_base()
+
+
+def truncate_title_context(text: str, max_tokens: int) -> str:
+    """ 按token数截断文档内容, 避免拼上提示词后超出模型的上下文长度 """
+    # 平均一个token不超过4个字符, 先按字符粗略截断, 减少需要编码的内容
+    text = text[:max_tokens * 4]
+    tokens = get_title_tokenizer().encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    context = get_title_tokenizer().decode(tokens[:max_tokens])
+    # 截断位置可能落在多字节字符中间, 去掉解码出的替换字符
+    return context.rstrip('\ufffd')
+
+
+def extract_document_title(llm, text: str, model_id: Any, conf: Dict[str, int]) -> str:
+    """ 总结单个文档的标题, 结果按 模型ID + 提示词版本 + 内容 缓存 """
+    context = truncate_title_context(text, conf['max_tokens'])
+    title_cache = get_title_cache()
+    cache_key = None
+    if model_id is not None:
+        cache_key = title_cache.make_key(model_id, title_extract_prompt_version, context)
+        title = title_cache.get(cache_key)
+        if title is not None:
+            return title
+
+    with get_title_semaphore(model_id, conf['concurrency']):
+        title = extract_title(llm, context, max_length=len(context))
+    # remove <think>.*</think> tag content
+    title = re.sub('<think>.*</think>', '', title, flags=re.S).strip()
+    if cache_key:
+        title_cache.set(cache_key, title)
+    return title
+
+
+def extract_documents_title(llm, documents: List[Document], file_name: str):
+    """ 配置了相关llm的话，就对文档做总结, 结果写入 metadata['title'] """
+    logger.info(f'start_extract_title file_name={file_name}')
+    if not llm:
+        return
+    t = time.time()
+    conf = get_title_extract_conf()
+    model_id = getattr(llm, 'model_id', None)
+    if len(documents) <= 1:
+        titles = [extract_document_title(llm, one.page_content, model_id, conf) for one in documents]
+    else:
+        # 同一个文件的多个文档并发总结, 并发数同样受模型的信号量限制
+        with ThreadPoolExecutor(max_workers=min(len(documents), max(1, conf['concurrency'])),
+                                thread_name_prefix='extract_title') as executor:
+            titles = list(executor.map(
+                lambda one: extract_document_title(llm, one.page_content, model_id, conf), documents))
+    for one, title in zip(documents, titles):
+        one.metadata['title'] = title
+    logger.info('file_extract_title=success timecost={}', time.time() - t)
+
+
+def split_file_documents(text_splitter, documents: List[Document],
+                         file_name: str) -> (List[str], List[dict]):
+    """ 切分文档, 返回分块文本和对应的metadata """
     logger.info(f'start_split_text file_name={file_name}')
     texts = text_splitter.split_documents(documents)
     raw_texts = [t.page_content for t in texts]
@@ -509,7 +828,7 @@ def read_chunk_text(input_file, file_name, separator: List[str], separator_rule:
         ''
     } for t_index, t in enumerate(texts)]
     logger.info(f'file_chunk_over file_name=={file_name}')
-    return raw_texts, metadatas, parse_type, partitions
+    return raw_texts, metadatas
 
 
 def text_knowledge(db_knowledge: Knowledge, db_file: KnowledgeFile, documents: List[Document]):
@@ -1,5 +1,5 @@
 import json
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from fastapi import Request
 from langchain_core.embeddings import Embeddings
@@ -11,10 +11,13 @@ from bisheng.api.errcode.llm import ServerExistError, ModelNameRepeatError, Serv
 from bisheng.api.services.user_service import UserPayload
 from bisheng.api.v1.schemas import LLMServerInfo, LLMModelInfo, KnowledgeLLMConfig, AssistantLLMConfig, \
     EvaluationLLMConfig, AssistantLLMItem, LLMServerCreateReq
+from bisheng.cache.embedding import get_embedding_cache
 from bisheng.database.models.config import ConfigDao, ConfigKeyEnum, Config
 from bisheng.database.models.llm_server import LLMDao, LLMServer, LLMModel, LLMModelType
 from bisheng.interface.importing import import_by_type
 from bisheng.interface.initialize.loading import instantiate_llm, instantiate_embedding
+from bisheng.interface.model_health import model_health_tracker
+from bisheng.interface.model_registry import model_registry
 
 
 class LLMService:
@@ -98,6 +101,7 @@ class LLMService:
             # 部分模型添加成功了, 删除失败的模型信息
             ret.models = success_models
             LLMDao.delete_model_by_ids(model_ids=[one.id for one in failed_models])
+            model_registry.invalidate()
             cls.add_llm_server_hook(request, login_user, ret)
             raise ServerAddError.http_exception(f"<{success_msg.rstrip(',')}>添加成功，{failed_msg}")
 
@@ -108,6 +112,7 @@ class LLMService:
     def delete_llm_server(cls, request: Request, login_user: UserPayload, server_id: int) -> bool:
         """ 删除一个服务提供方 """
         LLMDao.delete_server_by_id(server_id)
+        model_registry.invalidate()
         return True
 
     @classmethod
@@ -129,6 +134,7 @@ class LLMService:
 
     @classmethod
     def test_model_status(cls, model: LLMModel | LLMModelInfo):
+        status, remark = 0, ''
         try:
             if model.model_type == LLMModelType.LLM.value:
                 bisheng_model = cls.get_bisheng_llm(model_id=model.id, ignore_online=True, cache=False)
@@ -137,8 +143,10 @@ class LLMService:
                 bisheng_embed = cls.get_bisheng_embedding(model_id=model.id, ignore_online=True, cache=False)
                 bisheng_embed.embed_query('hello')
         except Exception as e:
-            LLMDao.update_model_status(model.id, 1, str(e))
+            status, remark = 1, str(e)
             logger.exception(f'test model status: {model.id} {model.model_name}')
+        # 测试结果立即写入数据库, 之前的调用统计不再参与计算模型状态
+        model_health_tracker.set_status(model.id, status, remark)
 
     @classmethod
     def set_default_model(cls, request: Request, login_user: UserPayload, model: LLMModel):
@@ -222,6 +230,7 @@ class LLMService:
         exist_server.config = server.config
 
         db_server = LLMDao.update_server_with_models(exist_server, list(model_dict.values()))
+        model_registry.invalidate()
         new_server_info = cls.get_one_llm(request, login_user, db_server.id)
 
         # 判断是否需要重新判断模型状态
@@ -241,6 +250,7 @@ class LLMService:
             raise NotFoundError.http_exception()
         exist_model.online = online
         LLMDao.update_model_online(exist_model.id, online)
+        model_registry.invalidate()
         return LLMModelInfo(**exist_model.dict())
 
     @classmethod
@@ -340,6 +350,16 @@ class LLMService:
         class_object = import_by_type(_type='embeddings', name='BishengEmbedding')
         return instantiate_embedding(class_object, kwargs)
 
+    @classmethod
+    def get_embedding_cache_stats(cls) -> Dict:
+        """ 获取embedding结果缓存的命中统计 """
+        return get_embedding_cache().get_stats()
+
+    @classmethod
+    def get_model_health(cls, model_id: Optional[int] = None) -> Dict:
+        """ 获取模型最近调用的错误率和耗时统计, 汇总了所有进程的数据 """
+        return model_health_tracker.get_stats(model_id)
+
     @classmethod
     def update_evaluation_llm(cls, request: Request, login_user: UserPayload, data: EvaluationLLMConfig) \
             -> EvaluationLLMConfig:
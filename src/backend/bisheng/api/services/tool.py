@@ -95,7 +95,7 @@ class ToolServices(BaseModel):
             # 实例化mcp服务对象，获取工具列表
             client = await ClientManager.connect_mcp_from_json(result)
 
-            tools = await client.list_tools()
+            tools = await client.list_tools(use_cache=False)
 
             for one in tools:
                 tool_type.children.append(GptsTools(
@@ -138,7 +138,7 @@ class ToolServices(BaseModel):
         # 1. get all new tools
         # 实例化mcp服务对象，获取工具列表
         client = await ClientManager.connect_mcp_from_json(tool_type.openapi_schema)
-        tools = await client.list_tools()
+        tools = await client.list_tools(use_cache=False)
         new_tools = {}
         for one in tools:
             tool_key = GptsToolsDao.get_tool_key(tool_type.id, md5_hash(one.name))
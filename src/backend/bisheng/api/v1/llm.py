@@ -50,6 +50,21 @@ def update_model_online(request: Request, login_user: UserPayload = Depends(get_
     return resp_200(data=ret)
 
 
+@router.get('/embedding/cache')
+def get_embedding_cache_stats(request: Request, login_user: UserPayload = Depends(get_admin_user)):
+    """ 当前进程内embedding缓存的命中统计 """
+    ret = LLMService.get_embedding_cache_stats()
+    return resp_200(data=ret)
+
+
+@router.get('/health')
+def get_model_health(request: Request, login_user: UserPayload = Depends(get_admin_user),
+                     model_id: int = Query(default=None, description='模型的唯一ID')):
+    """ 模型最近调用的错误率和p50/p95耗时 """
+    ret = LLMService.get_model_health(model_id)
+    return resp_200(data=ret)
+
+
 @router.get('/knowledge')
 def get_knowledge_llm(request: Request, login_user: UserPayload = Depends(get_login_user)):
     ret = LLMService.get_knowledge_llm()
@@ -11,7 +11,7 @@ from bisheng.api.v2.utils import get_default_operator
 from bisheng.chat.types import WorkType
 from bisheng.database.models.flow import FlowDao, FlowType
 from bisheng.worker.workflow.redis_callback import RedisCallback
-from bisheng.worker.workflow.tasks import execute_workflow
+from bisheng.worker.workflow.tasks import continue_workflow, execute_workflow
 from bisheng.workflow.common.workflow import WorkflowStatus
 from fastapi import APIRouter, Request, Body, Path, WebSocket, WebSocketException
 from fastapi import status as http_status
@@ -63,6 +63,9 @@ async def invoke_workflow(request: Request,
         if status_info['status'] == WorkflowStatus.INPUT.value and user_input:
             workflow.set_user_input(user_input, message_id)
             workflow.set_workflow_status(WorkflowStatus.INPUT_OVER.value)
+            # workflow 已暂停释放了执行任务, 需要发起新的任务恢复执行
+            if workflow.has_workflow_checkpoint():
+                continue_workflow.delay(unique_id, workflow_id, chat_id, str(login_user.user_id))
 
     logger.debug(f'waiting workflow over or input: {workflow_id}, {session_id}')
     async def handle_workflow_event(event_list: List):
@@ -0,0 +1,165 @@
+import hashlib
+import threading
+from array import array
+from typing import Callable, Dict, List, Optional, Union
+
+from cachetools import TTLCache
+from loguru import logger
+
+
+class EmbeddingCache:
+    """
+    embedding 结果缓存, key 为 模型标识 + 原始文本的hash
+    不对文本做归一化, 归一化后相同但原文不同的文本向量可能不同, 不能共用缓存
+    两级缓存: 进程内的LRU缓存 + redis共享缓存, 只把未命中的文本发给模型服务
+    向量以 array('d') 紧凑存储, 每个维度占8字节, 取出时和模型返回的结果完全一致
+    进程内缓存按字节数限制大小, redis缓存只靠过期时间回收, 内存上限由redis的 maxmemory 策略控制
+    """
+
+    key_prefix = 'embedding_cache'
+
+    def __init__(self,
+                 local_max_bytes: int = 64 * 1024 * 1024,
+                 local_ttl: int = 3600,
+                 redis_ttl: int = 7 * 24 * 3600,
+                 enabled: bool = True):
+        self.enabled = enabled
+        self.redis_ttl = redis_ttl
+        self._local = TTLCache(maxsize=local_max_bytes, ttl=local_ttl, getsizeof=self._vector_bytes)
+        self._lock = threading.Lock()
+        self._stats = {'local_hits': 0, 'redis_hits': 0, 'misses': 0}
+
+    @staticmethod
+    def _vector_bytes(value: array) -> int:
+        return len(value) * value.itemsize
+
+    @staticmethod
+    def _to_array(value: Union[bytes, List[float]]) -> array:
+        vector = array('d')
+        if isinstance(value, bytes):
+            vector.frombytes(value)
+        else:
+            # 兼容之前以list存储的缓存
+            vector.extend(value)
+        return vector
+
+    def _local_set(self, key: str, value: array):
+        try:
+            self._local[key] = value
+        except ValueError:
+            # 单个向量超过进程内缓存的大小上限, 只存redis
+            pass
+
+    @classmethod
+    def make_key(cls, model_key: str, kind: str, text: str) -> str:
+        text_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return f'{cls.key_prefix}:{model_key}:{kind}:{text_hash}'
+
+    def _incr(self, name: str, count: int):
+        if count:
+            with self._lock:
+                self._stats[name] += count
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['local_size'] = len(self._local)
+            stats['local_bytes'] = self._local.currsize
+        total = stats['local_hits'] + stats['redis_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['local_hits'] + stats['redis_hits']) / total, 4) if total else 0
+        return stats
+
+    def mget(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """ 批量获取缓存, 先查进程内缓存, 未命中的再批量查redis """
+        from bisheng.cache.redis import redis_client
+
+        result: List[Optional[List[float]]] = [None] * len(keys)
+        redis_index = []
+        with self._lock:
+            for index, key in enumerate(keys):
+                value = self._local.get(key)
+                if value is not None:
+                    result[index] = value.tolist()
+                else:
+                    redis_index.append(index)
+        self._incr('local_hits', len(keys) - len(redis_index))
+        if not redis_index:
+            return result
+
+        try:
+            redis_values = redis_client.mget([keys[index] for index in redis_index])
+        except Exception as e:
+            logger.warning(f'embedding_cache redis mget error: {e}')
+            redis_values = [None] * len(redis_index)
+
+        redis_hits = 0
+        with self._lock:
+            for index, value in zip(redis_index, redis_values):
+                if value is not None:
+                    vector = self._to_array(value)
+                    result[index] = vector.tolist()
+                    self._local_set(keys[index], vector)
+                    redis_hits += 1
+        self._incr('redis_hits', redis_hits)
+        self._incr('misses', len(redis_index) - redis_hits)
+        return result
+
+    def mset(self, mapping: Dict[str, List[float]]):
+        from bisheng.cache.redis import redis_client
+
+        if not mapping:
+            return
+        vectors = {key: array('d', value) for key, value in mapping.items()}
+        with self._lock:
+            for key, vector in vectors.items():
+                self._local_set(key, vector)
+        try:
+            redis_client.mset({key: vector.tobytes() for key, vector in vectors.items()},
+                              expiration=self.redis_ttl)
+        except Exception as e:
+            logger.warning(f'embedding_cache redis mset error: {e}')
+
+    def embed_with_cache(self, model_key: str, kind: str, texts: List[str],
+                         embed_func: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """ 只把缓存未命中的文本交给 embed_func, 结果按照原始顺序返回 """
+        # 空文本会被部分模型过滤掉, 导致结果无法和输入一一对应, 这种情况不走缓存
+        if not self.enabled or not texts or not all(texts):
+            return embed_func(texts)
+
+        keys = [self.make_key(model_key, kind, text) for text in texts]
+        result = self.mget(keys)
+        # 同一批次内重复的文本只计算一次
+        miss_keys: Dict[str, str] = {}
+        for index, value in enumerate(result):
+            if value is None and keys[index] not in miss_keys:
+                miss_keys[keys[index]] = texts[index]
+        if miss_keys:
+            miss_values = embed_func(list(miss_keys.values()))
+            if len(miss_values) != len(miss_keys):
+                raise ValueError(f'embedding result size {len(miss_values)} not match '
+                                 f'input size {len(miss_keys)}')
+            new_values = dict(zip(miss_keys.keys(), miss_values))
+            self.mset(new_values)
+            result = [value if value is not None else new_values[keys[index]]
+                      for index, value in enumerate(result)]
+        return result
+
+
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """ 首次使用时才读取配置创建缓存, 避免模块导入时访问数据库 """
+    global _embedding_cache
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                from bisheng.settings import settings
+                try:
+                    conf = settings.get_knowledge().get('embedding_cache') or {}
+                except Exception as e:
+                    logger.warning(f'load embedding_cache config error: {e}')
+                    conf = {}
+                _embedding_cache = EmbeddingCache(**conf)
+    return _embedding_cache
@@ -0,0 +1,126 @@
+import base64
+import hashlib
+import json
+import threading
+from typing import Any, Dict, Optional
+
+from langchain.schema.document import Document
+from loguru import logger
+
+
+def _json_default(value: Any) -> Dict:
+    if isinstance(value, Document):
+        return {'__document__': {'page_content': value.page_content, 'metadata': value.metadata}}
+    if isinstance(value, bytes):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    raise TypeError(f'file_parse_cache can not serialize {type(value).__name__}')
+
+
+def _json_object_hook(value: Dict) -> Any:
+    if '__document__' in value:
+        return Document(**value['__document__'])
+    if '__bytes__' in value:
+        return base64.b64decode(value['__bytes__'])
+    return value
+
+
+def _dumps(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, default=_json_default).encode('utf-8')
+
+
+def _loads(data: bytes) -> Any:
+    return json.loads(data, object_hook=_json_object_hook)
+
+
+class FileParseCache:
+    """
+    文件解析结果缓存, 以文件内容的md5为key, 同一个文件在预览和入库、上传到多个知识库时只解析一次
+    1. 解析结果: key 为 文件md5 + 解析参数, 内容为解析出的documents、parse_type、partitions和转换后的pdf
+    2. 切分结果: key 为 解析结果的key + 切分参数 + 总结标题的模型, 内容为分块文本和metadata
+    序列化后小于 redis_max_size 字节的结果直接存redis, 更大的结果存到minio, redis只保存对象名
+    缓存内容使用json序列化, Document 和 bytes 转为带标记的字典, 读取缓存时不会执行任何代码
+    """
+
+    key_prefix = 'file_parse_cache_json'
+    object_prefix = 'documents/parse_cache_json'
+
+    def __init__(self, enabled: bool = True, ttl: int = 7 * 24 * 3600, redis_max_size: int = 1024 * 1024):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.redis_max_size = redis_max_size
+
+    @classmethod
+    def file_md5(cls, file_path: str) -> str:
+        md5 = hashlib.md5()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                md5.update(block)
+        return md5.hexdigest()
+
+    @classmethod
+    def _hash_params(cls, params: dict) -> str:
+        return hashlib.md5(json.dumps(params, sort_keys=True, ensure_ascii=False,
+                                      default=str).encode('utf-8')).hexdigest()
+
+    def parse_key(self, file_md5: str, file_name: str, parse_params: dict) -> str:
+        file_type = file_name.rsplit('.', 1)[-1].lower()
+        return f'{self.key_prefix}:parse:{file_md5}:{file_type}:{self._hash_params(parse_params)}'
+
+    def chunk_key(self, parse_key: str, split_params: dict) -> str:
+        return f'{parse_key}:chunk:{self._hash_params(split_params)}'
+
+    def get(self, key: str) -> Optional[Any]:
+        if not self.enabled or not key:
+            return None
+        from bisheng.cache.redis import redis_client
+        try:
+            # 直接读写原始的字节, 不经过 redis_client 的pickle序列化
+            value = redis_client.connection.get(key)
+            if value is None:
+                return None
+            value = _loads(value)
+            if value.get('object_name'):
+                from bisheng.utils.minio_client import MinioClient
+                minio_client = MinioClient()
+                return _loads(minio_client.get_object(minio_client.tmp_bucket, value['object_name']))
+            return value['data']
+        except Exception as e:
+            # minio中的对象可能已经过期, 作为未命中处理
+            logger.warning(f'file_parse_cache get error key={key} error={e}')
+            return None
+
+    def set(self, key: str, value: Any):
+        if not self.enabled or not key:
+            return
+        from bisheng.cache.redis import redis_client
+        try:
+            data = _dumps(value)
+            if len(data) <= self.redis_max_size:
+                redis_client.connection.set(key, b'{"data": ' + data + b'}', ex=self.ttl)
+                return
+            from bisheng.utils.minio_client import MinioClient
+            object_name = f"{self.object_prefix}/{hashlib.md5(key.encode('utf-8')).hexdigest()}.json"
+            MinioClient().upload_tmp(object_name, data)
+            redis_client.connection.set(key, _dumps({'object_name': object_name}), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f'file_parse_cache set error key={key} error={e}')
+
+
+_parse_cache: Optional[FileParseCache] = None
+_parse_cache_lock = threading.Lock()
+
+
+def get_parse_cache() -> FileParseCache:
+    """ 首次使用时才读取配置创建缓存, 避免模块导入时访问数据库 """
+    global _parse_cache
+    if _parse_cache is None:
+        with _parse_cache_lock:
+            if _parse_cache is None:
+                from bisheng.settings import settings
+                try:
+                    conf = settings.get_knowledge().get('parse_cache') or {}
+                except Exception as e:
+                    logger.warning(f'load parse_cache config error: {e}')
+                    conf = {}
+                _parse_cache = FileParseCache(**conf)
+    return _parse_cache
@@ -1,89 +1,131 @@
+import asyncio
 import pickle
-from typing import Dict, Optional
+import weakref
+from typing import Any, Dict, List, Optional
 
 import redis
+import redis.asyncio as aioredis
 from bisheng.settings import settings
-from loguru import logger
 from redis import ConnectionPool, RedisCluster
+from redis.asyncio.cluster import ClusterNode as AsyncClusterNode
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.asyncio.sentinel import Sentinel as AsyncSentinel
 from redis.backoff import ExponentialBackoff
 from redis.cluster import ClusterNode
 from redis.retry import Retry
 from redis.sentinel import Sentinel
 
 
+def _parse_redis_conf(redis_url) -> (str, Dict):
+    """
+    解析redis配置
+    return: 模式(standalone, cluster, sentinel), 模式对应的连接参数
+    """
+    if not isinstance(redis_url, Dict):
+        return 'standalone', {}
+    redis_conf = dict(redis_url)
+    mode = redis_conf.pop('mode', 'sentinel')
+    if mode == 'cluster':
+        cluster_url = ''
+        startup_nodes = None
+        if 'startup_nodes' in redis_conf:
+            startup_nodes = redis_conf.pop('startup_nodes')
+            first_node = startup_nodes[0]
+            cluster_url = f'redis://{first_node["host"]}:{first_node["port"]}'
+        return mode, {'cluster_url': cluster_url, 'startup_nodes': startup_nodes, 'conf': redis_conf}
+    return 'sentinel', {
+        'hosts': [eval(x) for x in redis_conf.pop('sentinel_hosts')],
+        'password': redis_conf.pop('sentinel_password'),
+        'master': redis_conf.pop('sentinel_master'),
+        'conf': redis_conf,
+    }
+
+
+def _dumps(value: Any) -> bytes:
+    try:
+        return pickle.dumps(value)
+    except TypeError as exc:
+        raise TypeError('RedisCache only accepts values that can be pickled. ') from exc
+
+
+def _loads(value: Optional[bytes]) -> Any:
+    return pickle.loads(value) if value else None
+
+
 class RedisClient:
+    """
+    同步redis客户端, 连接由连接池管理, 命令执行后不关闭连接
+    值统一使用pickle序列化, 带过期时间的写操作通过 SET EX 或者 pipeline 一次请求完成
+    """
 
     def __init__(self, url, max_connections=10):
-        # # 哨兵模式
-        if isinstance(settings.redis_url, Dict):
-            redis_conf = dict(settings.redis_url)
-            mode = redis_conf.pop('mode', 'sentinel')
-            if mode == 'cluster':
-                # 集群模式
-                cluster_url = ''
-                if 'startup_nodes' in redis_conf:
-                    first_node = redis_conf['startup_nodes'][0]
-                    cluster_url = f'redis://{first_node["host"]}:{first_node["port"]}'
-                    redis_conf['startup_nodes'] = [
-                        ClusterNode(node.get('host'), node.get('port'))
-                        for node in redis_conf['startup_nodes']
-                    ]
-                self.connection = RedisCluster.from_url(cluster_url, **redis_conf,
-                                                        retry=Retry(ExponentialBackoff(), 6),
-                                                        cluster_error_retry_attempts=1)
-                return
-            hosts = [eval(x) for x in redis_conf.pop('sentinel_hosts')]
-            password = redis_conf.pop('sentinel_password')
-            master = redis_conf.pop('sentinel_master')
-            sentinel = Sentinel(sentinels=hosts, socket_timeout=0.1, sentinel_kwargs={'password': password})
+        self.url = url
+        self.max_connections = max_connections
+        mode, conf = _parse_redis_conf(settings.redis_url)
+        if mode == 'cluster':
+            # 集群模式
+            startup_nodes = None
+            if conf['startup_nodes']:
+                startup_nodes = [
+                    ClusterNode(node.get('host'), node.get('port')) for node in conf['startup_nodes']
+                ]
+            self.connection = RedisCluster.from_url(conf['cluster_url'],
+                                                    startup_nodes=startup_nodes,
+                                                    **conf['conf'],
+                                                    retry=Retry(ExponentialBackoff(), 6),
+                                                    cluster_error_retry_attempts=1)
+        elif mode == 'sentinel':
+            # 哨兵模式
+            sentinel = Sentinel(sentinels=conf['hosts'], socket_timeout=0.1,
+                                sentinel_kwargs={'password': conf['password']})
             # 获取主节点的连接
-            self.connection = sentinel.master_for(master, socket_timeout=0.1, **redis_conf)
-
+            self.connection = sentinel.master_for(conf['master'], socket_timeout=0.1, **conf['conf'])
         else:
             # 单机模式
             self.pool = ConnectionPool.from_url(url, max_connections=max_connections)
             self.connection = redis.StrictRedis(connection_pool=self.pool)
 
+    def pipeline(self):
+        """ 非事务的pipeline, 用于批量命令一次发送 """
+        return self.connection.pipeline(transaction=False)
+
     def set(self, key, value, expiration=3600):
-        try:
-            if pickled := pickle.dumps(value):
-                self.cluster_nodes(key)
-                if expiration:
-                    result = self.connection.setex(key, expiration, pickled)
-                else:
-                    result = self.connection.set(key, pickled)
-                if not result:
-                    raise ValueError('RedisCache could not set the value.')
-            else:
-                logger.error('pickle error, value={}', value)
-        except TypeError as exc:
-            raise TypeError('RedisCache only accepts values that can be pickled. ') from exc
-        finally:
-            self.close()
+        self.cluster_nodes(key)
+        result = self.connection.set(key, _dumps(value), ex=expiration or None)
+        if not result:
+            raise ValueError('RedisCache could not set the value.')
 
     def setNx(self, key, value, expiration=3600):
-        try:
-            if pickled := pickle.dumps(value):
-                self.cluster_nodes(key)
-                result = self.connection.setnx(key, pickled)
-                self.connection.expire(key, expiration)
-                if not result:
-                    return False
-                return True
-        except TypeError as exc:
-            raise TypeError('RedisCache only accepts values that can be pickled. ') from exc
-        finally:
-            self.close()
+        self.cluster_nodes(key)
+        return bool(self.connection.set(key, _dumps(value), ex=expiration or None, nx=True))
+
+    def mget(self, keys: List[str]) -> List:
+        """ 批量获取, 返回值和keys一一对应, 不存在的为None """
+        if not keys:
+            return []
+        if isinstance(self.connection, RedisCluster):
+            values = self.connection.mget_nonatomic(keys)
+        else:
+            values = self.connection.mget(keys)
+        return [_loads(value) for value in values]
+
+    def mset(self, mapping: Dict, expiration=3600):
+        """ 批量设置, 通过pipeline一次请求完成 """
+        if not mapping:
+            return
+        pipe = self.pipeline()
+        for key, value in mapping.items():
+            pipe.set(key, _dumps(value), ex=expiration or None)
+        pipe.execute()
+
+    def mdelete(self, *keys) -> int:
+        """ 批量删除, 集群模式下会按照slot拆分 """
+        if not keys:
+            return 0
+        return self.connection.delete(*keys)
 
     def hsetkey(self, name, key, value, expiration=3600):
-        try:
-            self.cluster_nodes(key)
-            r = self.connection.hset(name, key, value)
-            if expiration:
-                self.connection.expire(name, expiration)
-            return r
-        finally:
-            self.close()
+        return self.hset(name, key, value, expiration=expiration)
 
     def hset(self, name,
              key: Optional[str] = None,
@@ -91,100 +133,76 @@ class RedisClient:
              mapping: Optional[dict] = None,
              items: Optional[list] = None,
              expiration: int = 3600):
-        try:
-            self.cluster_nodes(name)
-            r = self.connection.hset(name, key, value, mapping, items)
-            if expiration:
-                self.connection.expire(name, expiration)
-            return r
-        finally:
-            self.close()
+        self.cluster_nodes(name)
+        if not expiration:
+            return self.connection.hset(name, key, value, mapping, items)
+        pipe = self.pipeline()
+        pipe.hset(name, key, value, mapping, items)
+        pipe.expire(name, expiration)
+        return pipe.execute()[0]
 
     def hget(self, name, key):
-        try:
-            self.cluster_nodes(name)
-            return self.connection.hget(name, key)
-        finally:
-            self.close()
+        self.cluster_nodes(name)
+        return self.connection.hget(name, key)
 
     def hgetall(self, name):
-        try:
-            self.cluster_nodes(name)
-            return self.connection.hgetall(name)
-        finally:
-            self.close()
+        self.cluster_nodes(name)
+        return self.connection.hgetall(name)
 
     def hdel(self, name, *keys):
-        try:
-            self.cluster_nodes(name)
-            return self.connection.hdel(name, *keys)
-        finally:
-            self.close()
+        self.cluster_nodes(name)
+        return self.connection.hdel(name, *keys)
 
     def get(self, key):
-        try:
-            self.cluster_nodes(key)
-            value = self.connection.get(key)
-            return pickle.loads(value) if value else None
-        finally:
-            self.close()
+        self.cluster_nodes(key)
+        return _loads(self.connection.get(key))
+
+    def get_int(self, key) -> Optional[int]:
+        """ 读取 incr 写入的计数值, incr 写入的值没有经过pickle """
+        self.cluster_nodes(key)
+        value = self.connection.get(key)
+        return int(value) if value is not None else None
 
     def incr(self, key, expiration=3600) -> int:
-        try:
-            self.cluster_nodes(key)
-            value = self.connection.incr(key)
-            if expiration:
-                self.connection.expire(key, expiration)
-            return value
-        finally:
-            self.close()
+        self.cluster_nodes(key)
+        if not expiration:
+            return self.connection.incr(key)
+        pipe = self.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, expiration)
+        return pipe.execute()[0]
 
     def expire_key(self, key, expiration: int):
-        try:
-            self.cluster_nodes(key)
-            self.connection.expire(key, expiration)
-        finally:
-            self.close()
+        self.cluster_nodes(key)
+        self.connection.expire(key, expiration)
 
     def delete(self, key):
-        try:
-            self.cluster_nodes(key)
-            return self.connection.delete(key)
-        finally:
-            self.close()
+        self.cluster_nodes(key)
+        return self.connection.delete(key)
 
     def rpush(self, key, value, expiration=3600):
-        try:
-            self.cluster_nodes(key)
-            ret = self.connection.rpush(key, value)
-            if expiration:
-                self.expire_key(key, expiration)
-            return ret
-        finally:
-            self.close()
-
-    def lpop(self, key, count: int=None):
-        try:
-            self.cluster_nodes(key)
-            return self.connection.lpop(key, count)
-        finally:
-            self.close()
+        self.cluster_nodes(key)
+        if not expiration:
+            return self.connection.rpush(key, value)
+        pipe = self.pipeline()
+        pipe.rpush(key, value)
+        pipe.expire(key, expiration)
+        return pipe.execute()[0]
+
+    def lpop(self, key, count: int = None):
+        self.cluster_nodes(key)
+        return self.connection.lpop(key, count)
 
     def publish(self, key, value):
-        try:
-            self.cluster_nodes(key)
-            return self.connection.publish(key, value)
-        finally:
-            self.close()
+        self.cluster_nodes(key)
+        return self.connection.publish(key, value)
 
     def exists(self, key):
-        try:
-            self.cluster_nodes(key)
-            return self.connection.exists(key)
-        finally:
-            self.close()
+        self.cluster_nodes(key)
+        return self.connection.exists(key)
 
     def close(self):
+        """ 关闭客户端, 只在进程退出时调用 """
         self.connection.close()
 
     def __contains__(self, key):
@@ -214,5 +232,170 @@ class RedisClient:
             self.connection.set_default_node(target)
 
 
+class AsyncRedisClient:
+    """
+    基于 redis.asyncio 的异步客户端, 接口和 RedisClient 保持一致
+    连接池和事件循环绑定, 每个事件循环单独创建连接
+    BLPOP 等阻塞命令在等待期间一直占用连接, 使用单独的阻塞式连接池, 连接用完时排队等待而不是报错
+    """
+
+    def __init__(self, url, max_connections=10, max_blocking_connections=100):
+        """
+        max_connections: 普通命令的连接池大小
+        max_blocking_connections: 阻塞命令的连接池大小, 按单个进程同时等待事件的消费者数量(如workflow会话数)设置
+        """
+        self.url = url
+        self.max_connections = max_connections
+        self.max_blocking_connections = max_blocking_connections
+        self._connections = weakref.WeakKeyDictionary()
+        self._blocking_connections = weakref.WeakKeyDictionary()
+
+    def _create_connection(self):
+        # 不设置socket_timeout, 阻塞类的命令由命令自身的超时时间控制
+        mode, conf = _parse_redis_conf(settings.redis_url)
+        if mode == 'cluster':
+            startup_nodes = None
+            if conf['startup_nodes']:
+                startup_nodes = [
+                    AsyncClusterNode(node.get('host'), node.get('port')) for node in conf['startup_nodes']
+                ]
+            return aioredis.RedisCluster.from_url(conf['cluster_url'],
+                                                  startup_nodes=startup_nodes,
+                                                  **conf['conf'],
+                                                  retry=AsyncRetry(ExponentialBackoff(), 6),
+                                                  cluster_error_retry_attempts=1)
+        elif mode == 'sentinel':
+            sentinel = AsyncSentinel(sentinels=conf['hosts'], socket_timeout=0.1,
+                                     sentinel_kwargs={'password': conf['password']})
+            return sentinel.master_for(conf['master'], **conf['conf'])
+        # 连接用完时短暂排队等待, 并发突增时不直接报 Too many connections
+        return aioredis.StrictRedis(connection_pool=aioredis.BlockingConnectionPool.from_url(
+            self.url, max_connections=self.max_connections, timeout=20))
+
+    def _create_blocking_connection(self):
+        mode, _ = _parse_redis_conf(settings.redis_url)
+        if mode != 'standalone':
+            # 集群和哨兵模式的连接池没有连接数上限, 阻塞命令和普通命令共用连接
+            return self.connection
+        # timeout=None: 连接用完时等待其他阻塞命令返回后复用连接
+        return aioredis.StrictRedis(connection_pool=aioredis.BlockingConnectionPool.from_url(
+            self.url, max_connections=self.max_blocking_connections, timeout=None))
+
+    @property
+    def connection(self):
+        loop = asyncio.get_running_loop()
+        connection = self._connections.get(loop)
+        if connection is None:
+            connection = self._create_connection()
+            self._connections[loop] = connection
+        return connection
+
+    @property
+    def blocking_connection(self):
+        """ 执行阻塞命令的连接, 不占用普通命令的连接池 """
+        loop = asyncio.get_running_loop()
+        connection = self._blocking_connections.get(loop)
+        if connection is None:
+            connection = self._create_blocking_connection()
+            self._blocking_connections[loop] = connection
+        return connection
+
+    def pipeline(self):
+        return self.connection.pipeline(transaction=False)
+
+    async def set(self, key, value, expiration=3600):
+        result = await self.connection.set(key, _dumps(value), ex=expiration or None)
+        if not result:
+            raise ValueError('RedisCache could not set the value.')
+
+    async def setNx(self, key, value, expiration=3600):
+        return bool(await self.connection.set(key, _dumps(value), ex=expiration or None, nx=True))
+
+    async def get(self, key):
+        return _loads(await self.connection.get(key))
+
+    async def mget(self, keys: List[str]) -> List:
+        if not keys:
+            return []
+        connection = self.connection
+        if isinstance(connection, aioredis.RedisCluster):
+            values = await connection.mget_nonatomic(keys)
+        else:
+            values = await connection.mget(keys)
+        return [_loads(value) for value in values]
+
+    async def mset(self, mapping: Dict, expiration=3600):
+        if not mapping:
+            return
+        pipe = self.pipeline()
+        for key, value in mapping.items():
+            pipe.set(key, _dumps(value), ex=expiration or None)
+        await pipe.execute()
+
+    async def mdelete(self, *keys) -> int:
+        if not keys:
+            return 0
+        return await self.connection.delete(*keys)
+
+    async def hset(self, name,
+                   key: Optional[str] = None,
+                   value: Optional[str] = None,
+                   mapping: Optional[dict] = None,
+                   items: Optional[list] = None,
+                   expiration: int = 3600):
+        if not expiration:
+            return await self.connection.hset(name, key, value, mapping, items)
+        pipe = self.pipeline()
+        pipe.hset(name, key, value, mapping, items)
+        pipe.expire(name, expiration)
+        return (await pipe.execute())[0]
+
+    async def hget(self, name, key):
+        return await self.connection.hget(name, key)
+
+    async def hgetall(self, name):
+        return await self.connection.hgetall(name)
+
+    async def hdel(self, name, *keys):
+        return await self.connection.hdel(name, *keys)
+
+    async def incr(self, key, expiration=3600) -> int:
+        if not expiration:
+            return await self.connection.incr(key)
+        pipe = self.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, expiration)
+        return (await pipe.execute())[0]
+
+    async def expire_key(self, key, expiration: int):
+        await self.connection.expire(key, expiration)
+
+    async def delete(self, key):
+        return await self.connection.delete(key)
+
+    async def rpush(self, key, value, expiration=3600):
+        if not expiration:
+            return await self.connection.rpush(key, value)
+        pipe = self.pipeline()
+        pipe.rpush(key, value)
+        pipe.expire(key, expiration)
+        return (await pipe.execute())[0]
+
+    async def lpop(self, key, count: int = None):
+        return await self.connection.lpop(key, count)
+
+    async def blpop(self, key, timeout: int):
+        """ 阻塞获取列表的第一个元素, 超时返回None """
+        ret = await self.blocking_connection.blpop([key], timeout=timeout)
+        return ret[1] if ret else None
+
+    async def publish(self, key, value):
+        return await self.connection.publish(key, value)
+
+    async def exists(self, key):
+        return await self.connection.exists(key)
+
+
 # 示例用法
 redis_client = RedisClient(settings.redis_url)
+async_redis_client = AsyncRedisClient(settings.redis_url)
@@ -0,0 +1,61 @@
+import hashlib
+import threading
+from typing import Optional
+
+from loguru import logger
+
+
+class DocumentTitleCache:
+    """
+    文档总结标题的缓存, key 为 模型ID + 提示词版本 + 发给模型的文档内容的hash
+    重复入库相同内容的文件时不再调用模型, 提示词或截断长度变化后key随之变化
+    """
+
+    key_prefix = 'document_title_cache'
+
+    def __init__(self, enabled: bool = True, ttl: int = 30 * 24 * 3600):
+        self.enabled = enabled
+        self.ttl = ttl
+
+    def make_key(self, model_id: int, prompt_version: str, context: str) -> str:
+        context_hash = hashlib.sha256(context.encode('utf-8')).hexdigest()
+        return f'{self.key_prefix}:{model_id}:{prompt_version}:{context_hash}'
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        from bisheng.cache.redis import redis_client
+        try:
+            return redis_client.get(key)
+        except Exception as e:
+            logger.warning(f'document_title_cache get error key={key} error={e}')
+            return None
+
+    def set(self, key: str, title: str):
+        if not self.enabled:
+            return
+        from bisheng.cache.redis import redis_client
+        try:
+            redis_client.set(key, title, expiration=self.ttl)
+        except Exception as e:
+            logger.warning(f'document_title_cache set error key={key} error={e}')
+
+
+_title_cache: Optional[DocumentTitleCache] = None
+_title_cache_lock = threading.Lock()
+
+
+def get_title_cache() -> DocumentTitleCache:
+    """ 首次使用时才读取配置创建缓存, 避免模块导入时访问数据库 """
+    global _title_cache
+    if _title_cache is None:
+        with _title_cache_lock:
+            if _title_cache is None:
+                from bisheng.settings import settings
+                try:
+                    conf = settings.get_knowledge().get('title_cache') or {}
+                except Exception as e:
+                    logger.warning(f'load title_cache config error: {e}')
+                    conf = {}
+                _title_cache = DocumentTitleCache(**conf)
+    return _title_cache
@@ -1,4 +1,3 @@
-import asyncio
 import json
 from typing import Dict, Optional
 
@@ -15,7 +14,7 @@ from bisheng.chat.types import WorkType
 from bisheng.database.models.flow import FlowDao, FlowStatus
 from bisheng.database.models.message import ChatMessageDao, ChatMessage
 from bisheng.worker.workflow.redis_callback import RedisCallback
-from bisheng.worker.workflow.tasks import execute_workflow
+from bisheng.worker.workflow.tasks import continue_workflow, execute_workflow
 from bisheng.workflow.common.workflow import WorkflowStatus
 
 
@@ -148,7 +147,9 @@ class WorkflowClient(BaseClient):
             if self.ws_closed:
                 break
             workflow_over = await self._workflow_run()
-            await asyncio.sleep(0.5)
+            if not workflow_over and self.workflow:
+                # 等待用户输入期间阻塞等待新的事件, 不再频繁轮询redis
+                await self.workflow.await_workflow_event()
 
     async def _workflow_run(self):
         # 需要不断从redis中获取workflow返回的消息
@@ -191,4 +192,8 @@ class WorkflowClient(BaseClient):
                 break
             self.workflow.set_user_input(user_input, message_id=message_id, message_content=new_message)
             self.workflow.set_workflow_status(WorkflowStatus.INPUT_OVER.value)
+            # workflow 已暂停释放了执行任务, 需要发起新的任务恢复执行
+            if self.workflow.has_workflow_checkpoint():
+                continue_workflow.delay(self.workflow.unique_id, self.workflow.workflow_id, self.chat_id,
+                                        str(self.user_id))
         # await self.workflow_run()
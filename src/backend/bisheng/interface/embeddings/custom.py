@@ -1,9 +1,13 @@
+import time
 from typing import List, Optional, Dict
 
 import numpy as np
-from bisheng.database.models.llm_server import (LLMDao, LLMModel, LLMModelType, LLMServer,
+from bisheng.cache.embedding import get_embedding_cache
+from bisheng.database.models.llm_server import (LLMModel, LLMModelType, LLMServer,
                                                 LLMServerType)
 from bisheng.interface.importing import import_by_type
+from bisheng.interface.model_health import model_health_tracker
+from bisheng.interface.model_registry import model_registry
 from bisheng.interface.utils import wrapper_bisheng_model_limit_check
 from langchain.embeddings.base import Embeddings
 from loguru import logger
@@ -54,6 +58,7 @@ class BishengEmbedding(BaseModel, Embeddings):
     max_retries: int = Field(default=6, description='embedding模型调用失败重试次数')
     request_timeout: int = Field(default=200, description='embedding模型调用超时时间')
     model_kwargs: dict = Field(default={}, description='embedding模型调用参数')
+    cache: bool = Field(default=True, description='是否使用embedding结果缓存')
 
     embeddings: Optional[Embeddings] = Field(default=None)
     llm_node_type: Dict = {
@@ -85,15 +90,15 @@ class BishengEmbedding(BaseModel, Embeddings):
         from bisheng.interface.initialize.loading import instantiate_embedding
         super().__init__()
         self.model_id = kwargs.get('model_id')
+        self.cache = kwargs.get('cache', True)
         # 是否忽略模型是否上线的检查
         ignore_online = kwargs.get('ignore_online', False)
 
         if not self.model_id:
             raise Exception('没有找到embedding模型配置')
-        model_info = LLMDao.get_model_by_id(self.model_id)
+        model_info, server_info = model_registry.get_model_info(self.model_id)
         if not model_info:
             raise Exception('embedding模型配置已被删除，请重新配置模型')
-        server_info = LLMDao.get_server_by_id(model_info.server_id)
         if not server_info:
             raise Exception('服务提供方配置已被删除，请重新配置embedding模型')
         if model_info.model_type != LLMModelType.EMBEDDING.value:
@@ -111,7 +116,9 @@ class BishengEmbedding(BaseModel, Embeddings):
         try:
             if server_info.type == LLMServerType.OLLAMA.value:
                 params['query_instruction'] = 'passage: '
-            self.embeddings = instantiate_embedding(class_object, params)
+            self.embeddings = model_registry.get_client('embedding', model_info, server_info,
+                                                        class_object, params,
+                                                        lambda p: instantiate_embedding(class_object, p))
         except Exception as e:
             logger.exception('init_bisheng_embedding error')
             raise Exception(f'初始化bisheng embedding组件失败，请检查配置或联系管理员。错误信息：{e}')
@@ -150,9 +157,29 @@ class BishengEmbedding(BaseModel, Embeddings):
             params['openai_api_key'] = params.pop('openai_api_key', None) or 'EMPTY'
         return params
 
-    @wrapper_bisheng_model_limit_check
+    @property
+    def cache_model_key(self) -> str:
+        """ 缓存key中的模型标识, 模型名称变化后缓存自动失效 """
+        return f'{self.model_id}:{self.model}'
+
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """embedding"""
+        if not self.cache:
+            return self._embed_documents(texts)
+        return get_embedding_cache().embed_with_cache(self.cache_model_key, 'doc', texts,
+                                                      self._embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        """embedding"""
+        if not self.cache:
+            return self._embed_query(text)
+        return get_embedding_cache().embed_with_cache(
+            self.cache_model_key, 'query', [text], lambda texts: [self._embed_query(texts[0])])[0]
+
+    @wrapper_bisheng_model_limit_check
+    def _embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """embedding"""
+        start_time = time.perf_counter()
         try:
             if self.server_info.limit_flag:
                 pass
@@ -162,33 +189,34 @@ class BishengEmbedding(BaseModel, Embeddings):
                 vector = ret[0]
                 if np.linalg.norm(vector) != 1:
                     ret = [(np.array(doc) / np.linalg.norm(doc)).tolist() for doc in ret]
-            self._update_model_status(0)
+            self._update_model_status(0, start_time=start_time)
             return ret
         except Exception as e:
-            self._update_model_status(1, str(e))
+            self._update_model_status(1, str(e), start_time)
             logger.exception('embedding error')
             raise Exception(f'embedding error: {e}')
 
     @wrapper_bisheng_model_limit_check
-    def embed_query(self, text: str) -> List[float]:
+    def _embed_query(self, text: str) -> List[float]:
         """embedding"""
+        start_time = time.perf_counter()
         try:
             ret = self.embeddings.embed_query(text)
             if np.linalg.norm(ret) != 1:
                 ret = (np.array(ret) / np.linalg.norm(ret)).tolist()
-            self._update_model_status(0)
+            self._update_model_status(0, start_time=start_time)
             return ret
         except Exception as e:
-            self._update_model_status(1, str(e))
+            self._update_model_status(1, str(e), start_time)
             logger.exception('embedding error')
             raise Exception(f'embedding组件异常，请检查配置或联系管理员。错误信息：{e}')
 
-    def _update_model_status(self, status: int, remark: str = ''):
-        """更新模型状态"""
-        # todo 接入到异步任务模块 累计5分钟更新一次
-        if self.model_info.status != status:
-            self.model_info.status =  status
-            LLMDao.update_model_status(self.model_id, status, remark)
+    def _update_model_status(self, status: int, remark: str = '', start_time: float = None):
+        """ 记录模型调用结果, 模型状态由 model_health_tracker 定时汇总后写入数据库 """
+        latency = time.perf_counter() - start_time if start_time else None
+        model_health_tracker.record(self.model_id, status == 0, latency, remark,
+                                    known_status=self.model_info.status)
+        self.model_info.status = status
 
 
 CUSTOM_EMBEDDING = {
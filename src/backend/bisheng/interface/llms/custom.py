@@ -1,4 +1,5 @@
 import json
+import time
 from typing import List, Optional, Any, Sequence, Union, Dict, Type, Callable, Iterator, AsyncIterator
 
 from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
@@ -10,9 +11,12 @@ from langchain_core.tools import BaseTool
 from loguru import logger
 from pydantic import Field
 
-from bisheng.database.models.llm_server import LLMDao, LLMModelType, LLMServerType, LLMModel, LLMServer
+from bisheng.database.models.llm_server import LLMModelType, LLMServerType, LLMModel, LLMServer
 from bisheng.interface.importing import import_by_type
 from bisheng.interface.initialize.loading import instantiate_llm
+from bisheng.interface.model_health import model_health_tracker
+from bisheng.interface.model_registry import model_registry
+from bisheng.settings import settings
 from bisheng.interface.utils import wrapper_bisheng_model_limit_check, wrapper_bisheng_model_limit_check_async, \
     wrapper_bisheng_model_generator, wrapper_bisheng_model_generator_async
 
@@ -167,11 +171,10 @@ class BishengLLM(BaseChatModel):
 
         if not self.model_id:
             raise Exception('没有找到llm模型配置')
-        model_info = LLMDao.get_model_by_id(self.model_id)
+        model_info, server_info = model_registry.get_model_info(self.model_id)
         if not model_info:
             raise Exception('llm模型配置已被删除，请重新配置模型')
         self.model_name = model_info.model_name
-        server_info = LLMDao.get_server_by_id(model_info.server_id)
         if not server_info:
             raise Exception('服务提供方配置已被删除，请重新配置llm模型')
         if model_info.model_type != LLMModelType.LLM.value:
@@ -185,7 +188,11 @@ class BishengLLM(BaseChatModel):
         class_object, class_name = self._get_llm_class(server_info.type)
         params = self._get_llm_params(server_info, model_info)
         try:
-            self.llm = instantiate_llm(class_name, class_object, params)
+            # 相同配置的模型复用已经实例化的客户端, request_timeout等配置会影响实例化结果
+            self.llm = model_registry.get_client(
+                'llm', model_info, server_info, class_object, params,
+                lambda p: instantiate_llm(class_name, class_object, p),
+                extra_key=settings.get_from_db('llm_request'))
         except Exception as e:
             logger.exception('init bisheng llm error')
             raise Exception(f'初始化llm失败，请检查配置或联系管理员。错误信息：{e}')
@@ -343,6 +350,7 @@ class BishengLLM(BaseChatModel):
             stream: Optional[bool] = None,
             **kwargs: Any,
     ) -> ChatResult:
+        start_time = time.perf_counter()
         try:
             messages, kwargs = self.parse_kwargs(messages, kwargs)
             if self.server_info.type == LLMServerType.MOONSHOT.value:
@@ -351,9 +359,9 @@ class BishengLLM(BaseChatModel):
                 ret = self.llm._generate(messages, stop, run_manager, **kwargs)
                 if self.server_info.type == LLMServerType.QWEN.value:
                     ret.generations[0].message = self.convert_qwen_result(ret.generations[0].message)
-            self._update_model_status(0)
+            self._update_model_status(0, start_time=start_time)
         except Exception as e:
-            self._update_model_status(1, str(e))
+            self._update_model_status(1, str(e), start_time)
             raise e
         return ret
 
@@ -364,28 +372,23 @@ class BishengLLM(BaseChatModel):
             run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
             **kwargs: Any,
     ) -> ChatResult:
-        try:
-            result = None
-            finish_reason = None
-            while finish_reason is None or finish_reason == 'tool_calls':
-                result = self.llm._generate(messages, stop, run_manager, **kwargs)
-                result_message = result.generations[0].message
-                finish_reason = result.generations[0].generation_info.get('finish_reason')
-                for tool_call in result_message.tool_calls:
-                    tool_call_name = tool_call['name']
-                    if tool_call_name == "$web_search":
-                        messages.append(result_message)
-                        messages.append(ToolMessage(
-                            tool_call_id=tool_call['id'],
-                            name=tool_call_name,
-                            content=json.dumps(tool_call['args'], ensure_ascii=False),
-                        ))
-                    else:
-                        break
-            self._update_model_status(0)
-        except Exception as e:
-            self._update_model_status(1, str(e))
-            raise e
+        result = None
+        finish_reason = None
+        while finish_reason is None or finish_reason == 'tool_calls':
+            result = self.llm._generate(messages, stop, run_manager, **kwargs)
+            result_message = result.generations[0].message
+            finish_reason = result.generations[0].generation_info.get('finish_reason')
+            for tool_call in result_message.tool_calls:
+                tool_call_name = tool_call['name']
+                if tool_call_name == "$web_search":
+                    messages.append(result_message)
+                    messages.append(ToolMessage(
+                        tool_call_id=tool_call['id'],
+                        name=tool_call_name,
+                        content=json.dumps(tool_call['args'], ensure_ascii=False),
+                    ))
+                else:
+                    break
         return result
 
     @wrapper_bisheng_model_limit_check_async
@@ -397,6 +400,7 @@ class BishengLLM(BaseChatModel):
             stream: Optional[bool] = None,
             **kwargs: Any,
     ) -> ChatResult:
+        start_time = time.perf_counter()
         try:
             messages, kwargs = self.parse_kwargs(messages, kwargs)
             if self.server_info.type == LLMServerType.MOONSHOT.value:
@@ -405,9 +409,9 @@ class BishengLLM(BaseChatModel):
                 ret = await self.llm._agenerate(messages, stop, run_manager, **kwargs)
                 if self.server_info.type == LLMServerType.QWEN.value:
                     ret.generations[0].message = self.convert_qwen_result(ret.generations[0].message)
-            self._update_model_status(0)
+            self._update_model_status(0, start_time=start_time)
         except Exception as e:
-            self._update_model_status(1, str(e))
+            self._update_model_status(1, str(e), start_time)
             # 记录失败状态
             raise e
         return ret
@@ -419,36 +423,31 @@ class BishengLLM(BaseChatModel):
             run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
             **kwargs: Any,
     ) -> ChatResult:
-        try:
-            result = None
-            finish_reason = None
-            while finish_reason is None or finish_reason == 'tool_calls':
-                result = await self.llm._agenerate(messages, stop, run_manager, **kwargs)
-                result_message = result.generations[0].message
-                finish_reason = result.generations[0].generation_info.get('finish_reason')
-                for tool_call in result_message.tool_calls:
-                    tool_call_name = tool_call['name']
-                    if tool_call_name == "$web_search":
-                        messages.append(result_message)
-                        messages.append(ToolMessage(
-                            tool_call_id=tool_call['id'],
-                            name=tool_call_name,
-                            content=json.dumps(tool_call['args'], ensure_ascii=False),
-                        ))
-                    else:
-                        break
-            self._update_model_status(0)
-        except Exception as e:
-            self._update_model_status(1, str(e))
-            raise e
+        result = None
+        finish_reason = None
+        while finish_reason is None or finish_reason == 'tool_calls':
+            result = await self.llm._agenerate(messages, stop, run_manager, **kwargs)
+            result_message = result.generations[0].message
+            finish_reason = result.generations[0].generation_info.get('finish_reason')
+            for tool_call in result_message.tool_calls:
+                tool_call_name = tool_call['name']
+                if tool_call_name == "$web_search":
+                    messages.append(result_message)
+                    messages.append(ToolMessage(
+                        tool_call_id=tool_call['id'],
+                        name=tool_call_name,
+                        content=json.dumps(tool_call['args'], ensure_ascii=False),
+                    ))
+                else:
+                    break
         return result
 
-    def _update_model_status(self, status: int, remark: str = ''):
-        """更新模型状态"""
-        # todo 接入到异步任务模块 累计5分钟更新一次
-        if self.model_info.status != status:
-            self.model_info.status = status
-            LLMDao.update_model_status(self.model_id, status, remark)
+    def _update_model_status(self, status: int, remark: str = '', start_time: float = None):
+        """ 记录模型调用结果, 模型状态由 model_health_tracker 定时汇总后写入数据库 """
+        latency = time.perf_counter() - start_time if start_time else None
+        model_health_tracker.record(self.model_id, status == 0, latency, remark,
+                                    known_status=self.model_info.status)
+        self.model_info.status = status
 
     def bind_tools(
             self,
@@ -471,14 +470,15 @@ class BishengLLM(BaseChatModel):
             run_manager: Optional[CallbackManagerForLLMRun] = None,
             **kwargs: Any,
     ) -> Iterator[ChatGenerationChunk]:
+        start_time = time.perf_counter()
         try:
             for one in self.llm._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
                 if self.server_info.type == LLMServerType.QWEN.value:
                     one.message = self.convert_qwen_result(one.message)
                 yield one
-            self._update_model_status(0)
+            self._update_model_status(0, start_time=start_time)
         except Exception as e:
-            self._update_model_status(1, str(e))
+            self._update_model_status(1, str(e), start_time)
             raise e
 
     @wrapper_bisheng_model_generator_async
@@ -489,12 +489,13 @@ class BishengLLM(BaseChatModel):
             run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
             **kwargs: Any,
     ) -> AsyncIterator[ChatGenerationChunk]:
+        start_time = time.perf_counter()
         try:
             async for one in self.llm._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
                 if self.server_info.type == LLMServerType.QWEN.value:
                     one.message = self.convert_qwen_result(one.message)
                 yield one
-            self._update_model_status(0)
+            self._update_model_status(0, start_time=start_time)
         except Exception as e:
-            self._update_model_status(1, str(e))
+            self._update_model_status(1, str(e), start_time)
             raise e
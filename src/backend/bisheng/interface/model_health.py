@@ -0,0 +1,252 @@
+import atexit
+import json
+import math
+import os
+import socket
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+
+def _percentile(values: List[float], percent: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, math.ceil(percent / 100 * len(values)) - 1))
+    return round(values[index], 4)
+
+
+class ModelHealth:
+    """ 单个模型在当前进程内的调用统计 """
+
+    def __init__(self, window: int):
+        # 最近 window 次调用的 (是否成功, 耗时, 调用时间)
+        self.samples = deque(maxlen=window)
+        self.total = 0
+        self.errors = 0
+        self.flushed_status: Optional[int] = None
+        self.last_error = ''
+        self.last_error_time = 0.0
+        self.updated_at = 0.0
+
+    def dump(self) -> Dict:
+        return {
+            'total': self.total,
+            'errors': self.errors,
+            'samples': [[int(success), latency, called_at] for success, latency, called_at in self.samples],
+            'last_error': self.last_error,
+            'last_error_time': self.last_error_time,
+            'updated_at': self.updated_at,
+        }
+
+
+class ModelHealthTracker:
+    """
+    模型调用健康状况的统计, 代替每次调用模型后同步更新数据库
+    调用结果只记录在内存中, 后台线程定时:
+    1. 每 flush_interval 秒把本进程的统计写入redis, 用于接口查询多个进程汇总后的错误率和耗时
+    2. 每 status_interval 秒根据所有进程汇总后的窗口错误率计算模型状态, 状态变化时写入数据库
+    """
+
+    redis_key = 'llm:model_health'
+    # model_id -> 手动测试模型的时间, 汇总统计时忽略此时间之前的调用
+    reset_key = 'llm:model_health:reset'
+
+    def __init__(self, window: int = 200, flush_interval: float = 30, status_interval: float = 300,
+                 stats_ttl: int = 600, error_rate_threshold: float = 0.5):
+        self.window = window
+        self.flush_interval = flush_interval
+        self.status_interval = status_interval
+        self.stats_ttl = stats_ttl
+        # 窗口错误率达到阈值时模型状态为异常
+        self.error_rate_threshold = error_rate_threshold
+        self._lock = threading.Lock()
+        self._models: Dict[int, ModelHealth] = {}
+        self._pid: Optional[int] = None
+        self._worker: Optional[threading.Thread] = None
+        self._last_status_flush = time.monotonic()
+        atexit.register(self._flush_at_exit)
+
+    @property
+    def process_key(self) -> str:
+        return f'{socket.gethostname()}:{os.getpid()}'
+
+    def _ensure_worker(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            if self._pid is not None:
+                # fork出来的子进程, 继承的统计属于父进程
+                self._models = {}
+            self._pid = pid
+            self._worker = threading.Thread(target=self._run, name='model-health-flush', daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f'model health flush error: {e}')
+
+    def record(self, model_id: int, success: bool, latency: Optional[float] = None, error: str = '',
+               known_status: Optional[int] = None):
+        """
+        记录一次模型调用
+        known_status: 调用方已知的数据库内的模型状态, 状态没有变化时不需要写数据库
+        """
+        if not model_id:
+            return
+        self._ensure_worker()
+        now = time.time()
+        with self._lock:
+            health = self._models.get(model_id)
+            if health is None:
+                health = self._models[model_id] = ModelHealth(self.window)
+                health.flushed_status = known_status
+            health.samples.append((success, round(latency, 4) if latency is not None else None, now))
+            health.total += 1
+            health.updated_at = now
+            if not success:
+                health.errors += 1
+                health.last_error = error
+                health.last_error_time = now
+
+    def flush(self, force_status: bool = False):
+        self.flush_stats()
+        now = time.monotonic()
+        if force_status or now - self._last_status_flush >= self.status_interval:
+            self._last_status_flush = now
+            self.flush_status()
+
+    def flush_stats(self):
+        """ 把本进程的统计写入redis """
+        from bisheng.cache.redis import redis_client
+
+        with self._lock:
+            mapping = {f'{model_id}:{self.process_key}': json.dumps(health.dump())
+                       for model_id, health in self._models.items()}
+        if mapping:
+            redis_client.hset(self.redis_key, mapping=mapping, expiration=self.stats_ttl)
+
+    def flush_status(self, model_ids: Optional[List[int]] = None):
+        """
+        根据所有进程汇总后的窗口错误率计算本进程调用过的模型的状态, 状态有变化的写入数据库
+        model_ids为空时处理所有模型
+        """
+        stats = self._merge_stats()
+        with self._lock:
+            flushed = {model_id: health.flushed_status for model_id, health in self._models.items()
+                       if model_ids is None or model_id in model_ids}
+        changed = {}
+        for model_id, flushed_status in flushed.items():
+            item = stats.get(model_id)
+            if not item or not item['window_requests']:
+                continue
+            status = 1 if item['error_rate'] >= self.error_rate_threshold else 0
+            if status != flushed_status:
+                changed[model_id] = (status, item['last_error'] if status else '')
+        for model_id, (status, remark) in changed.items():
+            self._write_status(model_id, status, remark)
+        if changed:
+            logger.info(f'flush model status: {changed}')
+
+    def set_status(self, model_id: int, status: int, remark: str = ''):
+        """
+        手动测试模型后直接写入测试结果, 之前的调用统计不再参与计算状态
+        避免测试通过后又被旧的错误率改回异常
+        """
+        from bisheng.cache.redis import redis_client
+
+        now = time.time()
+        # 其他进程内存中的旧调用记录可能一直存在, 所以重置时间不设置过期
+        redis_client.hset(self.reset_key, mapping={str(model_id): now}, expiration=None)
+        with self._lock:
+            health = self._models.get(model_id)
+            if health is not None:
+                health.samples.clear()
+        self._write_status(model_id, status, remark)
+
+    def _write_status(self, model_id: int, status: int, remark: str):
+        from bisheng.database.models.llm_server import LLMDao
+        from bisheng.interface.model_registry import model_registry
+
+        LLMDao.update_model_status(model_id, status, remark)
+        model_registry.set_model_status(model_id, status)
+        with self._lock:
+            health = self._models.get(model_id)
+            if health is None:
+                health = self._models[model_id] = ModelHealth(self.window)
+            health.flushed_status = status
+
+    def _flush_at_exit(self):
+        if self._pid != os.getpid():
+            return
+        try:
+            self.flush(force_status=True)
+        except Exception as e:
+            logger.warning(f'model health flush at exit error: {e}')
+
+    def get_stats(self, model_id: Optional[int] = None) -> Dict[int, Dict]:
+        """ 汇总所有进程上报的统计, 返回 model_id -> 统计信息 """
+        if self._pid == os.getpid():
+            self.flush_stats()
+        return self._merge_stats(model_id)
+
+    def _merge_stats(self, model_id: Optional[int] = None) -> Dict[int, Dict]:
+        from bisheng.cache.redis import redis_client
+
+        now = time.time()
+        resets = {}
+        for field, value in (redis_client.hgetall(self.reset_key) or {}).items():
+            field = field.decode() if isinstance(field, bytes) else field
+            resets[int(field)] = float(value)
+        merged: Dict[int, Dict] = {}
+        expired = []
+        for field, value in (redis_client.hgetall(self.redis_key) or {}).items():
+            field = field.decode() if isinstance(field, bytes) else field
+            one = json.loads(value)
+            if now - one['updated_at'] > self.stats_ttl:
+                expired.append(field)
+                continue
+            one_model_id = int(field.split(':', 1)[0])
+            if model_id is not None and one_model_id != model_id:
+                continue
+            item = merged.setdefault(one_model_id, {
+                'total': 0, 'errors': 0, 'samples': [], 'last_error': '', 'last_error_time': 0,
+                'updated_at': 0, 'processes': 0,
+            })
+            reset_at = resets.get(one_model_id, 0)
+            item['total'] += one['total']
+            item['errors'] += one['errors']
+            item['samples'].extend(sample for sample in one['samples'] if sample[2] > reset_at)
+            item['processes'] += 1
+            item['updated_at'] = max(item['updated_at'], one['updated_at'])
+            if reset_at < one['last_error_time'] and one['last_error_time'] > item['last_error_time']:
+                item['last_error'] = one['last_error']
+                item['last_error_time'] = one['last_error_time']
+        if expired:
+            redis_client.hdel(self.redis_key, *expired)
+
+        ret = {}
+        for one_model_id, item in merged.items():
+            samples = item.pop('samples')
+            latencies = [latency for _, latency, _ in samples if latency is not None]
+            window_errors = sum(1 for success, _, _ in samples if not success)
+            item['window_requests'] = len(samples)
+            item['window_errors'] = window_errors
+            item['error_rate'] = round(window_errors / len(samples), 4) if samples else 0
+            item['p50_latency'] = _percentile(latencies, 50)
+            item['p95_latency'] = _percentile(latencies, 95)
+            ret[one_model_id] = item
+        return ret
+
+
+model_health_tracker = ModelHealthTracker()
@@ -0,0 +1,135 @@
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+
+from cachetools import LRUCache, TTLCache
+from loguru import logger
+from pydantic import BaseModel
+
+from bisheng.database.models.llm_server import LLMDao, LLMModel, LLMServer
+
+# 每次调用都可能不同的参数, 命中缓存后通过浅拷贝覆盖, 不重新创建客户端
+OVERRIDE_PARAMS = ('temperature', 'top_p', 'streaming')
+
+
+def _copy_row(row):
+    """ 复制一份数据库对象, 避免调用方修改缓存内的对象 """
+    return type(row)(**row.model_dump())
+
+
+def _stamp(row) -> str:
+    return str(row.update_time or '')
+
+
+def _freeze(params: Dict) -> str:
+    return json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class ModelRegistry:
+    """
+    模型管理中模型的进程内注册表
+    1. 缓存 model_id -> (模型配置, 服务提供方配置), 初始化模型时不再每次查询两次数据库
+    2. 缓存实例化后的模型客户端, 相同配置的模型复用同一个客户端和它的http连接池
+    模型配置变更时递增redis内的版本号, 其他进程最多延迟 check_interval 秒后清空本地缓存
+    """
+
+    version_key = 'llm:model_registry:version'
+
+    def __init__(self, ttl: int = 300, model_size: int = 1024, client_size: int = 256,
+                 check_interval: float = 5):
+        self.check_interval = check_interval
+        self._models = TTLCache(maxsize=model_size, ttl=ttl)
+        self._clients = LRUCache(maxsize=client_size)
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._checked_at = 0.0
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        from bisheng.cache.redis import redis_client
+        try:
+            version = redis_client.get_int(self.version_key)
+        except Exception as e:
+            logger.warning(f'get model registry version error: {e}')
+            version = self._version
+        with self._lock:
+            self._checked_at = now
+            if version != self._version:
+                self._version = version
+                self._models.clear()
+                self._clients.clear()
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._clients.clear()
+
+    def invalidate(self):
+        """ 模型或服务提供方配置变更后调用, 通知所有进程清空缓存 """
+        from bisheng.cache.redis import redis_client
+        self.clear()
+        try:
+            redis_client.incr(self.version_key, expiration=None)
+        except Exception as e:
+            logger.warning(f'incr model registry version error: {e}')
+
+    def get_model_info(self, model_id: int) -> Tuple[Optional[LLMModel], Optional[LLMServer]]:
+        """ 获取模型配置和对应的服务提供方配置, 返回的是副本 """
+        self._check_version()
+        with self._lock:
+            cached = self._models.get(model_id)
+        if cached is None:
+            model_info = LLMDao.get_model_by_id(model_id)
+            if not model_info:
+                return None, None
+            server_info = LLMDao.get_server_by_id(model_info.server_id)
+            if not server_info:
+                return model_info, None
+            cached = (model_info, server_info)
+            with self._lock:
+                self._models[model_id] = cached
+        return _copy_row(cached[0]), _copy_row(cached[1])
+
+    def set_model_status(self, model_id: int, status: int):
+        """ 模型状态写入数据库后同步更新缓存, 避免用旧的状态重复更新 """
+        with self._lock:
+            cached = self._models.get(model_id)
+            if cached is not None:
+                cached[0].status = status
+
+    def get_client(self, kind: str, model_info: LLMModel, server_info: LLMServer, client_class: Type,
+                   params: Dict, factory: Callable[[Dict], Any], extra_key: Any = None) -> Any:
+        """
+        获取模型客户端, 相同配置的客户端只实例化一次
+        kind: 客户端类型, llm 或者 embedding
+        client_class: 客户端的类, 只有类上存在的字段才能在命中缓存后直接覆盖
+        params: 实例化客户端的参数
+        factory: 实例化客户端的函数, 入参为 params 的副本
+        extra_key: 影响客户端实例化的其他配置
+        """
+        self._check_version()
+        fields = getattr(client_class, 'model_fields', None) or {}
+        override = {key: params[key] for key in OVERRIDE_PARAMS if key in params and key in fields}
+        key_params = {key: value for key, value in params.items() if key not in override}
+        cache_key = (kind, model_info.id, server_info.id, _stamp(model_info), _stamp(server_info),
+                     _freeze(key_params), _freeze(extra_key))
+        with self._lock:
+            client = self._clients.get(cache_key)
+        if client is None:
+            client = factory(dict(params))
+            with self._lock:
+                self._clients[cache_key] = client
+            return client
+
+        # 浅拷贝会共享底层的http客户端
+        if isinstance(client, BaseModel):
+            update = {key: value for key, value in override.items() if getattr(client, key) != value}
+            if update:
+                client = client.model_copy(update=update)
+        return client
+
+
+model_registry = ModelRegistry()
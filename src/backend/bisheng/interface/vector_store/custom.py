@@ -1,5 +1,10 @@
+import asyncio
+import functools
+import json
+import weakref
 from ast import literal_eval
 from abc import ABC
+from concurrent.futures import ThreadPoolExecutor
 from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 import jieba
@@ -18,6 +23,46 @@ from loguru import logger
 if TYPE_CHECKING:
     from elasticsearch import Elasticsearch  # noqa: F401
 
+# 多知识库检索时, 并发计算query向量和查询collection的线程池
+_search_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='vector_search')
+
+
+@functools.lru_cache(maxsize=1024)
+def _jieba_extract_tags(query: str) -> Tuple[str, ...]:
+    return tuple(jieba.analyse.extract_tags(query, topK=10, withWeight=False))
+
+
+def _extract_keywords(query: str) -> List[str]:
+    """ jieba提取关键词, 相同的query只提取一次 """
+    return list(_jieba_extract_tags(query))
+
+
+# es异步客户端, 按事件循环和连接配置在进程内共享, 事件循环回收后对应的客户端一起释放
+_async_es_clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]' = \
+    weakref.WeakKeyDictionary()
+
+
+def _get_async_es_client(elasticsearch_url: str, ssl_verify: Dict[str, Any]) -> Any:
+    from elasticsearch import AsyncElasticsearch
+    loop = asyncio.get_running_loop()
+    clients = _async_es_clients.setdefault(loop, {})
+    key = json.dumps([elasticsearch_url, ssl_verify], sort_keys=True, default=str)
+    client = clients.get(key)
+    if client is None:
+        client = AsyncElasticsearch(elasticsearch_url, **ssl_verify)
+        clients[key] = client
+    return client
+
+
+async def close_async_es_clients():
+    """ 关闭当前事件循环创建的es异步客户端, 服务退出时调用 """
+    clients = _async_es_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        try:
+            await client.close()
+        except Exception as e:
+            logger.warning(f'close async elasticsearch client error: {e}')
+
 
 class MilvusWithPermissionCheck(MilvusLangchain):
     """
@@ -354,10 +399,8 @@ class MilvusWithPermissionCheck(MilvusLangchain):
             logger.debug('No existing collection to search.')
             return []
 
-        # Embed the query text.
-        embedding = self.embedding_func.embed_query(query)
-
-        res = self.similarity_search_with_score_by_vector(embedding=embedding,
+        # 每个collection会使用自己的embedding计算query向量, 这里不再单独计算
+        res = self.similarity_search_with_score_by_vector(embedding=None,
                                                           k=k,
                                                           query=query,
                                                           param=param,
@@ -383,7 +426,7 @@ class MilvusWithPermissionCheck(MilvusLangchain):
         https://milvus.io/api-reference/pymilvus/v2.2.6/Collection/search().md
 
         Args:
-            embedding (List[float]): disabled.
+            embedding (List[float]): only used when query is None.
             k (int, optional): The amount of results to return. Defaults to 4.
             param (dict): The search params for the specified index.
                 Defaults to None.
@@ -406,42 +449,153 @@ class MilvusWithPermissionCheck(MilvusLangchain):
 
         if param is None:
             param = self.search_params
+        finally_k = kwargs.pop('k', k)
+
+        # 相同的embedding模型只计算一次query向量
+        query_embeddings = self._embed_query_by_model(query, embedding)
+        futures = [
+            _search_executor.submit(self._search_one_collection, index, query_embeddings[index],
+                                    k, param, query, expr, timeout, **kwargs)
+            for index in range(len(self.col))
+        ]
+        col_results = [future.result() for future in futures]
+        return self._merge_search_results(col_results, finally_k)
+
+    async def asimilarity_search_with_score(
+        self,
+        query: str,
+        k: int = 4,
+        param: Optional[dict] = None,
+        expr: Optional[str] = None,
+        timeout: Optional[int] = None,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        """Async version of similarity_search_with_score, searches all collections concurrently."""
+        if k == 0:
+            # pm need to control
+            return []
+        if not self.col:
+            logger.debug('No existing collection to search.')
+            return []
+
+        if param is None:
+            param = self.search_params
+        finally_k = kwargs.pop('k', k)
 
+        query_embeddings = await self._aembed_query_by_model(query)
+        loop = asyncio.get_running_loop()
+        col_results = await asyncio.gather(*[
+            loop.run_in_executor(
+                _search_executor,
+                functools.partial(self._search_one_collection, index, query_embeddings[index], k,
+                                  param, query, expr, timeout, **kwargs))
+            for index in range(len(self.col))
+        ])
+        return self._merge_search_results(col_results, finally_k)
+
+    async def asimilarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        param: Optional[dict] = None,
+        expr: Optional[str] = None,
+        timeout: Optional[int] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        res = await self.asimilarity_search_with_score(query=query,
+                                                       k=k,
+                                                       param=param,
+                                                       expr=expr,
+                                                       timeout=timeout,
+                                                       **kwargs)
+        return [doc for doc, _ in res]
+
+    @staticmethod
+    def _embedding_model_key(embedding: Embeddings) -> Any:
+        """ 区分embedding模型的标识, 毕昇的embedding用模型ID, 其他的用对象本身 """
+        model_id = getattr(embedding, 'model_id', None)
+        if model_id:
+            return f'model_id:{model_id}'
+        return id(embedding)
+
+    def _group_collection_by_model(self) -> Dict[Any, List[int]]:
+        groups: Dict[Any, List[int]] = {}
+        for index in range(len(self.col)):
+            key = self._embedding_model_key(self.collection_embeddings[index])
+            groups.setdefault(key, []).append(index)
+        return groups
+
+    def _embed_query_by_model(self, query: Optional[str],
+                              embedding: Optional[List[float]] = None) -> List[List[float]]:
+        """ 计算每个collection的query向量, 同一个模型只计算一次, 不同模型并发计算 """
+        if query is None:
+            # 没有query时直接使用传入的向量
+            return [embedding] * len(self.col)
+        groups = self._group_collection_by_model()
+        futures = {
+            key: _search_executor.submit(self.collection_embeddings[indexes[0]].embed_query, query)
+            for key, indexes in groups.items()
+        }
+        ret: List[Optional[List[float]]] = [None] * len(self.col)
+        for key, indexes in groups.items():
+            query_embedding = futures[key].result()
+            for index in indexes:
+                ret[index] = query_embedding
+        return ret
+
+    async def _aembed_query_by_model(self, query: str) -> List[List[float]]:
+        groups = self._group_collection_by_model()
+        keys = list(groups.keys())
+        query_embeddings = await asyncio.gather(*[
+            self.collection_embeddings[groups[key][0]].aembed_query(query) for key in keys
+        ])
+        ret: List[Optional[List[float]]] = [None] * len(self.col)
+        for key, query_embedding in zip(keys, query_embeddings):
+            for index in groups[key]:
+                ret[index] = query_embedding
+        return ret
+
+    def _search_one_collection(self, index: int, embedding: List[float], k: int, param: dict,
+                               query: Optional[str], expr: Optional[str], timeout: Optional[int],
+                               **kwargs: Any) -> List[Tuple[Document, float]]:
+        one_col = self.col[index]
         # Determine result metadata fields.
         output_fields = self.fields[:]
         output_fields.remove(self._vector_field)
 
-        finally_k = kwargs.pop('k', k)
-
+        search_expr = expr
+        if self.col_partition_key[index]:
+            # add parttion
+            if expr:
+                search_expr = f"{expr} and {self._partition_field}==\"{self.col_partition_key[index]}\""
+            else:
+                search_expr = f"{self._partition_field}==\"{self.col_partition_key[index]}\""
+        # Perform the search.
+        res = one_col.search(
+            data=[embedding],
+            anns_field=self._vector_field,
+            param=param,
+            limit=k,
+            expr=search_expr,
+            output_fields=output_fields,
+            timeout=timeout,
+            **kwargs,
+        )
+        # Organize results.
         ret = []
+        for result in res[0]:
+            meta = {x: result.entity.get(x) for x in output_fields}
+            doc = Document(page_content=meta.pop(self._text_field), metadata=meta)
+            pair = (doc, result.score)
+            ret.append(pair)
+        logger.debug(f'MilvusWithPermissionCheck Search {one_col.name} query: {query} results: {res[0]}')
+        return ret
 
-        for index, one_col in enumerate(self.col):
-            search_expr = expr
-            embedding = self.collection_embeddings[index].embed_query(query)
-            if self.col_partition_key[index]:
-                # add parttion
-                if expr:
-                    search_expr = f"{expr} and {self._partition_field}==\"{self.col_partition_key[index]}\""
-                else:
-                    search_expr = f"{self._partition_field}==\"{self.col_partition_key[index]}\""
-            # Perform the search.
-            res = one_col.search(
-                data=[embedding],
-                anns_field=self._vector_field,
-                param=param,
-                limit=k,
-                expr=search_expr,
-                output_fields=output_fields,
-                timeout=timeout,
-                **kwargs,
-            )
-            # Organize results.
-            for result in res[0]:
-                meta = {x: result.entity.get(x) for x in output_fields}
-                doc = Document(page_content=meta.pop(self._text_field), metadata=meta)
-                pair = (doc, result.score)
-                ret.append(pair)
-            logger.debug(f'MilvusWithPermissionCheck Search {one_col.name} query: {query} results: {res[0]}')
+    @staticmethod
+    def _merge_search_results(col_results: List[List[Tuple[Document, float]]],
+                              finally_k: int) -> List[Tuple[Document, float]]:
+        # 按照collection的顺序合并, 保证分数相同时的顺序稳定
+        ret = [pair for one in col_results for pair in one]
         ret.sort(key=lambda x: x[1])
         logger.debug(f'MilvusWithPermissionCheck Search all results: {len(ret)}')
         # milvus是分数越小越好，所以直接取前几位就行
@@ -485,6 +639,7 @@ class ElasticsearchWithPermissionCheck(VectorStore, ABC):
         _ssl_verify = ssl_verify or {}
         self.elasticsearch_url = elasticsearch_url
         self.ssl_verify = _ssl_verify
+        self._version_num: Optional[int] = None
         try:
             self.client = elasticsearch.Elasticsearch(elasticsearch_url, **_ssl_verify)
         except ValueError as e:
@@ -525,41 +680,139 @@ class ElasticsearchWithPermissionCheck(VectorStore, ABC):
         if k == 0:
             # pm need to control
             return []
+        if not self.index_name:
+            # 用户没有可访问的知识库
+            return []
         assert must_or_should in ['must', 'should'], 'only support must and should.'
         # llm or jiaba extract keywords
         if self.llm_chain:
             keywords_str = self.llm_chain.run(query)
-            logger.debug('elasticsearch llm search keywords:', keywords_str)
-            try:
-                keywords = literal_eval(keywords_str)
-                if not isinstance(keywords, list):
-                    raise ValueError('Keywords extracted by llm is not list.')
-            except Exception:
-                keywords = jieba.analyse.extract_tags(query, topK=10, withWeight=False)
+            keywords = self._parse_llm_keywords(query, keywords_str)
         else:
-            keywords = jieba.analyse.extract_tags(query, topK=10, withWeight=False)
+            keywords = _extract_keywords(query)
+        match_query = self._build_match_query(query, keywords, query_strategy, must_or_should)
+
+        # 所有索引的查询合并成一次 msearch 请求
+        searches = self._build_msearch_body(match_query, k)
+        if self._get_version_num() >= 8:
+            response = self.client.msearch(searches=searches)
+        else:
+            response = self.client.msearch(body=searches)
+        return self._merge_msearch_response(response, kwargs.pop('finally_k', k))
+
+    async def asimilarity_search_with_score(self,
+                                            query: str,
+                                            k: int = 4,
+                                            query_strategy: str = 'match_phrase',
+                                            must_or_should: str = 'should',
+                                            **kwargs: Any) -> List[Tuple[Document, float]]:
+        if k == 0:
+            # pm need to control
+            return []
+        if not self.index_name:
+            # 用户没有可访问的知识库
+            return []
+        assert must_or_should in ['must', 'should'], 'only support must and should.'
+        if self.llm_chain:
+            keywords_str = await self.llm_chain.arun(query)
+            keywords = self._parse_llm_keywords(query, keywords_str)
+        else:
+            keywords = _extract_keywords(query)
+        match_query = self._build_match_query(query, keywords, query_strategy, must_or_should)
+
+        searches = self._build_msearch_body(match_query, k)
+        async_client = self._get_async_client()
+        if await self._aget_version_num(async_client) >= 8:
+            response = await async_client.msearch(searches=searches)
+        else:
+            response = await async_client.msearch(body=searches)
+        return self._merge_msearch_response(response, kwargs.pop('finally_k', k))
+
+    async def asimilarity_search(self,
+                                 query: str,
+                                 k: int = 4,
+                                 query_strategy: str = 'match_phrase',
+                                 must_or_should: str = 'should',
+                                 **kwargs: Any) -> List[Document]:
+        if k == 0:
+            # pm need to control
+            return []
+        docs_and_scores = await self.asimilarity_search_with_score(query,
+                                                                   k=k,
+                                                                   query_strategy=query_strategy,
+                                                                   must_or_should=must_or_should,
+                                                                   **kwargs)
+        return [d[0] for d in docs_and_scores]
+
+    @staticmethod
+    def _parse_llm_keywords(query: str, keywords_str: str) -> List[str]:
+        logger.debug('elasticsearch llm search keywords:', keywords_str)
+        try:
+            keywords = literal_eval(keywords_str)
+            if not isinstance(keywords, list):
+                raise ValueError('Keywords extracted by llm is not list.')
+        except Exception:
+            keywords = _extract_keywords(query)
+        return keywords
+
+    @staticmethod
+    def _build_match_query(query: str, keywords: List[str], query_strategy: str,
+                           must_or_should: str) -> Dict:
         keywords = keywords or [query]
         logger.debug(f'finally search keywords: {keywords}')
         match_query = {'bool': {must_or_should: []}}
         for key in keywords:
             match_query['bool'][must_or_should].append({query_strategy: {'text': key}})
+        return match_query
 
-        ret = []
+    def _build_msearch_body(self, match_query: Dict, k: int) -> List[Dict]:
+        searches = []
         for one_index_name in self.index_name:
-            response = self.client_search(self.client, one_index_name, match_query, size=k)
-            hits = [hit for hit in response['hits']['hits']]
+            searches.append({'index': one_index_name})
+            searches.append({'query': match_query, 'size': k})
+        return searches
+
+    def _merge_msearch_response(self, response: Any,
+                                finally_k: int) -> List[Tuple[Document, float]]:
+        ret = []
+        for one_index_name, one_response in zip(self.index_name, response['responses']):
+            if 'error' in one_response:
+                error = one_response['error']
+                # 知识库还没有上传过文件时索引不存在, 跳过即可
+                if isinstance(error, dict) and error.get('type') == 'index_not_found_exception':
+                    logger.warning(f'ElasticsearchWithPermissionCheck index {one_index_name} not found')
+                    continue
+                raise ValueError(f'elasticsearch search {one_index_name} error: {error}')
+            hits = [hit for hit in one_response['hits']['hits']]
             for hit in hits:
                 ret.append((Document(page_content=hit['_source']['text'],
                                      metadata=hit['_source']['metadata']), hit['_score']))
             logger.debug(
                 f'ElasticsearchWithPermissionCheck Search {one_index_name} results: {hits}')
         logger.debug(f'ElasticsearchWithPermissionCheck Search all results: {len(ret)}')
-        finally_k = kwargs.pop('finally_k', k)
         ret.sort(key=lambda x: x[1], reverse=True)
         ret = ret[:finally_k]
         logger.debug(f'ElasticsearchWithPermissionCheck Search finally results: {len(ret)}')
         return ret
 
+    def _get_version_num(self) -> int:
+        """ es服务的主版本号, 只查询一次 """
+        if self._version_num is None:
+            version_num = self.client.info()['version']['number'][0]
+            self._version_num = int(version_num)
+        return self._version_num
+
+    async def _aget_version_num(self, async_client: Any) -> int:
+        """ 异步获取es服务的主版本号, 和同步方法共用缓存 """
+        if self._version_num is None:
+            version_num = (await async_client.info())['version']['number'][0]
+            self._version_num = int(version_num)
+        return self._version_num
+
+    def _get_async_client(self) -> Any:
+        """ 相同连接配置的实例共用进程内的异步客户端, 避免每个实例都创建连接池 """
+        return _get_async_es_client(self.elasticsearch_url, self.ssl_verify)
+
     def add_texts(
             self,
             texts: Iterable[str],
@@ -621,8 +874,7 @@ class ElasticsearchWithPermissionCheck(VectorStore, ABC):
         return vectorsearch
 
     def client_search(self, client: Any, index_name: str, script_query: Dict, size: int) -> Any:
-        version_num = client.info()['version']['number'][0]
-        version_num = int(version_num)
+        version_num = self._get_version_num()
         if version_num >= 8:
             response = client.search(index=index_name, query=script_query, size=size)
         else:
@@ -5,11 +5,13 @@ from typing import Optional
 from bisheng.api import router, router_rpc
 from bisheng.database.init_data import init_default_data
 from bisheng.interface.utils import setup_llm_caching
+from bisheng.interface.vector_store.custom import close_async_es_clients
 from bisheng.services.utils import initialize_services, teardown_services
 from bisheng.settings import settings
 from bisheng.utils.http_middleware import CustomMiddleware
 from bisheng.utils.logger import configure
 from bisheng.utils.threadpool import thread_pool
+from bisheng_langchain.embeddings.host_embedding import close_async_clients as close_embedding_clients
 from fastapi import FastAPI, HTTPException, Request, status
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
@@ -52,6 +54,8 @@ async def lifespan(app: FastAPI):
     init_default_data()
     # LangfuseInstance.update()
     yield
+    await close_async_es_clients()
+    await close_embedding_clients()
     teardown_services()
     thread_pool.tear_down()
 
@@ -1,19 +1,26 @@
+import json
 from abc import abstractmethod
 from contextlib import AsyncExitStack, asynccontextmanager
 from typing import Any
 
 from mcp import ClientSession
 
+from bisheng.utils import md5_hash
+
 
 class BaseMcpClient(object):
     """
     Base class for MCP clients.
+    Tool calls go through the process wide session pool, clients with the same config share one session.
     """
 
     def __init__(self, **kwargs):
         self.exit_stack = AsyncExitStack()
 
         self.client_session: ClientSession | None = None
+        # 相同配置的客户端复用会话池内的同一个会话
+        self.pool_key = md5_hash(json.dumps({'client': self.__class__.__name__, **kwargs},
+                                            sort_keys=True, ensure_ascii=False, default=str))
 
     @abstractmethod
     async def get_transport(self):
@@ -29,18 +36,31 @@ class BaseMcpClient(object):
                 await session.initialize()
                 yield session
 
-    async def list_tools(self):
-        async with self.initialize() as client_session:
-            tools = await client_session.list_tools()
-        return tools.tools
+    async def list_tools(self, use_cache: bool = True):
+        from bisheng.mcp_manage.pool import mcp_session_pool
+
+        return await mcp_session_pool.list_tools(self, use_cache=use_cache)
 
     async def call_tool(self, name: str, arguments: dict[str, Any] | None = None) -> str:
         """
         Call a tool.
         """
-        async with self.initialize() as client_session:
-            try:
-                resp = await client_session.call_tool(name, arguments)
-            except Exception as e:
-                return f"Tool call failed: {str(e)}"
+        from bisheng.mcp_manage.pool import mcp_session_pool
+
+        try:
+            resp = await mcp_session_pool.call_tool(self, name, arguments)
+        except Exception as e:
+            return f"Tool call failed: {str(e)}"
+        return resp.model_dump_json()
+
+    def sync_call_tool(self, name: str, arguments: dict[str, Any] | None = None) -> str:
+        """
+        Call a tool from sync code, the call runs in the session pool's event loop.
+        """
+        from bisheng.mcp_manage.pool import mcp_session_pool
+
+        try:
+            resp = mcp_session_pool.sync_call_tool(self, name, arguments)
+        except Exception as e:
+            return f"Tool call failed: {str(e)}"
         return resp.model_dump_json()
@@ -1,6 +1,3 @@
-import asyncio
-import concurrent
-import concurrent.futures
 from typing import Any, Type
 
 from langchain_core.tools import StructuredTool
@@ -63,11 +60,8 @@ class McpTool(BaseModel):
     mcp_tool_name: str
 
     def run(self, *args, **kwargs: Any) -> Any:
-        # todo call async method better when using in event pool
-        with concurrent.futures.ThreadPoolExecutor() as pool:
-            future = pool.submit(asyncio.run, self.arun(*args, **kwargs))
-            resp = future.result()
-        return resp
+        # 会话池在后台事件循环中执行调用, 不需要再为每次调用创建新的事件循环
+        return self.mcp_client.sync_call_tool(self.mcp_tool_name, kwargs)
 
     async def arun(self, *args, **kwargs: Any) -> Any:
         """Use the tool asynchronously."""
@@ -0,0 +1,236 @@
+import asyncio
+import atexit
+import concurrent.futures
+import os
+import threading
+import time
+from typing import Any, Awaitable, Dict, Optional
+
+import anyio
+from cachetools import TTLCache
+from loguru import logger
+from mcp import ClientSession
+
+# 这些异常说明连接已经断开, 需要重新建立会话
+_DISCONNECT_ERRORS = (anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream,
+                      ConnectionError, OSError)
+
+
+class McpSession:
+    """
+    一个保持连接的mcp会话
+    transport 和 ClientSession 的上下文必须在同一个task里进入和退出, 所以由单独的task持有连接, 直到被关闭
+    """
+
+    def __init__(self, client, max_concurrency: int):
+        self.client = client
+        self.session: Optional[ClientSession] = None
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_use = 0
+        self.last_used = time.monotonic()
+        self.last_checked = time.monotonic()
+        self._ready = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._error: Optional[BaseException] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and not self._closing.is_set()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+        await self._ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    async def _run(self):
+        try:
+            async with self.client.initialize() as session:
+                self.session = session
+                self._ready.set()
+                await self._closing.wait()
+        except BaseException as e:
+            if not self._ready.is_set():
+                self._error = e
+            else:
+                logger.warning(f'mcp session closed: {self.client.pool_key} {e!r}')
+        finally:
+            self.session = None
+            self._closing.set()
+            self._ready.set()
+
+    async def close(self, timeout: float = 5):
+        self._closing.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, timeout)
+            except BaseException as e:
+                logger.warning(f'mcp session close error: {e!r}')
+
+
+class McpSessionPool:
+    """
+    mcp会话池, 相同配置的mcp服务复用已经初始化好的会话, 不再每次调用都启动子进程或者建立新的sse连接
+    所有会话运行在一个后台事件循环内, 调用方不论在哪个线程或者事件循环里都可以使用
+    - 每个服务最多 max_concurrency 个并发调用
+    - 空闲超过 idle_timeout 秒的会话会被关闭, 空闲超过 health_check_interval 秒的会话会ping检查
+    - 连接断开的会话会被丢弃, list_tools 自动重连重试一次
+      call_tool 不重试, 请求可能已经被服务端执行, 重试会重复执行有副作用的工具
+    - list_tools 的结果缓存 tools_ttl 秒
+    - 工具调用超过 call_timeout 秒未返回时取消调用
+    """
+
+    def __init__(self, max_concurrency: int = 8, idle_timeout: float = 300,
+                 health_check_interval: float = 60, tools_ttl: float = 300, call_timeout: float = 300):
+        self.max_concurrency = max_concurrency
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.call_timeout = call_timeout
+        self._sessions: Dict[str, McpSession] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._tools_cache = TTLCache(maxsize=1024, ttl=tools_ttl)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        pid = os.getpid()
+        if self._pid == pid:
+            return self._loop
+        with self._lock:
+            if self._pid != pid:
+                # fork出来的子进程不能使用父进程的事件循环和连接
+                self._sessions = {}
+                self._locks = {}
+                self._tools_cache.clear()
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=self._run_loop, args=(loop,), name='mcp-session-pool',
+                                 daemon=True).start()
+                self._loop = loop
+                self._pid = pid
+        return self._loop
+
+    def _run_loop(self, loop: asyncio.AbstractEventLoop):
+        asyncio.set_event_loop(loop)
+        loop.create_task(self._maintain())
+        loop.run_forever()
+
+    def submit(self, coro: Awaitable):
+        """ 把协程提交到后台事件循环执行, 返回 concurrent.futures.Future """
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    async def _maintain(self):
+        """ 定时关闭空闲的会话, 检查长时间未使用的会话是否可用 """
+        interval = max(1.0, min(self.idle_timeout, self.health_check_interval) / 2)
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for key, session in list(self._sessions.items()):
+                if session.in_use:
+                    continue
+                if not session.alive or now - session.last_used > self.idle_timeout:
+                    await self._discard(key, session)
+                elif now - session.last_checked > self.health_check_interval:
+                    session.last_checked = now
+                    try:
+                        await asyncio.wait_for(session.session.send_ping(), 10)
+                    except BaseException as e:
+                        logger.warning(f'mcp session health check failed: {key} {e!r}')
+                        await self._discard(key, session)
+
+    async def _discard(self, key: str, session: McpSession):
+        if self._sessions.get(key) is session:
+            self._sessions.pop(key, None)
+        await session.close()
+
+    async def _acquire(self, client) -> McpSession:
+        key = client.pool_key
+        session = self._sessions.get(key)
+        if session is not None and session.alive:
+            return session
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            session = self._sessions.get(key)
+            if session is not None and session.alive:
+                return session
+            if session is not None:
+                await self._discard(key, session)
+            session = McpSession(client, self.max_concurrency)
+            await session.start()
+            self._sessions[key] = session
+            return session
+
+    async def _execute(self, client, method: str, *args, retry: bool = False) -> Any:
+        """ retry: 连接断开时是否重连后重试一次, 只有幂等的请求可以重试 """
+        for attempt in range(2 if retry else 1):
+            session = await self._acquire(client)
+            async with session.semaphore:
+                session.in_use += 1
+                try:
+                    return await getattr(session.session, method)(*args)
+                except Exception as e:
+                    # 给连接的task一次机会感知到断开
+                    await asyncio.sleep(0)
+                    if session.alive and not isinstance(e, _DISCONNECT_ERRORS):
+                        raise
+                    # 断开的会话不再使用, 下次调用重新建立连接
+                    await self._discard(client.pool_key, session)
+                    if attempt or not retry:
+                        raise
+                    logger.warning(f'mcp session disconnected, reconnect: {client.pool_key} {e!r}')
+                finally:
+                    session.in_use -= 1
+                    session.last_used = time.monotonic()
+
+    async def _list_tools(self, client, use_cache: bool):
+        key = client.pool_key
+        if use_cache and key in self._tools_cache:
+            return self._tools_cache[key]
+        tools = (await self._execute(client, 'list_tools', retry=True)).tools
+        self._tools_cache[key] = tools
+        return tools
+
+    async def list_tools(self, client, use_cache: bool = True):
+        return await asyncio.wrap_future(self.submit(self._list_tools(client, use_cache)))
+
+    async def _call_tool(self, client, name: str, arguments: dict[str, Any] | None, timeout: float):
+        try:
+            return await asyncio.wait_for(self._execute(client, 'call_tool', name, arguments), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f'mcp tool call timeout after {timeout}s: {name}')
+
+    async def call_tool(self, client, name: str, arguments: dict[str, Any] | None = None,
+                        timeout: Optional[float] = None):
+        timeout = timeout or self.call_timeout
+        return await asyncio.wrap_future(self.submit(self._call_tool(client, name, arguments, timeout)))
+
+    def sync_call_tool(self, client, name: str, arguments: dict[str, Any] | None = None,
+                       timeout: Optional[float] = None):
+        timeout = timeout or self.call_timeout
+        future = self.submit(self._call_tool(client, name, arguments, timeout))
+        try:
+            # 后台事件循环内已经有超时控制, 这里多等一会, 避免事件循环阻塞时调用方一直等待
+            return future.result(timeout + 5)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f'mcp tool call timeout after {timeout}s: {name}')
+
+    async def _close_all(self):
+        sessions = list(self._sessions.items())
+        self._sessions = {}
+        for key, session in sessions:
+            await session.close()
+
+    def close(self, timeout: float = 10):
+        """ 进程退出时关闭所有会话, 让stdio的子进程正常退出 """
+        if self._pid != os.getpid() or not self._sessions:
+            return
+        try:
+            self.submit(self._close_all()).result(timeout)
+        except Exception as e:
+            logger.warning(f'close mcp session pool error: {e!r}')
+
+
+mcp_session_pool = McpSessionPool()
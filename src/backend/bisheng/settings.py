@@ -1,6 +1,9 @@
+import copy
 import json
 import os
 import re
+import threading
+import time
 from typing import Dict, List, Optional, Union
 
 import yaml
@@ -84,6 +87,7 @@ class ObjectStore(BaseModel):
 class WorkflowConf(BaseModel):
     max_steps: int = Field(default=50, description="节点运行最大步数")
     timeout: int = Field(default=720, description="节点超时时间（min）")
+    max_batch_concurrency: int = Field(default=5, description="节点批量执行时的最大并发数")
 
 
 class Settings(BaseModel):
@@ -203,7 +207,7 @@ class Settings(BaseModel):
     def get_knowledge(self):
         # 由于分布式的要求，可变更的配置存储于mysql，因此读取配置每次从mysql中读取
         all_config = self.get_all_config()
-        ret = all_config.get('knowledges', {})
+        ret = copy.deepcopy(all_config.get('knowledges', {}))
         # milvus、 es、minio配置从环境变量获取
         ret.update({
             "vectorstores": {
@@ -232,7 +236,7 @@ class Settings(BaseModel):
     def get_default_llm(self):
         # 由于分布式的要求，可变更的配置存储于mysql，因此读取配置每次从mysql中读取
         all_config = self.get_all_config()
-        return all_config.get('default_llm', {})
+        return copy.deepcopy(all_config.get('default_llm', {}))
 
     def get_password_conf(self) -> PasswordConf:
         # 获取密码相关的配置项
@@ -254,26 +258,18 @@ class Settings(BaseModel):
     def get_from_db(self, key: str):
         # 先获取所有的key
         all_config = self.get_all_config()
-        return all_config.get(key, {})
+        return copy.deepcopy(all_config.get(key, {}))
 
-    def get_all_config(self):
-        from bisheng.database.base import session_getter
-        from bisheng.cache.redis import redis_client
-        from bisheng.database.models.config import Config
+    def get_all_config(self) -> Dict:
+        """
+        获取数据库内的系统配置, 返回的是进程内的只读快照, 调用方不要修改返回值
+        配置变更时通过redis内的版本号感知, 每个进程最多每 check_interval 秒检查一次版本号
+        """
+        return config_snapshot.get()
 
-        redis_key = 'config:initdb_config'
-        cache = redis_client.get(redis_key)
-        if cache:
-            return yaml.safe_load(cache)
-        else:
-            with session_getter() as session:
-                initdb_config = session.exec(
-                    select(Config).where(Config.key == 'initdb_config')).first()
-                if initdb_config:
-                    redis_client.set(redis_key, initdb_config.value, 100)
-                    return yaml.safe_load(initdb_config.value)
-                else:
-                    raise Exception('initdb_config not found, please check your system config')
+    def refresh_all_config(self):
+        """ 系统配置变更后调用, 递增版本号通知所有进程重新加载配置 """
+        config_snapshot.bump_version()
 
     def update_from_yaml(self, file_path: str, dev: bool = False):
         new_settings = load_settings_from_yaml(file_path)
@@ -324,6 +320,77 @@ def env_var_constructor(loader, node):
 yaml.SafeLoader.add_constructor('!env', env_var_constructor)
 
 
+class ConfigSnapshot:
+    """
+    数据库内系统配置(initdb_config)的进程内快照
+    快照带有版本号, 版本号存储在redis内, 保存配置时递增。
+    读取配置时只有超过 check_interval 秒才会去redis检查一次版本号, 版本号变化或者超过 max_age 秒才重新从数据库加载
+    """
+
+    version_key = 'config:initdb_config:version'
+    # 兼容旧版本进程使用的配置缓存
+    cache_key = 'config:initdb_config'
+
+    def __init__(self, check_interval: float = 5, max_age: float = 100):
+        self.check_interval = check_interval
+        # 版本号不变时也定期重新加载, 兼容直接修改数据库的场景
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._data: Optional[Dict] = None
+        self._version: Optional[int] = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+
+    @property
+    def version(self) -> Optional[int]:
+        return self._version
+
+    def _get_remote_version(self) -> Optional[int]:
+        from bisheng.cache.redis import redis_client
+        try:
+            return redis_client.get_int(self.version_key)
+        except Exception as e:
+            logger.warning(f'get config version error: {e}')
+            return self._version
+
+    def _load(self) -> Dict:
+        from bisheng.database.base import session_getter
+        from bisheng.database.models.config import Config
+
+        with session_getter() as session:
+            initdb_config = session.exec(
+                select(Config).where(Config.key == 'initdb_config')).first()
+        if not initdb_config:
+            raise Exception('initdb_config not found, please check your system config')
+        return yaml.safe_load(initdb_config.value) or {}
+
+    def get(self) -> Dict:
+        now = time.monotonic()
+        if self._data is not None and now - self._checked_at < self.check_interval:
+            return self._data
+        with self._lock:
+            if self._data is not None and now - self._checked_at < self.check_interval:
+                return self._data
+            version = self._get_remote_version()
+            if self._data is None or version != self._version or now - self._loaded_at >= self.max_age:
+                self._data = self._load()
+                self._version = version
+                self._loaded_at = now
+                logger.debug(f'load initdb_config version={version}')
+            self._checked_at = now
+            return self._data
+
+    def bump_version(self) -> int:
+        from bisheng.cache.redis import redis_client
+
+        redis_client.delete(self.cache_key)
+        version = redis_client.incr(self.version_key, expiration=None)
+        with self._lock:
+            # 当前进程立即失效, 其他进程最多延迟 check_interval 秒
+            self._data = None
+        return version
+
+
 def save_settings_to_yaml(settings: Settings, file_path: str):
     # Check if a string is a valid path or a file name
     if '/' not in file_path:
@@ -420,3 +487,4 @@ def decrypt_token(token: str):
 
 config_file = os.getenv('config', 'config.yaml')
 settings = load_settings_from_yaml(config_file)
+config_snapshot = ConfigSnapshot()
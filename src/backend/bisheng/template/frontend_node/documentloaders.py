@@ -385,7 +385,8 @@ def build_pdf_semantic_loader_fields():
     #     text_elem_sep: str = '\n',
     #     start: int = 0,
     #     n: int = None,
-    #     verbose: bool = False
+    #     verbose: bool = False,
+    #     parallelism: int = 1
     file_path = TemplateField(field_type='file',
                               required=True,
                               show=True,
@@ -460,9 +461,16 @@ def build_pdf_semantic_loader_fields():
                             name='verbose',
                             value='False',
                             display_name='verbose')
+    parallelism = TemplateField(field_type='int',
+                                required=False,
+                                show=True,
+                                advanced=True,
+                                name='parallelism',
+                                value=1,
+                                display_name='parallelism')
 
     return (file_path, password, layout_api_key, layout_api_url, n, verbose, is_join_table,
-            with_columns, support_rotate, text_elem_sep, start)
+            with_columns, support_rotate, text_elem_sep, start, parallelism)
 
 
 def build_directory_loader_fields():
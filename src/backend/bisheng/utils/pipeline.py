@@ -0,0 +1,137 @@
+import contextvars
+import queue
+import threading
+from typing import Any, Callable, Iterable, List, Optional
+
+from loguru import logger
+
+# 阶段结束的标记
+_STOP = object()
+
+
+class PipelineStage:
+    """ 流水线中的一个阶段, 每个阶段拥有独立的并发数和有界队列 """
+
+    def __init__(self, name: str, func: Callable[[Any], Any], workers: int = 1,
+                 queue_size: int = None):
+        """
+        name: 阶段名称, 用于日志和线程名
+        func: 处理函数, 入参为上一个阶段的输出, 返回值会传给下一个阶段
+        workers: 阶段的并发线程数
+        queue_size: 阶段输入队列的长度, 队列满时上游阶段会阻塞, 默认为 workers * 2
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers or 1))
+        self.queue = queue.Queue(maxsize=queue_size or self.workers * 2)
+        self._finished_workers = 0
+        self._lock = threading.Lock()
+
+    def worker_finished(self) -> bool:
+        """ 记录一个线程退出, 返回是否所有线程都已退出 """
+        with self._lock:
+            self._finished_workers += 1
+            return self._finished_workers == self.workers
+
+
+class StagePipeline:
+    """
+    多阶段流水线: item 依次经过每个阶段, 各阶段并发执行, 通过有界队列实现背压。
+    某个 item 在任一阶段失败后不再进入后续阶段, 直接以异常回调 on_done。
+    阶段中抛出 BaseException(如 SystemExit) 时流水线中止, 剩余的 item 都以该异常回调 on_done, run 结束后抛出该异常
+    """
+
+    def __init__(self,
+                 stages: List[PipelineStage],
+                 on_done: Callable[[Any, Optional[BaseException]], None] = None,
+                 thread_name_prefix: str = 'pipeline'):
+        if not stages:
+            raise ValueError('pipeline stages is empty')
+        self.stages = stages
+        self.on_done = on_done
+        self.thread_name_prefix = thread_name_prefix
+        # on_done 回调串行执行, 避免调用方处理并发
+        self._done_lock = threading.Lock()
+        # 导致流水线中止的异常
+        self._fatal_error: Optional[BaseException] = None
+
+    def _finish(self, item: Any, error: Optional[BaseException]):
+        if self.on_done is None:
+            return
+        with self._done_lock:
+            try:
+                self.on_done(item, error)
+            except Exception:
+                logger.exception('pipeline on_done callback error')
+
+    def _stage_worker(self, index: int):
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        try:
+            while True:
+                try:
+                    self._stage_loop(stage, next_stage)
+                    break
+                except BaseException as e:
+                    # 如 on_done 回调中的 BaseException, 记录后继续消费队列, 否则上游会阻塞在已满的队列上
+                    logger.exception(f'pipeline_stage_worker_error stage={stage.name}')
+                    if self._fatal_error is None:
+                        self._fatal_error = e
+        finally:
+            # 本阶段所有线程退出后, 通知下一个阶段结束, 线程异常退出时也要通知, 否则下游会一直等待
+            if stage.worker_finished() and next_stage is not None:
+                for _ in range(next_stage.workers):
+                    next_stage.queue.put(_STOP)
+
+    def _stage_loop(self, stage: PipelineStage, next_stage: Optional[PipelineStage]):
+        while True:
+            item = stage.queue.get()
+            if item is _STOP:
+                break
+            if self._fatal_error is not None:
+                # 流水线已中止, 继续消费队列避免上游阻塞, item 直接以中止的异常结束
+                self._finish(item, self._fatal_error)
+                continue
+            try:
+                output = stage.func(item)
+            except Exception as e:
+                logger.exception(f'pipeline_stage_error stage={stage.name}')
+                self._finish(item, e)
+                continue
+            except BaseException as e:
+                logger.exception(f'pipeline_stage_fatal_error stage={stage.name}')
+                if self._fatal_error is None:
+                    self._fatal_error = e
+                self._finish(item, e)
+                continue
+            if next_stage is None:
+                self._finish(output, None)
+            else:
+                next_stage.queue.put(output)
+
+    def run(self, items: Iterable[Any]):
+        """ 阻塞执行, 直到所有的 item 处理完成 """
+        self._fatal_error = None
+        threads = []
+        for index, stage in enumerate(self.stages):
+            for i in range(stage.workers):
+                # 复制上下文, 保证线程内日志的trace_id和调用方一致
+                ctx = contextvars.copy_context()
+                t = threading.Thread(target=ctx.run,
+                                     args=(self._stage_worker, index),
+                                     name=f'{self.thread_name_prefix}-{stage.name}-{i}',
+                                     daemon=True)
+                t.start()
+                threads.append(t)
+
+        first_stage = self.stages[0]
+        try:
+            for item in items:
+                first_stage.queue.put(item)
+        finally:
+            for _ in range(first_stage.workers):
+                first_stage.queue.put(_STOP)
+            for t in threads:
+                t.join()
+        if self._fatal_error is not None:
+            raise self._fatal_error
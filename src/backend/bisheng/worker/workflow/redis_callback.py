@@ -1,9 +1,10 @@
 import os
-import asyncio
 import json
+import threading
 import time
 import uuid
-from typing import AsyncIterator
+from collections import deque
+from typing import AsyncIterator, Callable, Dict, List
 
 from cachetools import TTLCache
 from langchain_core.documents import Document
@@ -13,7 +14,7 @@ from bisheng.api.errcode.flow import WorkFlowNodeRunMaxTimesError, WorkFlowWaitU
     WorkFlowNodeUpdateError, WorkFlowVersionUpdateError, WorkFlowTaskBusyError
 from bisheng.api.v1.schema.workflow import WorkflowEventType
 from bisheng.api.v1.schemas import ChatResponse
-from bisheng.cache.redis import redis_client
+from bisheng.cache.redis import async_redis_client, redis_client
 from bisheng.chat.utils import sync_judge_source, sync_process_source_document
 from bisheng.database.models.flow import FlowDao, FlowType
 from bisheng.database.models.message import ChatMessageDao, ChatMessage
@@ -26,7 +27,81 @@ from bisheng.workflow.common.workflow import WorkflowStatus
 
 
 
+class StreamMsgCoalescer:
+    """
+    合并流式输出的token, 减少写入redis的次数
+    每个 (unique_id, node_id, output_key) 的第一个token立即发送, 之后的token在时间窗口内合并后发送
+    """
+
+    def __init__(self, send_func: Callable[[StreamMsgData], None], interval: float = 0.2,
+                 max_size: int = 512):
+        """
+        send_func: 发送合并后的流式消息
+        interval: 合并的时间窗口(秒)
+        max_size: 缓存的内容超过此长度时立即发送
+        """
+        self.send_func = send_func
+        self.interval = interval
+        self.max_size = max_size
+        self._buffers: Dict[tuple, StreamMsgData] = {}
+        self._last_send: Dict[tuple, float] = {}
+        self._timers: Dict[tuple, threading.Timer] = {}
+        # 节点批量执行时会有多个线程同时输出
+        self._lock = threading.RLock()
+
+    def add(self, data: StreamMsgData):
+        key = (data.unique_id, data.node_id, data.output_key)
+        with self._lock:
+            buffered = self._buffers.get(key)
+            if buffered is None:
+                buffered = data.model_copy()
+                self._buffers[key] = buffered
+            else:
+                buffered.msg = (buffered.msg or '') + (data.msg or '')
+                if data.reasoning_content:
+                    buffered.reasoning_content = (buffered.reasoning_content or '') + data.reasoning_content
+
+            elapsed = time.time() - self._last_send.get(key, 0)
+            size = len(buffered.msg or '') + len(buffered.reasoning_content or '')
+            if elapsed >= self.interval or size >= self.max_size:
+                self._send(key)
+            elif key not in self._timers:
+                # 时间窗口结束后, 即使没有新的token也要把缓存的内容发送出去
+                timer = threading.Timer(self.interval - elapsed, self.flush, args=(key,))
+                timer.daemon = True
+                self._timers[key] = timer
+                timer.start()
+
+    def _send(self, key: tuple):
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        data = self._buffers.pop(key, None)
+        self._last_send[key] = time.time()
+        if data:
+            self.send_func(data)
+
+    def flush(self, key: tuple = None):
+        """ 发送缓存的内容, 不指定key时发送全部, 并重置时间窗口 """
+        with self._lock:
+            if key is not None:
+                self._send(key)
+                return
+            for one in list(self._buffers.keys()):
+                self._send(one)
+            self._last_send.clear()
+
+
 class RedisCallback(BaseCallback):
+    # 状态变化时写入事件队列的标记, 用来唤醒阻塞等待事件的消费者
+    status_event_category = '__workflow_status__'
+    # 阻塞等待事件的超时时间(秒), 超时后重新检查一次workflow的状态
+    event_block_timeout = 5
+    # 一次最多取出的事件数
+    event_batch_size = 100
+    # 流式输出合并的时间窗口(秒)和最大长度
+    stream_flush_interval = 0.2
+    stream_flush_size = 512
 
     def __init__(self, unique_id: str, workflow_id: str, chat_id: str, user_id: str):
         super(RedisCallback, self).__init__()
@@ -42,12 +117,24 @@ class RedisCallback(BaseCallback):
         self.workflow_cache: TTLCache = TTLCache(maxsize=1024, ttl=10)
 
         self.redis_client = redis_client
+        self.async_redis_client = async_redis_client
         self.workflow_data_key = f'workflow:{unique_id}:data'
         self.workflow_status_key = f'workflow:{unique_id}:status'
         self.workflow_event_key = f'workflow:{unique_id}:event'
         self.workflow_input_key = f'workflow:{unique_id}:input'
         self.workflow_stop_key = f'workflow:{unique_id}:stop'
-        self.workflow_expire_time = settings.get_workflow_conf().timeout * 60 + 60
+        # workflow 等待用户输入时持久化的运行状态
+        self.workflow_checkpoint_key = f'workflow:{unique_id}:checkpoint'
+        self.workflow_input_timeout = settings.get_workflow_conf().timeout * 60
+        self.workflow_expire_time = self.workflow_input_timeout + 60
+
+        # 已经从redis中取出, 还未消费的事件
+        self._event_buffer: deque = deque()
+        self._last_status = None
+
+        self._stream_coalescer = StreamMsgCoalescer(self._send_stream_msg,
+                                                    interval=self.stream_flush_interval,
+                                                    max_size=self.stream_flush_size)
 
     def set_workflow_data(self, data: dict):
         self.redis_client.set(self.workflow_data_key, data, expiration=self.workflow_expire_time)
@@ -55,15 +142,39 @@ class RedisCallback(BaseCallback):
     def get_workflow_data(self) -> dict:
         return self.redis_client.get(self.workflow_data_key)
 
-    def set_workflow_status(self, status: int, reason: str = None):
+    def set_workflow_status(self, status: int, reason: str = None, expiration: int = None):
+        # 状态变化前先把缓存的流式输出发送出去
+        self._stream_coalescer.flush()
         self.redis_client.set(self.workflow_status_key,
                               {'status': status, 'reason': reason, 'time': time.time()},
-                              expiration=None)
+                              expiration=expiration)
         self.workflow_cache.clear()
+        # 状态变化时通知等待事件的消费者, 重复刷新状态时间的不需要通知
+        if status != self._last_status:
+            self._last_status = status
+            self.insert_workflow_response({'category': self.status_event_category, 'status': status})
         if status in [WorkflowStatus.FAILED.value, WorkflowStatus.SUCCESS.value]:
             # 消息事件和状态key可能还需要消费
             self.redis_client.delete(self.workflow_data_key)
             self.redis_client.delete(self.workflow_input_key)
+            self.redis_client.delete(self.workflow_checkpoint_key)
+
+    def set_workflow_checkpoint(self, workflow_data: dict, state: dict):
+        """ 保存等待用户输入的workflow运行状态, 超过等待时间后自动过期 """
+        self.redis_client.set(self.workflow_checkpoint_key, state, expiration=self.workflow_input_timeout)
+        # 延长workflow数据的过期时间, 恢复执行时需要用来重建workflow
+        self.set_workflow_data(workflow_data)
+
+    def pop_workflow_checkpoint(self) -> dict | None:
+        """ 获取并删除运行状态, 保证同一个暂停点只会被一个任务恢复 """
+        ret = self.redis_client.get(self.workflow_checkpoint_key)
+        if ret and not self.redis_client.delete(self.workflow_checkpoint_key):
+            # 已经被其他任务取走了
+            return None
+        return ret
+
+    def has_workflow_checkpoint(self) -> bool:
+        return bool(self.redis_client.exists(self.workflow_checkpoint_key))
 
     def get_workflow_status(self, user_cache: bool = True) -> dict | None:
         # if user_cache and self.workflow_cache.get(self.workflow_status_key):
@@ -72,26 +183,92 @@ class RedisCallback(BaseCallback):
         self.workflow_cache.setdefault(self.workflow_status_key, workflow_status)
         return workflow_status
 
+    async def aget_workflow_status(self) -> dict | None:
+        workflow_status = await self.async_redis_client.get(self.workflow_status_key)
+        self.workflow_cache.setdefault(self.workflow_status_key, workflow_status)
+        return workflow_status
+
     def clear_workflow_status(self):
         self.redis_client.delete(self.workflow_status_key)
         self.redis_client.delete(self.workflow_stop_key)
         self.redis_client.delete(self.workflow_data_key)
+        self.redis_client.delete(self.workflow_checkpoint_key)
 
     def insert_workflow_response(self, event: dict):
         self.redis_client.rpush(self.workflow_event_key, json.dumps(event), expiration=self.workflow_expire_time)
 
-    def get_workflow_response(self) -> ChatResponse | None:
-        response = self.redis_client.lpop(self.workflow_event_key)
-        if response:
-            response = ChatResponse(**json.loads(response))
-            if ((response.category == WorkflowEventType.NodeRun.value and response.type == 'end'
-                 and response.message and response.message.get('node_id', '').startswith('end_')) or
-                    (response.category in [WorkflowEventType.UserInput.value, WorkflowEventType.OutputWithChoose.value
-                        , WorkflowEventType.OutputWithInput.value])):
-                # 如果是结束节点或者输入事件，清空状态缓存
-                self.workflow_cache.clear()
+    def parse_workflow_response(self, response: str | bytes) -> ChatResponse | None:
+        """ 解析事件, 状态变化的标记返回None """
+        response = json.loads(response)
+        if response.get('category') == self.status_event_category:
+            return None
+        response = ChatResponse(**response)
+        if ((response.category == WorkflowEventType.NodeRun.value and response.type == 'end'
+             and response.message and response.message.get('node_id', '').startswith('end_')) or
+                (response.category in [WorkflowEventType.UserInput.value, WorkflowEventType.OutputWithChoose.value
+                    , WorkflowEventType.OutputWithInput.value])):
+            # 如果是结束节点或者输入事件，清空状态缓存
+            self.workflow_cache.clear()
         return response
 
+    def get_workflow_response(self) -> ChatResponse | None:
+        while True:
+            if self._event_buffer:
+                response = self._event_buffer.popleft()
+            else:
+                response = self.redis_client.lpop(self.workflow_event_key)
+            if not response:
+                return None
+            response = self.parse_workflow_response(response)
+            if response:
+                return response
+
+    async def afetch_workflow_events(self, block_timeout: int = 0) -> bool:
+        """
+        批量从redis中取出事件放到缓冲区
+        block_timeout: 大于0时, 没有事件则阻塞等待直到有新事件或者超时
+        return: 缓冲区是否有事件
+        """
+        if self._event_buffer:
+            return True
+        if block_timeout > 0:
+            first = await self.async_redis_client.blpop(self.workflow_event_key, block_timeout)
+            if not first:
+                return False
+            self._event_buffer.append(first)
+        events = await self.async_redis_client.lpop(self.workflow_event_key, self.event_batch_size)
+        if events:
+            self._event_buffer.extend(events)
+        return bool(self._event_buffer)
+
+    async def aget_workflow_responses(self, block_timeout: int = 0) -> (List[ChatResponse], bool):
+        """
+        return: 事件列表, 是否收到了状态变化的通知
+        """
+        await self.afetch_workflow_events(block_timeout)
+        responses = []
+        status_changed = False
+        while self._event_buffer:
+            response = self.parse_workflow_response(self._event_buffer.popleft())
+            if response is None:
+                status_changed = True
+            else:
+                responses.append(response)
+        return responses, status_changed
+
+    async def adrain_workflow_responses(self) -> List[ChatResponse]:
+        """ 取出所有剩余的事件 """
+        ret = []
+        while True:
+            responses, status_changed = await self.aget_workflow_responses()
+            if not responses and not status_changed:
+                return ret
+            ret.extend(responses)
+
+    async def await_workflow_event(self, timeout: int = None):
+        """ 阻塞等待新的事件或者状态变化, 事件保留在缓冲区中等待消费 """
+        await self.afetch_workflow_events(timeout or self.event_block_timeout)
+
     def build_chat_response(self, category, category_type, message, extra=None, files=None):
         return ChatResponse(
             user_id=self.user_id,
@@ -128,18 +305,15 @@ class RedisCallback(BaseCallback):
 
     async def get_response_until_break(self) -> AsyncIterator[ChatResponse]:
         """ 不断获取workflow的response，直到遇到运行结束或者待输入 """
+        # get workflow status
+        status_info = await self.aget_workflow_status()
         while True:
-            # get workflow status
-            status_info = self.get_workflow_status()
             if not status_info:
                 yield self.build_chat_response(WorkflowEventType.Error.value, 'over',
                                                {'code': 500, 'message': 'workflow status not found'})
                 break
             elif status_info['status'] in [WorkflowStatus.FAILED.value, WorkflowStatus.SUCCESS.value]:
-                while True:
-                    chat_response = self.get_workflow_response()
-                    if not chat_response:
-                        break
+                for chat_response in await self.adrain_workflow_responses():
                     yield chat_response
                 if status_info['status'] == WorkflowStatus.FAILED.value:
                     error_resp = self.parse_workflow_failed(status_info)
@@ -147,11 +321,14 @@ class RedisCallback(BaseCallback):
                         yield error_resp
                 break
             elif status_info['status'] == WorkflowStatus.INPUT.value:
-                while True:
-                    chat_response = self.get_workflow_response()
-                    if not chat_response:
-                        break
+                for chat_response in await self.adrain_workflow_responses():
                     yield chat_response
+                # 暂停中的workflow没有任务在等待用户输入, 超时的判断在这里处理
+                if time.time() - status_info['time'] > self.workflow_input_timeout and \
+                        not self.has_workflow_checkpoint():
+                    self.set_workflow_status(WorkflowStatus.FAILED.value, 'workflow wait user input timeout')
+                    yield self.build_chat_response(WorkflowEventType.Error.value, 'over',
+                                                   {'code': WorkFlowWaitUserTimeoutError.Code, 'message': ''})
                 break
             elif status_info['status'] in [WorkflowStatus.WAITING.value, WorkflowStatus.INPUT_OVER.value] and time.time() - status_info['time'] > 10:
                 # 10秒内没有收到状态更新，说明workflow没有启动，可能是celery worker线程数已满
@@ -167,11 +344,12 @@ class RedisCallback(BaseCallback):
                 self.set_workflow_stop()
                 break
             else:
-                chat_response = self.get_workflow_response()
-                if not chat_response:
-                    await asyncio.sleep(1)
-                    continue
-                yield chat_response
+                # 阻塞等待新的事件, 收到状态变化的通知或者等待超时后再重新检查状态
+                responses, status_changed = await self.aget_workflow_responses(self.event_block_timeout)
+                for chat_response in responses:
+                    yield chat_response
+                if status_changed or not responses:
+                    status_info = await self.aget_workflow_status()
 
     def set_user_input(self, data: dict, message_id: int = None, message_content: str = None):
         if self.chat_id and message_id:
@@ -223,6 +401,9 @@ class RedisCallback(BaseCallback):
 
     def set_workflow_stop(self):
         self.redis_client.set(self.workflow_stop_key, 1, expiration=self.workflow_expire_time)
+        # 暂停中的workflow没有执行任务, 直接结束
+        if self.pop_workflow_checkpoint():
+            self.set_workflow_status(WorkflowStatus.FAILED.value, 'stop by user')
 
     def get_workflow_stop(self) -> bool | None:
         """ 为了可以及时停止workflow，不做内存的缓存 """
@@ -230,6 +411,11 @@ class RedisCallback(BaseCallback):
 
     def send_chat_response(self, chat_response: ChatResponse):
         """ 发送聊天消息 """
+        is_stream_chunk = chat_response.category == WorkflowEventType.StreamMsg.value and \
+                          chat_response.type == 'stream'
+        # 保证消息顺序, 其他事件发送前先把缓存的流式输出发送出去
+        if not is_stream_chunk:
+            self._stream_coalescer.flush()
         self.insert_workflow_response(chat_response.dict())
 
         # 判断下是否需要停止workflow, 流式输出时不判断，查询太频繁，而且也停不掉workflow
@@ -360,6 +546,9 @@ class RedisCallback(BaseCallback):
 
     def on_stream_msg(self, data: StreamMsgData):
         logger.debug(f'stream msg: {data}')
+        self._stream_coalescer.add(data)
+
+    def _send_stream_msg(self, data: StreamMsgData):
         self.send_chat_response(
             ChatResponse(message=data.dict(),
                          category=WorkflowEventType.StreamMsg.value,
@@ -10,50 +10,75 @@ from bisheng.workflow.common.workflow import WorkflowStatus
 from bisheng.workflow.graph.workflow import Workflow
 
 
+def _init_workflow(redis_callback: RedisCallback, workflow_id: str, user_id: str) -> (Workflow, dict):
+    # get workflow data
+    workflow_data = redis_callback.get_workflow_data()
+    if not workflow_data:
+        raise Exception('workflow data not found maybe data is expired')
+
+    # init workflow
+    workflow_conf = settings.get_workflow_conf()
+    workflow = Workflow(workflow_id, user_id, workflow_data, False,
+                        workflow_conf.max_steps,
+                        workflow_conf.timeout,
+                        redis_callback)
+    redis_callback.workflow = workflow
+    return workflow, workflow_data
+
+
+def _pause_workflow(redis_callback: RedisCallback, workflow: Workflow, workflow_data: dict) -> bool:
+    """ 持久化workflow的运行状态, 释放当前的执行任务, 收到用户输入后由 continue_workflow 恢复执行 """
+    try:
+        redis_callback.set_workflow_checkpoint(workflow_data, workflow.dump_state())
+    except Exception as e:
+        # 运行状态无法序列化时, 继续在当前任务中等待用户输入
+        logger.warning(f'workflow pause error, waiting input in task: {e}')
+        return False
+    redis_callback.set_workflow_status(WorkflowStatus.INPUT.value, expiration=redis_callback.workflow_expire_time)
+    logger.info('workflow paused, waiting user input')
+    return True
+
+
+def _run_workflow(redis_callback: RedisCallback, workflow: Workflow, workflow_data: dict,
+                  user_input: dict = None):
+    status, reason = workflow.run(user_input)
+    start_time = time.time()
+    first_input = True
+    # run workflow
+    while True:
+        logger.debug(f'workflow execute status: {workflow.status()}')
+        if workflow.status() in [WorkflowStatus.FAILED.value, WorkflowStatus.SUCCESS.value]:
+            redis_callback.set_workflow_status(status, reason)
+            break
+        elif workflow.status() == WorkflowStatus.INPUT.value:
+            if first_input:
+                if _pause_workflow(redis_callback, workflow, workflow_data):
+                    break
+                start_time = time.time()
+                first_input = False
+            redis_callback.set_workflow_status(status, reason)
+            time.sleep(1)
+            if time.time() - start_time > workflow.timeout * 60:
+                raise IgnoreException('workflow wait user input timeout')
+            if redis_callback.get_workflow_stop():
+                raise IgnoreException('workflow stop by user')
+            user_input = redis_callback.get_user_input()
+            if not user_input:
+                continue
+            redis_callback.set_workflow_status(WorkflowStatus.RUNNING.value)
+            status, reason = workflow.run(user_input)
+            first_input = True
+        else:
+            raise Exception(f'unexpected workflow status error: {status}')
+
+
 def _execute_workflow(unique_id: str, workflow_id: str, chat_id: str, user_id: str):
     redis_callback = RedisCallback(unique_id, workflow_id, chat_id, user_id)
     try:
         # update workflow status
         redis_callback.set_workflow_status(WorkflowStatus.RUNNING.value)
-        # get workflow data
-        workflow_data = redis_callback.get_workflow_data()
-        if not workflow_data:
-            raise Exception('workflow data not found maybe data is expired')
-
-        # init workflow
-        workflow_conf = settings.get_workflow_conf()
-        workflow = Workflow(workflow_id, user_id, workflow_data, False,
-                            workflow_conf.max_steps,
-                            workflow_conf.timeout,
-                            redis_callback)
-        redis_callback.workflow = workflow
-        start_time = time.time()
-        status, reason = workflow.run()
-        first_input = True
-        # run workflow
-        while True:
-            logger.debug(f'workflow execute status: {workflow.status()}')
-            if workflow.status() in [WorkflowStatus.FAILED.value, WorkflowStatus.SUCCESS.value]:
-                redis_callback.set_workflow_status(status, reason)
-                break
-            elif workflow.status() == WorkflowStatus.INPUT.value:
-                if first_input:
-                    start_time = time.time()
-                    first_input = False
-                redis_callback.set_workflow_status(status, reason)
-                time.sleep(1)
-                if time.time() - start_time > workflow.timeout * 60:
-                    raise IgnoreException('workflow wait user input timeout')
-                if redis_callback.get_workflow_stop():
-                    raise IgnoreException('workflow stop by user')
-                user_input = redis_callback.get_user_input()
-                if not user_input:
-                    continue
-                redis_callback.set_workflow_status(WorkflowStatus.RUNNING.value)
-                status, reason = workflow.run(user_input)
-                first_input = True
-            else:
-                raise Exception(f'unexpected workflow status error: {status}')
+        workflow, workflow_data = _init_workflow(redis_callback, workflow_id, user_id)
+        _run_workflow(redis_callback, workflow, workflow_data)
     except IgnoreException as e:
         logger.warning(f'execute_workflow ignore error: {e}')
         redis_callback.set_workflow_status(WorkflowStatus.FAILED.value, str(e))
@@ -62,8 +87,43 @@ def _execute_workflow(unique_id: str, workflow_id: str, chat_id: str, user_id: s
         redis_callback.set_workflow_status(WorkflowStatus.FAILED.value, str(e)[:100])
 
 
+def _continue_workflow(unique_id: str, workflow_id: str, chat_id: str, user_id: str):
+    redis_callback = RedisCallback(unique_id, workflow_id, chat_id, user_id)
+    try:
+        checkpoint = redis_callback.pop_workflow_checkpoint()
+        if not checkpoint:
+            status_info = redis_callback.get_workflow_status()
+            # 运行状态已过期, 说明等待用户输入超时了
+            if status_info and status_info['status'] == WorkflowStatus.INPUT_OVER.value:
+                raise IgnoreException('workflow wait user input timeout')
+            # 已经被其他任务恢复执行
+            logger.warning('workflow checkpoint not found, skip continue')
+            return
+        user_input = redis_callback.get_user_input()
+        redis_callback.set_workflow_status(WorkflowStatus.RUNNING.value)
+        if redis_callback.get_workflow_stop():
+            raise IgnoreException('workflow stop by user')
+        workflow, workflow_data = _init_workflow(redis_callback, workflow_id, user_id)
+        workflow.load_state(checkpoint)
+        logger.info('workflow resumed from checkpoint')
+        _run_workflow(redis_callback, workflow, workflow_data, user_input or {})
+    except IgnoreException as e:
+        logger.warning(f'continue_workflow ignore error: {e}')
+        redis_callback.set_workflow_status(WorkflowStatus.FAILED.value, str(e))
+    except Exception as e:
+        logger.exception('continue_workflow error')
+        redis_callback.set_workflow_status(WorkflowStatus.FAILED.value, str(e)[:100])
+
+
 @bisheng_celery.task
 def execute_workflow(unique_id: str, workflow_id: str, chat_id: str, user_id: str):
     """ 执行workflow """
     with logger.contextualize(trace_id=unique_id):
         _execute_workflow(unique_id, workflow_id, chat_id, user_id)
+
+
+@bisheng_celery.task
+def continue_workflow(unique_id: str, workflow_id: str, chat_id: str, user_id: str):
+    """ 收到用户输入后, 从持久化的运行状态中恢复执行workflow """
+    with logger.contextualize(trace_id=unique_id):
+        _continue_workflow(unique_id, workflow_id, chat_id, user_id)
@@ -1,4 +1,7 @@
-from typing import Optional, List, Any
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
 
 from pydantic import BaseModel, Field
 
@@ -57,48 +60,207 @@ class EdgeManage:
             return None
         return self.source_map[source]
 
-    def get_all_edges_nodes(self, start_node_id: str, end_node_id: str) -> List[List[str]]:
-        """ get all branch nodes from start node to end node """
-        branches = []
-        def get_node_branch(node_id, branch: List, node_map: dict):
-            # 已经遍历过的节点不再遍历，说明成环了
-            if node_id in node_map or node_id == end_node_id:
-                branch.append(node_id)
-                branches.append(branch)
-                return branch
-            branch.append(node_id)
-            node_map[node_id] = True
-            next_nodes = self.get_target_node(node_id)
-            if not next_nodes:
-                branches.append(branch)
-                return branch
-
-            for one_node in next_nodes:
-                tmp_node_map = node_map.copy()
-                tmp_branch = branch.copy()
-                get_node_branch(one_node, tmp_branch, tmp_node_map)
-            return branch
-        get_node_branch(start_node_id, [], {})
-        return branches
-
     def get_next_nodes(self, node_id: str, exclude: Optional[List[str]] = None) -> List[str] | None:
         """ get all next nodes by node id"""
-        # 获取直接的下游节点
-        output_nodes = self.get_target_node(node_id)
-        if not output_nodes:
-            return []
-        if not exclude:
-            exclude = [node_id]
-
-        # 排除指定的节点
-        for one in exclude:
-            if one in output_nodes:
-                output_nodes.remove(one)
-
-        exclude.extend(output_nodes)
-        for one in output_nodes:
-            next_nodes = self.get_next_nodes(one, exclude=exclude)
-            if next_nodes:
-                output_nodes.extend(next_nodes)
-
+        # 广度优先遍历所有可达的下游节点, 已访问的节点用集合判断
+        visited = set(exclude) if exclude else {node_id}
+        output_nodes = []
+        queue = deque([node_id])
+        while queue:
+            for one in self.get_target_node(queue.popleft()) or []:
+                if one in visited:
+                    continue
+                visited.add(one)
+                output_nodes.append(one)
+                queue.append(one)
         return output_nodes
+
+    def _get_strong_components(self, start_node_id: str) -> List[List[str]]:
+        """ tarjan算法计算从开始节点可达的强连通分量, 按拓扑序返回 """
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        components = []
+        counter = 0
+
+        index[start_node_id] = low[start_node_id] = counter
+        stack.append(start_node_id)
+        on_stack.add(start_node_id)
+        work = [(start_node_id, iter(self.get_target_node(start_node_id) or []))]
+        while work:
+            node_id, targets = work[-1]
+            for one in targets:
+                if one not in index:
+                    counter += 1
+                    index[one] = low[one] = counter
+                    stack.append(one)
+                    on_stack.add(one)
+                    work.append((one, iter(self.get_target_node(one) or [])))
+                    break
+                if one in on_stack:
+                    low[node_id] = min(low[node_id], index[one])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node_id])
+                if low[node_id] == index[node_id]:
+                    component = []
+                    while True:
+                        one = stack.pop()
+                        on_stack.discard(one)
+                        component.append(one)
+                        if one == node_id:
+                            break
+                    components.append(component)
+        components.reverse()
+        return components
+
+    def _get_component_distance(self, entry: str, component: set, max_steps: int) -> Dict[str, int] | None:
+        """ 强连通分量内, 从入口节点出发到每个节点的最长简单路径长度; 遍历次数超过max_steps返回None """
+        distance = {entry: 0}
+        path = {entry}
+        steps = 0
+        work = [(entry, iter(self.get_target_node(entry) or []))]
+        while work:
+            node_id, targets = work[-1]
+            for one in targets:
+                if one not in component or one in path:
+                    continue
+                steps += 1
+                if steps > max_steps:
+                    return None
+                distance[one] = max(distance.get(one, 0), len(work))
+                path.add(one)
+                work.append((one, iter(self.get_target_node(one) or [])))
+                break
+            else:
+                path.discard(node_id)
+                work.pop()
+        return distance
+
+    def _get_component_distance_approx(self, entry: str, component: set) -> Dict[str, int]:
+        """ 去掉深度优先遍历中的回边, 在剩余的有向无环图上计算最长路径 """
+        order = []
+        visited = {entry}
+        path = {entry}
+        dag_edges = {}
+        work = [(entry, iter(self.get_target_node(entry) or []))]
+        while work:
+            node_id, targets = work[-1]
+            for one in targets:
+                if one not in component or one in path:
+                    continue
+                dag_edges.setdefault(node_id, []).append(one)
+                if one in visited:
+                    continue
+                visited.add(one)
+                path.add(one)
+                work.append((one, iter(self.get_target_node(one) or [])))
+                break
+            else:
+                path.discard(node_id)
+                order.append(node_id)
+                work.pop()
+        distance = {entry: 0}
+        for node_id in reversed(order):
+            for one in dag_edges.get(node_id, []):
+                distance[one] = max(distance.get(one, 0), distance[node_id] + 1)
+        return distance
+
+    def get_node_level(self, start_node_id: str, max_steps: int = 100000) -> Dict[str, int]:
+        """
+        计算从开始节点到每个可达节点的最长简单路径长度
+        把图按强连通分量缩点后按拓扑序递推, 只有在环内才需要枚举路径, 无环图是线性时间
+        单个环内的遍历次数超过max_steps时, 忽略环内的回边近似计算
+        """
+        node_level = {}
+        # 节点: 从分量外进入此节点时的最长路径长度
+        arrive_level = {start_node_id: 0}
+        for component in self._get_strong_components(start_node_id):
+            component_set = set(component)
+            cyclic = len(component) > 1 or component[0] in (self.get_target_node(component[0]) or [])
+            for entry in component:
+                if entry not in arrive_level:
+                    continue
+                if not cyclic:
+                    distance = {entry: 0}
+                else:
+                    distance = self._get_component_distance(entry, component_set, max_steps)
+                    if distance is None:
+                        logger.warning(f'node level exceed max steps, approximate with dag, entry: {entry}')
+                        distance = self._get_component_distance_approx(entry, component_set)
+                for node_id, one_distance in distance.items():
+                    node_level[node_id] = max(node_level.get(node_id, 0), arrive_level[entry] + one_distance)
+            for node_id in component:
+                for one in self.get_target_node(node_id) or []:
+                    if one not in component_set:
+                        arrive_level[one] = max(arrive_level.get(one, 0), node_level[node_id] + 1)
+        return node_level
+
+    def _build_split_graph(self, end_node_id: str) -> Dict[Any, Dict[Any, int]]:
+        """
+        拆点后的残量图: 除结束节点外每个节点拆成(in, node)->(out, node), 容量为1, 保证节点只被一条路径经过
+        边的容量为边的条数, 结束节点的出边不需要
+        """
+        graph = {}
+        for one in self.edges:
+            if one.source == end_node_id:
+                continue
+            target = end_node_id if one.target == end_node_id else ('in', one.target)
+            arcs = graph.setdefault(('out', one.source), {})
+            arcs[target] = arcs.get(target, 0) + 1
+        for node_id in list(self.source_map.keys()) + list(self.target_map.keys()):
+            if node_id != end_node_id:
+                graph.setdefault(('in', node_id), {})[('out', node_id)] = 1
+        return graph
+
+    @staticmethod
+    def _max_flow(graph: Dict[Any, Dict[Any, int]], source: Any, sink: Any, limit: int) -> int:
+        """ 广度优先找增广路, 最多找limit条 """
+        flow = 0
+        while flow < limit:
+            parents = {source: None}
+            queue = deque([source])
+            while queue and sink not in parents:
+                node = queue.popleft()
+                for one, capacity in graph.get(node, {}).items():
+                    if capacity > 0 and one not in parents:
+                        parents[one] = node
+                        queue.append(one)
+            if sink not in parents:
+                break
+            node = sink
+            while parents[node] is not None:
+                parent = parents[node]
+                graph[parent][node] -= 1
+                reverse = graph.setdefault(node, {})
+                reverse[parent] = reverse.get(parent, 0) + 1
+                node = parent
+            flow += 1
+        return flow
+
+    def has_exclusive_branches(self, start_node_ids: List[str], end_node_id: str) -> bool:
+        """
+        判断是否存在两条从start_node_ids中的节点到结束节点的路径, 两条路径的中间节点不重复
+        等价于枚举所有起点到结束节点的简单路径后两两比较中间节点, 用最大流判断只需要线性时间
+        """
+        start_node_ids = [one for one in dict.fromkeys(start_node_ids) if one != end_node_id]
+        if not start_node_ids or end_node_id not in self.target_map:
+            return False
+        # 同一个起点出发的两条路径
+        for one in start_node_ids:
+            if one not in self.source_map:
+                continue
+            graph = self._build_split_graph(end_node_id)
+            if self._max_flow(graph, ('out', one), end_node_id, 2) >= 2:
+                return True
+        # 不同起点出发的两条路径, 每个起点最多提供一条路径
+        graph = self._build_split_graph(end_node_id)
+        for one in start_node_ids:
+            if one not in self.source_map:
+                continue
+            graph.setdefault('source', {})[('start', one)] = 1
+            graph[('start', one)] = dict(graph[('out', one)])
+        return self._max_flow(graph, 'source', end_node_id, 2) >= 2
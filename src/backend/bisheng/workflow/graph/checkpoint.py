@@ -0,0 +1,30 @@
+from typing import Any, Dict
+
+from langgraph.checkpoint.memory import MemorySaver
+
+
+class WorkflowCheckpointSaver(MemorySaver):
+    """
+    可以导出和恢复的 langgraph checkpointer
+    workflow 等待用户输入时把 checkpoint 导出到 redis, 收到输入后在新的任务里恢复继续执行
+    """
+
+    def dump(self) -> Dict[str, Any]:
+        """ 导出为可以pickle的数据结构 """
+        storage = {}
+        for thread_id, ns_checkpoints in self.storage.items():
+            storage[thread_id] = {ns: dict(checkpoints) for ns, checkpoints in ns_checkpoints.items()}
+        return {
+            'storage': storage,
+            'writes': {key: dict(value) for key, value in self.writes.items()},
+            'blobs': dict(self.blobs),
+        }
+
+    def load(self, data: Dict[str, Any]):
+        """ 从导出的数据中恢复 """
+        for thread_id, ns_checkpoints in data.get('storage', {}).items():
+            for ns, checkpoints in ns_checkpoints.items():
+                self.storage[thread_id][ns].update(checkpoints)
+        for key, value in data.get('writes', {}).items():
+            self.writes[key].update(value)
+        self.blobs.update(data.get('blobs', {}))
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from cachetools import LRUCache
+from langchain_core.runnables import RunnableConfig
+
+from bisheng.workflow.common.node import BaseNodeData
+from bisheng.workflow.edges.edges import EdgeManage
+
+# 运行配置中存放本次运行节点实例的key
+NODES_MAP_KEY = 'nodes_map'
+
+
+def node_runner(node_id: str, async_mode: bool):
+    """ 编译后的图在多次运行之间复用, 节点函数从运行配置里找到本次运行的节点实例 """
+    if async_mode:
+        async def arun(state: dict, config: RunnableConfig):
+            return await config['configurable'][NODES_MAP_KEY][node_id].arun(state)
+
+        return arun
+
+    def run(state: dict, config: RunnableConfig):
+        return config['configurable'][NODES_MAP_KEY][node_id].run(state)
+
+    return run
+
+
+def node_router(node_id: str):
+    """ 条件边的路由函数, 同样从运行配置里找到本次运行的节点实例 """
+
+    def route(state: dict, config: RunnableConfig):
+        return config['configurable'][NODES_MAP_KEY][node_id].route_node(state)
+
+    return route
+
+
+class CompiledWorkflow:
+    """
+    同一份workflow数据构建出的不可变部分: 解析后的边和节点数据、节点层级和扇入分析结果、编译后的langgraph图
+    每次运行只需要实例化节点和绑定运行状态, 所有属性在运行时只读
+    """
+
+    def __init__(self, edges: EdgeManage, nodes_data: List[BaseNodeData], condition_nodes: List[str],
+                 nodes_fan_in: Dict[str, List[str]], nodes_next_nodes: Dict[str, List[str]],
+                 node_level: Dict[str, int], graph: Any, recursion_limit: int):
+        self.edges = edges
+        self.nodes_data = nodes_data
+        self.condition_nodes = condition_nodes
+        self.nodes_fan_in = nodes_fan_in
+        self.nodes_next_nodes = nodes_next_nodes
+        self.node_level = node_level
+        self.graph = graph
+        self.recursion_limit = recursion_limit
+
+
+class WorkflowGraphCache:
+    """
+    进程内的workflow编译结果缓存, key为 (workflow_id, workflow数据的hash, 运行模式, 最大步数)
+    workflow数据变化后hash随之变化, 旧版本的编译结果由LRU淘汰, 不需要主动失效
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self._cache = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(workflow_id: Optional[str], workflow_data: Dict, async_mode: bool, max_steps: int) -> Tuple:
+        data_hash = hashlib.md5(json.dumps(workflow_data, sort_keys=True, ensure_ascii=False,
+                                           default=str).encode('utf-8')).hexdigest()
+        return workflow_id, data_hash, async_mode, max_steps
+
+    def get(self, key: Tuple) -> Optional[CompiledWorkflow]:
+        with self._lock:
+            return self._cache.get(key)
+
+    def set(self, key: Tuple, compiled: CompiledWorkflow):
+        with self._lock:
+            self._cache[key] = compiled
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+workflow_graph_cache = WorkflowGraphCache()
@@ -1,5 +1,5 @@
 import operator
-from typing import Annotated, Any, Dict
+from typing import Annotated, Any, Dict, List
 
 from bisheng.utils.exceptions import IgnoreException
 from bisheng.workflow.callback.base_callback import BaseCallback
@@ -7,11 +7,13 @@ from bisheng.workflow.callback.event import UserInputData
 from bisheng.workflow.common.node import BaseNodeData, NodeType
 from bisheng.workflow.common.workflow import WorkflowStatus
 from bisheng.workflow.edges.edges import EdgeManage
+from bisheng.workflow.graph.checkpoint import WorkflowCheckpointSaver
+from bisheng.workflow.graph.graph_cache import (NODES_MAP_KEY, CompiledWorkflow, node_router, node_runner,
+                                                 workflow_graph_cache)
 from bisheng.workflow.graph.graph_state import GraphState
 from bisheng.workflow.nodes.base import BaseNode
 from bisheng.workflow.nodes.node_manage import NodeFactory
 from bisheng.workflow.nodes.output.output_fake import OutputFakeNode
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.constants import END, START
 from langgraph.graph import StateGraph
 from loguru import logger
@@ -56,15 +58,26 @@ class GraphEngine:
         self.graph_state = GraphState()
 
         # init langgraph state graph
-        self.graph_builder = StateGraph(TempState)
+        self.graph_builder = None
         self.graph = None
-        self.graph_config = {'configurable': {'thread_id': '1'}, 'recursion_limit': 50}
+        self.checkpointer = WorkflowCheckpointSaver()
+        self.graph_config = {
+            'configurable': {'thread_id': '1', NODES_MAP_KEY: self.nodes_map},
+            'recursion_limit': 50
+        }
 
         self.status = WorkflowStatus.RUNNING.value
         self.reason = ''  # 失败原因
 
-        self.build_edges()
-        self.build_nodes()
+        # 同一份workflow数据的拓扑分析和编译后的图在多次运行之间复用, 只有节点实例是每次运行新建的
+        cache_key = workflow_graph_cache.get_key(workflow_id, workflow_data, async_mode, max_steps)
+        compiled = workflow_graph_cache.get(cache_key)
+        if compiled is None:
+            self.build_edges()
+            compiled = self.build_nodes()
+            workflow_graph_cache.set(cache_key, compiled)
+        else:
+            self.load_compiled(compiled)
 
     def build_edges(self):
         # init edges
@@ -85,13 +98,10 @@ class GraphEngine:
         # output 节点后跟一个fake 节点用来处理中断
         if node_instance.type == NodeType.OUTPUT.value:
             fake_node = self.nodes_map[f'{node_instance.id}_fake']
-            if self.async_mode:
-                self.graph_builder.add_node(fake_node.id, fake_node.arun)
-            else:
-                self.graph_builder.add_node(fake_node.id, fake_node.run)
+            self.graph_builder.add_node(fake_node.id, node_runner(fake_node.id, self.async_mode))
             self.graph_builder.add_edge(node_instance.id, fake_node.id)
             self.graph_builder.add_conditional_edges(
-                fake_node.id, node_instance.route_node,
+                fake_node.id, node_router(node_instance.id),
                 {node_id: node_id
                  for node_id in target_node_ids})
             return
@@ -99,7 +109,7 @@ class GraphEngine:
         # condition 和 output 节点后面需要接 langgraph的 edge_condition
         if node_instance.type == NodeType.CONDITION.value:
             self.graph_builder.add_conditional_edges(
-                node_instance.id, node_instance.route_node,
+                node_instance.id, node_router(node_instance.id),
                 {node_id: node_id
                  for node_id in target_node_ids})
             return
@@ -141,28 +151,8 @@ class GraphEngine:
             return [], [one for one in source_ids if not one.startswith(('output_', 'condition_'))]
 
         # 判断是否存在从condition节点或者output节点（选择型交互）到此节点的 两条不重复的路径
-        all_branches = []
-        for one in self.condition_nodes:
-            if node_id == one:
-                continue
-            branches = self.edges.get_all_edges_nodes(one, node_id)
-            for branch in branches:
-                if node_id not in branch:
-                    continue
-                branch.remove(node_id)
-                branch.remove(one)
-                all_branches.append(branch)
-
-        def judge_not_same_branch():
-            # 判断所有边中是否存在两条不重复的路径
-            for i in range(len(all_branches)):
-                for j in range(i + 1, len(all_branches)):
-                    if not (set(all_branches[i]) & set(all_branches[j])):
-                        return True
-            return False
-
         # 说明是互斥收尾节点，不需要等待
-        if judge_not_same_branch():
+        if self.edges.has_exclusive_branches(self.condition_nodes, node_id):
             return [], [one for one in source_ids if not one.startswith(('output_', 'condition_'))]
 
         # 说明不是互斥收尾节点，需要等待所有前驱节点执行完毕再执行
@@ -175,57 +165,43 @@ class GraphEngine:
 
     def build_node_level(self, start_node: str):
         """ 计算所有节点的层级 """
+        self.node_level = self.edges.get_node_level(start_node)
+
+    def instance_node(self, node_data: BaseNodeData) -> BaseNode:
+        """ 实例化节点, output节点同时实例化用来处理中断的fake节点 """
+        node_instance = NodeFactory.instance_node(node_type=node_data.type,
+                                                  node_data=node_data,
+                                                  user_id=self.user_id,
+                                                  workflow_id=self.workflow_id,
+                                                  graph_state=self.graph_state,
+                                                  target_edges=self.edges.get_target_edges(
+                                                      node_data.id),
+                                                  max_steps=self.max_steps,
+                                                  callback=self.callback)
+        self.nodes_map[node_data.id] = node_instance
+        if node_instance.type == NodeType.OUTPUT.value:
+            fake_node = OutputFakeNode(id=f'{node_instance.id}_fake',
+                                       output_node=node_instance,
+                                       type=NodeType.FAKE_OUTPUT.value)
+            self.nodes_map[fake_node.id] = fake_node
+        return node_instance
 
-        # 标记节点的层级
-        def mark_node_level(node_id, node_map: dict, level: int):
-            # 已经遍历过的节点不再遍历，说明成环了
-            if node_id in node_map:
-                return
-            self.node_level[node_id] = max(self.node_level.get(node_id, 0), level)
-            node_map[node_id] = True
-            next_nodes = self.edges.get_target_node(node_id)
-            if not next_nodes:
-                return
-
-            for one_node in next_nodes:
-                tmp_node_map = node_map.copy()
-                mark_node_level(one_node, tmp_node_map, level + 1)
-            return
-
-        mark_node_level(start_node, {}, 0)
-
-    def init_nodes(self, nodes):
+    def init_nodes(self, nodes_data: List[BaseNodeData]):
         """ return node id """
         start_node = None
         end_nodes = []
         interrupt_nodes = []
-        for node in nodes:
-            node_data = BaseNodeData(**node.get('data', {}))
-            if not node_data.id:
-                raise Exception('node must have attribute id')
-
-            node_instance = NodeFactory.instance_node(node_type=node_data.type,
-                                                      node_data=node_data,
-                                                      user_id=self.user_id,
-                                                      workflow_id=self.workflow_id,
-                                                      graph_state=self.graph_state,
-                                                      target_edges=self.edges.get_target_edges(
-                                                          node_data.id),
-                                                      max_steps=self.max_steps,
-                                                      callback=self.callback)
+        for node_data in nodes_data:
+            node_instance = self.instance_node(node_data)
             if node_instance.is_condition_node():
                 self.condition_nodes.append(node_instance.id)
-            self.nodes_map[node_data.id] = node_instance
             self.nodes_fan_in[node_instance.id] = self.edges.get_source_node(node_instance.id)
             if node_instance.type not in [NodeType.START.value]:
                 self.nodes_next_nodes[node_instance.id] = self.edges.get_next_nodes(
                     node_instance.id)
 
             # add node into langgraph
-            if self.async_mode:
-                self.graph_builder.add_node(node_instance.id, node_instance.arun)
-            else:
-                self.graph_builder.add_node(node_instance.id, node_instance.run)
+            self.graph_builder.add_node(node_instance.id, node_runner(node_instance.id, self.async_mode))
 
             # find special node
             if node_instance.type == NodeType.START.value:
@@ -237,19 +213,26 @@ class GraphEngine:
                 interrupt_nodes.append(node_instance.id)
             elif node_instance.type == NodeType.OUTPUT.value:
                 # 需要中止接收用户输入的节点
-                fake_node = OutputFakeNode(id=f'{node_instance.id}_fake',
-                                           output_node=node_instance,
-                                           type=NodeType.FAKE_OUTPUT.value)
-                self.nodes_map[fake_node.id] = fake_node
-                interrupt_nodes.append(fake_node.id)
+                interrupt_nodes.append(f'{node_instance.id}_fake')
         return start_node, end_nodes, interrupt_nodes
 
-    def build_nodes(self):
+    def parse_nodes_data(self) -> List[BaseNodeData]:
         nodes = self.workflow_data.get('nodes', [])
         if not nodes:
             raise Exception('workflow must have at least one node')
+        nodes_data = []
+        for node in nodes:
+            node_data = BaseNodeData(**node.get('data', {}))
+            if not node_data.id:
+                raise Exception('node must have attribute id')
+            nodes_data.append(node_data)
+        return nodes_data
+
+    def build_nodes(self) -> CompiledWorkflow:
+        nodes_data = self.parse_nodes_data()
+        self.graph_builder = StateGraph(TempState)
 
-        start_node, end_nodes, interrupt_nodes = self.init_nodes(nodes)
+        start_node, end_nodes, interrupt_nodes = self.init_nodes(nodes_data)
 
         if not start_node:
             raise Exception('workflow must have start node')
@@ -268,16 +251,37 @@ class GraphEngine:
         # 处理包含多个扇入节点的节点
         self.build_more_fan_in_node()
 
-        # compile langgraph
-        self.graph = self.graph_builder.compile(checkpointer=MemorySaver(),
-                                                interrupt_before=interrupt_nodes)
-        self.graph_config['recursion_limit'] = max(
-            (len(nodes) - len(end_nodes) - 1) * self.max_steps, 1) + len(end_nodes) + 1
+        # compile langgraph, 编译后的图不绑定checkpointer, 可以被多次运行共用
+        graph = self.graph_builder.compile(interrupt_before=interrupt_nodes)
+        recursion_limit = max(
+            (len(nodes_data) - len(end_nodes) - 1) * self.max_steps, 1) + len(end_nodes) + 1
+        self.graph = graph.copy(update={'checkpointer': self.checkpointer, 'auto_validate': False})
+        self.graph_config['recursion_limit'] = recursion_limit
 
         # import datetime
         # with open(f"./bisheng/data/graph/graph_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.png",
         #           'wb') as f:
         #     f.write(self.graph.get_graph().draw_mermaid_png())
+        return CompiledWorkflow(edges=self.edges,
+                                nodes_data=nodes_data,
+                                condition_nodes=self.condition_nodes,
+                                nodes_fan_in=self.nodes_fan_in,
+                                nodes_next_nodes=self.nodes_next_nodes,
+                                node_level=self.node_level,
+                                graph=graph,
+                                recursion_limit=recursion_limit)
+
+    def load_compiled(self, compiled: CompiledWorkflow):
+        """ 复用已编译的workflow, 只实例化本次运行的节点 """
+        self.edges = compiled.edges
+        self.condition_nodes = compiled.condition_nodes
+        self.nodes_fan_in = compiled.nodes_fan_in
+        self.nodes_next_nodes = compiled.nodes_next_nodes
+        self.node_level = compiled.node_level
+        for node_data in compiled.nodes_data:
+            self.instance_node(node_data)
+        self.graph = compiled.graph.copy(update={'checkpointer': self.checkpointer, 'auto_validate': False})
+        self.graph_config['recursion_limit'] = compiled.recursion_limit
 
     def _run(self, input_data: Any):
         try:
@@ -379,3 +383,33 @@ class GraphEngine:
     def stop(self):
         for _, node_instance in self.nodes_map.items():
             node_instance.stop()
+
+    def dump_state(self) -> Dict:
+        """ 导出引擎的运行状态: langgraph的checkpoint、全局变量、聊天历史和节点的运行数据 """
+        history = None
+        if self.graph_state.history_memory:
+            history = list(self.graph_state.history_memory.chat_memory.messages)
+        return {
+            'checkpoint': self.checkpointer.dump(),
+            'variables_pool': self.graph_state.variables_pool,
+            'history': history,
+            'nodes': {
+                node_id: node_instance.get_runtime_state()
+                for node_id, node_instance in self.nodes_map.items()
+                if isinstance(node_instance, BaseNode)
+            },
+            'status': self.status,
+            'reason': self.reason,
+        }
+
+    def load_state(self, state: Dict):
+        """ 从导出的运行状态中恢复, 需要在同一份workflow_data构建的引擎上调用 """
+        self.checkpointer.load(state['checkpoint'])
+        self.graph_state.variables_pool = state['variables_pool']
+        if state['history'] is not None and self.graph_state.history_memory:
+            self.graph_state.history_memory.chat_memory.messages = state['history']
+        for node_id, node_state in state['nodes'].items():
+            if node_id in self.nodes_map:
+                self.nodes_map[node_id].set_runtime_state(node_state)
+        self.status = state['status']
+        self.reason = state['reason']
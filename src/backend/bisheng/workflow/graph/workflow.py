@@ -82,5 +82,16 @@ class Workflow:
     def stop(self):
         self.graph_engine.stop()
 
+    def dump_state(self) -> Dict:
+        """ 导出运行状态, 等待用户输入时持久化, 不再占用执行任务 """
+        return {
+            'current_time': self.current_time,
+            'graph_engine': self.graph_engine.dump_state(),
+        }
+
+    def load_state(self, state: Dict):
+        self.current_time = state['current_time']
+        self.graph_engine.load_state(state['graph_engine'])
+
     def status(self):
         return self.graph_engine.status
@@ -27,6 +27,8 @@ agent_executor_dict = {
 
 class AgentNode(BaseNode):
 
+    runtime_state_keys = BaseNode.runtime_state_keys + ['_batch_variable_list', '_tool_invoke_list']
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # 判断是单次还是批量
@@ -1,11 +1,14 @@
 import base64
+import contextvars
 import copy
 import uuid
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
 
 from langchain_core.messages import HumanMessage
 
+from bisheng.settings import settings
 from bisheng.utils.exceptions import IgnoreException
 from bisheng.workflow.callback.base_callback import BaseCallback
 from bisheng.workflow.callback.event import NodeEndData, NodeStartData
@@ -15,8 +18,26 @@ from bisheng.workflow.graph.graph_state import GraphState
 from bisheng.workflow.nodes.prompt_template import PromptTemplateParser
 
 
+def _is_plain_data(value: Any) -> bool:
+    """ 是否是只由基础类型组成的数据 """
+    if value is None or isinstance(value, (str, int, float, bool, bytes)):
+        return True
+    if isinstance(value, (list, tuple, set)):
+        return all(_is_plain_data(one) for one in value)
+    if isinstance(value, dict):
+        return all(_is_plain_data(k) and _is_plain_data(v) for k, v in value.items())
+    return False
+
+
 class BaseNode(ABC):
 
+    # workflow 暂停等待用户输入时需要持久化的节点运行数据
+    # 节点实例上由基础类型组成的属性会自动持久化, 其他类型(如Document列表)的运行数据需要在这里声明
+    runtime_state_keys = ['current_step', 'exec_unique_id', 'node_params', 'other_node_variable']
+    # 由构造参数决定的属性, 恢复时以新的实例为准, 不持久化
+    runtime_state_exclude_keys = ['id', 'type', 'name', 'description', 'user_id', 'workflow_id', 'max_steps',
+                                  'tmp_collection_name', 'stop_flag']
+
     def __init__(self, node_data: BaseNodeData, workflow_id: str, user_id: str,
                  graph_state: GraphState, target_edges: List[EdgeBase], max_steps: int,
                  callback: BaseCallback, **kwargs: Any):
@@ -101,6 +122,21 @@ class BaseNode(ABC):
         self.other_node_variable[variable_key] = value
         return value
 
+    def get_runtime_state(self) -> Dict[str, Any]:
+        """ 获取节点的运行数据, 用于workflow暂停后恢复 """
+        state = {key: getattr(self, key) for key in self.runtime_state_keys}
+        for key, value in vars(self).items():
+            if key in state or key in self.runtime_state_exclude_keys:
+                continue
+            if _is_plain_data(value):
+                state[key] = value
+        return state
+
+    def set_runtime_state(self, state: Dict[str, Any]):
+        for key, value in state.items():
+            if key not in self.runtime_state_exclude_keys:
+                setattr(self, key, value)
+
     def get_input_schema(self) -> Any:
         """ 返回用户需要输入的表单描述信息 """
         return None
@@ -147,6 +183,32 @@ class BaseNode(ABC):
             msg = msg_template.format(var_map)
         return msg, variables
 
+    def get_batch_concurrency(self) -> int:
+        """ 节点批量执行的最大并发数, 节点参数未配置时使用全局的workflow配置 """
+        max_concurrency = self.node_params.get('max_concurrency')
+        if not max_concurrency:
+            max_concurrency = settings.get_workflow_conf().max_batch_concurrency
+        return max(1, int(max_concurrency))
+
+    def run_batch(self, func: Callable[..., Any], batch_args: List[tuple]) -> List[Any]:
+        """
+        并发执行批量任务, 结果按照输入的顺序返回
+        params:
+            func: 单个任务的执行函数
+            batch_args: 每个任务的参数列表
+        """
+        max_workers = min(self.get_batch_concurrency(), len(batch_args)) if len(batch_args) > 1 else 1
+        if max_workers <= 1:
+            return [func(*args) for args in batch_args]
+        with ThreadPoolExecutor(max_workers=max_workers,
+                                thread_name_prefix=f'node_{self.id}') as executor:
+            # 复制上下文, 保证线程内日志的trace_id和调用方一致
+            futures = [
+                executor.submit(contextvars.copy_context().run, func, *args)
+                for args in batch_args
+            ]
+            return [future.result() for future in futures]
+
     def get_file_base64_data(self, file_path: str) -> str:
         with open(file_path, "rb") as f:
             file_data = f.read()
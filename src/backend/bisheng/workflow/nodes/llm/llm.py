@@ -11,6 +11,9 @@ from loguru import logger
 
 class LLMNode(BaseNode):
 
+    # 批量执行时的变量来自其他节点, 可能不是基础类型
+    runtime_state_keys = BaseNode.runtime_state_keys + ['_batch_variable_list']
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # 判断是单次还是批量
@@ -49,14 +52,20 @@ class LLMNode(BaseNode):
 
         result = {}
         if self._tab == 'single':
-            result['output'], reasoning_content = self._run_once(None, unique_id, 'output')
-            self._log_reasoning_content.append(reasoning_content)
+            batch_args = [(None, unique_id, 'output')]
         else:
+            batch_args = []
             for index, one in enumerate(self.node_params['batch_variable']):
                 self._batch_variable_list.append(self.get_other_node_variable(one))
-                output_key = self.node_params['output'][index]['key']
-                result[output_key], reasoning_content = self._run_once(one, unique_id, output_key)
-                self._log_reasoning_content.append(reasoning_content)
+                batch_args.append((one, unique_id, self.node_params['output'][index]['key']))
+
+        # 批量执行时并发调用模型, 结果和日志按照输入的顺序组装
+        batch_result = self.run_batch(self._run_once, batch_args)
+        for args, (output, reasoning_content, system, user) in zip(batch_args, batch_result):
+            result[args[2]] = output
+            self._system_prompt_list.append(system)
+            self._user_prompt_list.append(user)
+            self._log_reasoning_content.append(reasoning_content)
 
         if self._output_user:
             for k, v in result.items():
@@ -83,7 +92,8 @@ class LLMNode(BaseNode):
     def _run_once(self,
                   input_variable: str = None,
                   unique_id: str = None,
-                  output_key: str = None) -> (str, str):
+                  output_key: str = None) -> (str, str, str, str):
+        """ return: 模型输出, 思考内容, 系统提示词, 用户提示词 """
         # 说明是引用了批处理的变量, 需要把变量的值替换为用户选择的变量
         special_variable = f'{self.id}.batch_variable'
         variable_map = {}
@@ -93,7 +103,6 @@ class LLMNode(BaseNode):
                 continue
             variable_map[one] = self.get_other_node_variable(one)
         system = self._system_prompt.format(variable_map)
-        self._system_prompt_list.append(system)
 
         variable_map = {}
         for one in self._user_variables:
@@ -102,7 +111,6 @@ class LLMNode(BaseNode):
                 continue
             variable_map[one] = self.get_other_node_variable(one)
         user = self._user_prompt.format(variable_map)
-        self._user_prompt_list.append(user)
 
         logger.debug(
             f'outputkey={output_key} workflow llm node prompt: system: {system}\nuser: {user}')
@@ -127,4 +135,4 @@ class LLMNode(BaseNode):
 
         result = self._llm.invoke(inputs, config=config)
 
-        return result.content, llm_callback.reasoning_content
+        return result.content, llm_callback.reasoning_content, system, user
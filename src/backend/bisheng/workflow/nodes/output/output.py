@@ -9,6 +9,8 @@ from bisheng.workflow.nodes.prompt_template import PromptTemplateParser
 
 class OutputNode(BaseNode):
 
+    runtime_state_keys = BaseNode.runtime_state_keys + ['_source_documents']
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -1,4 +1,5 @@
 import re
+from functools import lru_cache
 
 from loguru import logger
 
@@ -7,6 +8,12 @@ WITH_VARIABLE_TMPL_REGEX = re.compile(
     r'\{\{#([#a-zA-Z_][a-zA-Z0-9_]{0,29}|[#a-zA-Z0-9_]{1,50}\.[#a-zA-Z0-9_\.]{1,100})#\}\}')
 
 
+@lru_cache(maxsize=4096)
+def _extract_variables(regex: re.Pattern, template: str) -> tuple:
+    """ 同一个模板只解析一次, 已发布的workflow每次运行都会用相同的模板初始化节点 """
+    return tuple(re.findall(regex, template))
+
+
 class PromptTemplateParser:
     """
     Rules:
@@ -27,7 +34,7 @@ class PromptTemplateParser:
 
     def extract(self) -> list:
         # Regular expression to match the template rules
-        return re.findall(self.regex, self.template)
+        return list(_extract_variables(self.regex, self.template))
 
     def format(self, inputs: dict, remove_template_variables: bool = True) -> str:
 
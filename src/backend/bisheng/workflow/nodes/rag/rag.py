@@ -19,6 +19,8 @@ from langchain_core.prompts import (ChatPromptTemplate, HumanMessagePromptTempla
 
 class RagNode(BaseNode):
 
+    runtime_state_keys = BaseNode.runtime_state_keys + ['_log_source_documents']
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -83,45 +85,58 @@ class RagNode(BaseNode):
             return_source_documents=True,
         )
         user_questions = self.init_user_question()
-        ret = {}
+        batch_args = []
         for index, question in enumerate(user_questions):
             output_key = self.node_params['output_user_input'][index]['key']
-            if question is None:
-                question = ''
-            # 因为rag需要溯源所以不能用通用llm callback来返回消息。需要拿到source_document之后在返回消息内容
-            llm_callback = LLMNodeCallbackHandler(callback=self.callback_manager,
-                                                  unique_id=unique_id,
-                                                  node_id=self.id,
-                                                  output=self._output_user,
-                                                  output_key=output_key,
-                                                  cancel_llm_end=True)
-
-            result = retriever._call({'query': question}, run_manager=llm_callback)
+            batch_args.append((retriever, question, unique_id, output_key))
 
+        # 多个问题并发检索和回答, 结果和日志按照问题的顺序组装
+        batch_result = self.run_batch(self._run_once, batch_args)
+        ret = {}
+        for args, (result, reasoning_content) in zip(batch_args, batch_result):
+            output_key = args[3]
             if self._output_user:
                 self.graph_state.save_context(content=result['result'], msg_sender='AI')
-                if llm_callback.output_len == 0:
-                    self.callback_manager.on_output_msg(
-                        OutputMsgData(node_id=self.id,
-                                      msg=result['result'],
-                                      unique_id=unique_id,
-                                      output_key=output_key,
-                                      source_documents=result['source_documents']))
-                else:
-                    # 说明有流式输出，则触发流式结束事件, 因为需要source_document所以在此执行流式结束事件
-                    self.callback_manager.on_stream_over(StreamMsgOverData(
-                        node_id=self.id,
-                        msg=result['result'],
-                        reasoning_content=llm_callback.reasoning_content,
-                        unique_id=unique_id,
-                        source_documents=result['source_documents'],
-                        output_key=output_key,
-                    ))
             ret[output_key] = result[retriever.output_key]
-            self._log_reasoning_content[output_key] = llm_callback.reasoning_content
+            self._log_reasoning_content[output_key] = reasoning_content
             self._log_source_documents[output_key] = result['source_documents']
         return ret
 
+    def _run_once(self, retriever: BishengRetrievalQA, question: str, unique_id: str,
+                  output_key: str) -> (dict, str):
+        """ return: 检索问答的结果, 思考内容 """
+        if question is None:
+            question = ''
+        # 因为rag需要溯源所以不能用通用llm callback来返回消息。需要拿到source_document之后在返回消息内容
+        llm_callback = LLMNodeCallbackHandler(callback=self.callback_manager,
+                                              unique_id=unique_id,
+                                              node_id=self.id,
+                                              output=self._output_user,
+                                              output_key=output_key,
+                                              cancel_llm_end=True)
+
+        result = retriever._call({'query': question}, run_manager=llm_callback)
+
+        if self._output_user:
+            if llm_callback.output_len == 0:
+                self.callback_manager.on_output_msg(
+                    OutputMsgData(node_id=self.id,
+                                  msg=result['result'],
+                                  unique_id=unique_id,
+                                  output_key=output_key,
+                                  source_documents=result['source_documents']))
+            else:
+                # 说明有流式输出，则触发流式结束事件, 因为需要source_document所以在此执行流式结束事件
+                self.callback_manager.on_stream_over(StreamMsgOverData(
+                    node_id=self.id,
+                    msg=result['result'],
+                    reasoning_content=llm_callback.reasoning_content,
+                    unique_id=unique_id,
+                    source_documents=result['source_documents'],
+                    output_key=output_key,
+                ))
+        return result, llm_callback.reasoning_content
+
     def parse_log(self, unique_id: str, result: dict) -> Any:
         ret = []
         index = 0
@@ -0,0 +1,139 @@
+"""
+模型健康统计: record -> flush_stats -> get_stats 汇总多个进程的窗口错误率和耗时分位数
+以及根据汇总后的错误率计算模型状态, 手动测试后忽略之前的调用记录
+需要配置文件中的 redis_url 指向可用的redis
+"""
+import os
+import sys
+import uuid
+
+parent_dir = os.path.dirname(os.path.abspath(__file__)).replace('test', '')
+sys.path.append(parent_dir)
+os.environ['config'] = os.path.join(parent_dir, 'bisheng/config.dev.yaml')
+
+from bisheng.cache.redis import redis_client
+from bisheng.interface.model_health import ModelHealthTracker, _percentile
+
+MODEL_ID = 1
+
+
+class ProcessTracker(ModelHealthTracker):
+    """ 模拟不同进程的统计, 使用独立的redis key, 数据库的状态写入记录在 written 中 """
+
+    def __init__(self, name: str, redis_key: str, **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+        self.redis_key = redis_key
+        self.reset_key = f'{redis_key}:reset'
+        self.written = []
+
+    @property
+    def process_key(self) -> str:
+        return self.name
+
+    def _write_status(self, model_id: int, status: int, remark: str):
+        self.written.append((model_id, status, remark))
+        with self._lock:
+            self._models[model_id].flushed_status = status
+
+
+def build_trackers(num: int):
+    redis_key = f'llm:model_health_test_{uuid.uuid4().hex}'
+    # 不启动后台线程, 由测试代码主动flush
+    trackers = [ProcessTracker(f'process_{i}', redis_key, flush_interval=3600) for i in range(num)]
+    for tracker in trackers:
+        tracker._pid = os.getpid()
+    return trackers
+
+
+def clean(tracker: ModelHealthTracker):
+    redis_client.delete(tracker.redis_key)
+    redis_client.delete(tracker.reset_key)
+
+
+def test_percentile():
+    assert _percentile([], 50) is None
+    values = [float(i) for i in range(1, 101)]
+    assert _percentile(values, 50) == 50
+    assert _percentile(values, 95) == 95
+    assert _percentile(list(reversed(values)), 95) == 95
+    assert _percentile([3.0], 95) == 3
+
+
+def test_merge_stats_of_processes():
+    first, second = build_trackers(2)
+    try:
+        for i in range(1, 51):
+            first.record(MODEL_ID, True, latency=i)
+        for i in range(51, 101):
+            second.record(MODEL_ID, i > 60, latency=i, error=f'error {i}')
+        first.flush_stats()
+        second.flush_stats()
+
+        stats = first.get_stats(MODEL_ID)[MODEL_ID]
+        print(stats)
+        assert stats['processes'] == 2
+        assert (stats['total'], stats['errors']) == (100, 10)
+        assert (stats['window_requests'], stats['window_errors']) == (100, 10)
+        assert stats['error_rate'] == 0.1
+        assert (stats['p50_latency'], stats['p95_latency']) == (50, 95)
+        assert stats['last_error'] == 'error 60'
+        assert first.get_stats(MODEL_ID + 1) == {}
+    finally:
+        clean(first)
+
+
+def test_window_keeps_latest_calls():
+    tracker = build_trackers(1)[0]
+    tracker.window = 10
+    try:
+        for i in range(20):
+            tracker.record(MODEL_ID, i >= 15, latency=i)
+        stats = tracker.get_stats()[MODEL_ID]
+        assert (stats['total'], stats['errors']) == (20, 15)
+        assert (stats['window_requests'], stats['window_errors']) == (10, 5)
+        assert stats['error_rate'] == 0.5
+    finally:
+        clean(tracker)
+
+
+def test_status_from_merged_error_rate():
+    first, second = build_trackers(2)
+    try:
+        # 偶发的失败不会改变状态, 最后一次调用失败也不会
+        for i in range(9):
+            first.record(MODEL_ID, True, latency=0.1, known_status=0)
+        first.record(MODEL_ID, False, latency=0.1, error='timeout')
+        first.flush(force_status=True)
+        assert first.written == []
+
+        # 其他进程的大量失败使汇总后的错误率超过阈值
+        for i in range(30):
+            second.record(MODEL_ID, False, latency=0.1, error='connection refused', known_status=0)
+        second.flush_stats()
+        first.flush(force_status=True)
+        assert first.written == [(MODEL_ID, 1, 'connection refused')]
+        # 状态没有变化时不再写入
+        first.flush(force_status=True)
+        assert len(first.written) == 1
+
+        # 手动测试通过后, 之前的调用记录不再参与计算, 状态不会被改回异常
+        first.set_status(MODEL_ID, 0)
+        second.flush(force_status=True)
+        first.flush(force_status=True)
+        assert first.written[-1] == (MODEL_ID, 0, '')
+        assert second.written == []
+        stats = first.get_stats(MODEL_ID)[MODEL_ID]
+        assert (stats['window_requests'], stats['last_error']) == (0, '')
+
+        first.record(MODEL_ID, True, latency=0.2)
+        assert first.get_stats(MODEL_ID)[MODEL_ID]['window_requests'] == 1
+    finally:
+        clean(first)
+
+
+if __name__ == '__main__':
+    test_percentile()
+    test_merge_stats_of_processes()
+    test_window_keeps_latest_calls()
+    test_status_from_merged_error_rate()
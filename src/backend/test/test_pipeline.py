@@ -0,0 +1,130 @@
+"""
+多阶段流水线: 结果的顺序、on_done 串行回调、阶段异常的处理
+阶段中抛出 BaseException 时流水线不能卡住, 剩余的 item 以异常结束, run 抛出该异常
+"""
+import os
+import sys
+import threading
+import time
+
+parent_dir = os.path.dirname(os.path.abspath(__file__)).replace('test', '')
+sys.path.append(parent_dir)
+
+from bisheng.utils.pipeline import PipelineStage, StagePipeline
+
+
+class DoneRecorder:
+    """ 记录 on_done 的回调, 同时检查回调没有并发执行 """
+
+    def __init__(self):
+        self.results = []
+        self.running = 0
+        self.max_running = 0
+
+    def __call__(self, item, error):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        time.sleep(0.001)
+        self.results.append((item, error))
+        self.running -= 1
+
+
+def run_with_timeout(pipeline: StagePipeline, items, timeout: float = 10):
+    """ 在子线程中执行流水线, 超时说明流水线卡住了 """
+    errors = []
+
+    def target():
+        try:
+            pipeline.run(items)
+        except BaseException as e:
+            errors.append(e)
+
+    t = threading.Thread(target=target, daemon=True)
+    t.start()
+    t.join(timeout)
+    assert not t.is_alive(), 'pipeline hangs'
+    return errors[0] if errors else None
+
+
+def test_order_and_serial_on_done():
+    recorder = DoneRecorder()
+    stages = [
+        PipelineStage('add', lambda x: x + 1),
+        PipelineStage('double', lambda x: x * 2),
+        PipelineStage('str', str),
+    ]
+    assert run_with_timeout(StagePipeline(stages, on_done=recorder), range(50)) is None
+    # 每个阶段只有一个线程时, 结果和输入的顺序一致
+    assert recorder.results == [(str((i + 1) * 2), None) for i in range(50)]
+    assert recorder.max_running == 1
+
+
+def test_concurrent_stage_serial_on_done():
+    recorder = DoneRecorder()
+    stages = [
+        PipelineStage('sleep', lambda x: time.sleep(0.01) or x, workers=4),
+        PipelineStage('square', lambda x: x * x, workers=3, queue_size=1),
+    ]
+    assert run_with_timeout(StagePipeline(stages, on_done=recorder), range(40)) is None
+    assert sorted(item for item, _ in recorder.results) == [i * i for i in range(40)]
+    assert recorder.max_running == 1
+
+
+def test_item_error_not_in_next_stage():
+    recorder = DoneRecorder()
+    second_stage_items = []
+
+    def first(x):
+        if x % 3 == 0:
+            raise ValueError(f'bad {x}')
+        return x
+
+    def second(x):
+        second_stage_items.append(x)
+        return x
+
+    stages = [PipelineStage('first', first, workers=2), PipelineStage('second', second)]
+    assert run_with_timeout(StagePipeline(stages, on_done=recorder), range(9)) is None
+    errors = {item: str(error) for item, error in recorder.results if error is not None}
+    assert errors == {0: 'bad 0', 3: 'bad 3', 6: 'bad 6'}
+    assert sorted(second_stage_items) == [1, 2, 4, 5, 7, 8]
+
+
+def test_base_exception_stops_pipeline():
+    recorder = DoneRecorder()
+
+    def first(x):
+        if x == 2:
+            raise SystemExit('stage exit')
+        return x
+
+    # 下游阶段的队列很小, 中止后上游和下游都不能阻塞
+    stages = [PipelineStage('first', first), PipelineStage('second', lambda x: x, queue_size=1)]
+    error = run_with_timeout(StagePipeline(stages, on_done=recorder), range(20))
+    assert isinstance(error, SystemExit)
+    assert len(recorder.results) == 20
+    # 中止前进入下游的 item 可能已经完成, 之后的 item 都以中止的异常结束
+    assert {item for item, err in recorder.results if err is None} <= {0, 1}
+    assert all(err is error for item, err in recorder.results if item >= 2)
+
+
+def test_on_done_base_exception_not_hang():
+    calls = []
+
+    def on_done(item, error):
+        calls.append(item)
+        if item == 1:
+            raise SystemExit('on_done exit')
+
+    stages = [PipelineStage('first', lambda x: x, workers=2), PipelineStage('second', lambda x: x)]
+    error = run_with_timeout(StagePipeline(stages, on_done=on_done), range(10))
+    assert isinstance(error, SystemExit)
+    assert 1 in calls
+
+
+if __name__ == '__main__':
+    test_order_and_serial_on_done()
+    test_concurrent_stage_serial_on_done()
+    test_item_error_not_in_next_stage()
+    test_base_exception_stops_pipeline()
+    test_on_done_base_exception_not_hang()
@@ -0,0 +1,85 @@
+"""
+workflow事件的阻塞读取不能占满普通命令的连接池
+同时等待事件的会话数超过 max_connections 时, 阻塞读取排队等待而不是报 Too many connections
+需要配置文件中的 redis_url 指向可用的单机redis, 连接不上时跳过
+"""
+import asyncio
+import os
+import sys
+import time
+import uuid
+from collections import deque
+
+import pytest
+import redis
+
+parent_dir = os.path.dirname(os.path.abspath(__file__)).replace('test', '')
+sys.path.append(parent_dir)
+os.environ['config'] = os.path.join(parent_dir, 'bisheng/config.dev.yaml')
+
+from bisheng.cache.redis import AsyncRedisClient
+from bisheng.settings import settings
+from bisheng.worker.workflow.redis_callback import RedisCallback
+
+
+def redis_available() -> bool:
+    try:
+        return redis.Redis.from_url(settings.redis_url, socket_connect_timeout=1).ping()
+    except (redis.RedisError, OSError):
+        return False
+
+
+if not redis_available():
+    pytest.skip(f'redis is not available: {settings.redis_url}', allow_module_level=True)
+
+
+def build_callback(client: AsyncRedisClient) -> RedisCallback:
+    # 只测试事件读取, 不需要初始化workflow相关的配置
+    callback = RedisCallback.__new__(RedisCallback)
+    callback.async_redis_client = client
+    callback.workflow_event_key = f'workflow:test_{uuid.uuid4().hex}:event'
+    callback._event_buffer = deque()
+    return callback
+
+
+async def run_concurrent_consumers(consumer_num: int, max_connections: int):
+    client = AsyncRedisClient(settings.redis_url, max_connections=max_connections,
+                              max_blocking_connections=consumer_num)
+    callbacks = [build_callback(client) for _ in range(consumer_num)]
+
+    async def produce():
+        await asyncio.sleep(0.5)
+        # 一半的消费者收到事件, 等待期间普通命令依然可以执行
+        for callback in callbacks[::2]:
+            await client.rpush(callback.workflow_event_key, 'event', expiration=60)
+        assert await client.get(f'test_{uuid.uuid4().hex}') is None
+
+    start = time.perf_counter()
+    results = await asyncio.gather(produce(),
+                                   *[callback.afetch_workflow_events(block_timeout=2) for callback in callbacks])
+    cost = time.perf_counter() - start
+    for index, callback in enumerate(callbacks):
+        assert results[index + 1] == (index % 2 == 0), (index, results[index + 1])
+        await client.delete(callback.workflow_event_key)
+    # 所有消费者同时阻塞, 总耗时约等于一次阻塞的超时时间
+    assert cost < 4, (consumer_num, max_connections, cost)
+
+
+def test_blocking_reads_exceed_max_connections():
+    asyncio.run(run_concurrent_consumers(consumer_num=30, max_connections=10))
+
+
+def test_blocking_pool_smaller_than_consumers():
+    # 阻塞连接池小于消费者数时排队等待, 不报错
+    client = AsyncRedisClient(settings.redis_url, max_connections=2, max_blocking_connections=4)
+
+    async def run():
+        callbacks = [build_callback(client) for _ in range(8)]
+        return await asyncio.gather(*[callback.afetch_workflow_events(block_timeout=1) for callback in callbacks])
+
+    assert asyncio.run(run()) == [False] * 8
+
+
+if __name__ == '__main__':
+    test_blocking_reads_exceed_max_connections()
+    test_blocking_pool_smaller_than_consumers()
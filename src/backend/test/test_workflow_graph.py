@@ -0,0 +1,133 @@
+"""
+工作流图分析的回归测试和性能基准
+节点层级和互斥收尾节点的判断结果需要和原来枚举所有路径的实现保持一致
+"""
+import random
+import time
+from typing import Dict, List
+
+from bisheng.workflow.edges.edges import EdgeManage
+
+
+def build_edge_manage(edges: List[tuple]) -> EdgeManage:
+    return EdgeManage([{
+        'id': f'edge_{index}',
+        'source': source,
+        'sourceHandle': f'{source}_handle',
+        'target': target,
+        'targetHandle': f'{target}_handle',
+    } for index, (source, target) in enumerate(edges)])
+
+
+def reference_node_level(edges: EdgeManage, start_node: str) -> Dict[str, int]:
+    """ 原来的实现: 枚举从开始节点出发的所有简单路径 """
+    node_level = {}
+
+    def mark_node_level(node_id, node_map: dict, level: int):
+        if node_id in node_map:
+            return
+        node_level[node_id] = max(node_level.get(node_id, 0), level)
+        node_map[node_id] = True
+        for one_node in edges.get_target_node(node_id) or []:
+            mark_node_level(one_node, node_map.copy(), level + 1)
+
+    mark_node_level(start_node, {}, 0)
+    return node_level
+
+
+def reference_all_branches(edges: EdgeManage, start_node_id: str, end_node_id: str) -> List[List[str]]:
+    """ 原来的实现: 枚举开始节点到结束节点的所有分支, 遇到环或者结束节点时分支结束 """
+    branches = []
+
+    def get_node_branch(node_id, branch: List, node_map: dict):
+        if node_id in node_map or node_id == end_node_id:
+            branch.append(node_id)
+            branches.append(branch)
+            return
+        branch.append(node_id)
+        node_map[node_id] = True
+        next_nodes = edges.get_target_node(node_id)
+        if not next_nodes:
+            branches.append(branch)
+            return
+        for one_node in next_nodes:
+            get_node_branch(one_node, branch.copy(), node_map.copy())
+
+    get_node_branch(start_node_id, [], {})
+    return branches
+
+
+def reference_exclusive_branches(edges: EdgeManage, condition_nodes: List[str], node_id: str) -> bool:
+    """ 原来的实现: 枚举所有条件节点到此节点的路径, 两两比较中间节点 """
+    all_branches = []
+    for one in condition_nodes:
+        if node_id == one:
+            continue
+        for branch in reference_all_branches(edges, one, node_id):
+            if node_id not in branch:
+                continue
+            branch.remove(node_id)
+            branch.remove(one)
+            all_branches.append(branch)
+    for i in range(len(all_branches)):
+        for j in range(i + 1, len(all_branches)):
+            if not (set(all_branches[i]) & set(all_branches[j])):
+                return True
+    return False
+
+
+def random_graph(rand: random.Random, node_num: int, edge_num: int) -> List[tuple]:
+    nodes = [f'node_{i}' for i in range(node_num)]
+    # 保证所有节点都能从开始节点到达
+    edges = [(rand.choice(nodes[:i]), nodes[i]) for i in range(1, node_num)]
+    for _ in range(edge_num):
+        edges.append((rand.choice(nodes), rand.choice(nodes)))
+    return edges
+
+
+def test_match_reference_on_random_graphs():
+    rand = random.Random(0)
+    for _ in range(500):
+        node_num = rand.randint(2, 9)
+        edges = build_edge_manage(random_graph(rand, node_num, rand.randint(0, 8)))
+        assert edges.get_node_level('node_0') == reference_node_level(edges, 'node_0')
+
+        condition_nodes = rand.sample([f'node_{i}' for i in range(node_num)], rand.randint(1, min(3, node_num)))
+        for i in range(node_num):
+            node_id = f'node_{i}'
+            assert (edges.has_exclusive_branches(condition_nodes, node_id)
+                    == reference_exclusive_branches(edges, condition_nodes, node_id)), (condition_nodes, node_id)
+
+
+def wide_dag(width: int) -> List[tuple]:
+    """ 一个条件节点分出width个分支, 每个分支两个节点后汇合到同一个节点 """
+    edges = [('start', 'condition_0')]
+    for i in range(width):
+        edges.extend([('condition_0', f'a_{i}'), (f'a_{i}', f'b_{i}'), (f'b_{i}', 'end')])
+    return edges
+
+
+def deep_dag(depth: int) -> List[tuple]:
+    """ depth个菱形串联, 路径数量是2^depth """
+    edges = [('start', 'condition_0')]
+    for i in range(depth):
+        edges.extend([(f'condition_{i}', f'left_{i}'), (f'condition_{i}', f'right_{i}'),
+                      (f'left_{i}', f'condition_{i + 1}'), (f'right_{i}', f'condition_{i + 1}')])
+    return edges
+
+
+def test_benchmark_wide_and_deep_dag():
+    for name, edge_list, condition_nodes, end_node in [
+        ('wide', wide_dag(2000), ['condition_0'], 'end'),
+        ('deep', deep_dag(200), [f'condition_{i}' for i in range(200)], 'condition_200'),
+    ]:
+        edges = build_edge_manage(edge_list)
+        start = time.perf_counter()
+        node_level = edges.get_node_level('start')
+        exclusive = edges.has_exclusive_branches(condition_nodes, end_node)
+        cost = time.perf_counter() - start
+        print(f'{name} dag: nodes={len(node_level)} edges={len(edge_list)} cost={cost:.3f}s')
+        assert node_level[end_node] == max(node_level.values())
+        assert exclusive
+        # 枚举路径的实现在深度为200的图上无法结束
+        assert cost < 5
@@ -0,0 +1,211 @@
+"""
+workflow 暂停等待用户输入后, 导出运行状态, 在新的 workflow 实例上恢复并继续执行
+结果需要和不暂停、一直在同一个实例上执行的结果一致
+"""
+import pickle
+import uuid
+from typing import List
+
+from bisheng.workflow.callback.base_callback import BaseCallback
+from bisheng.workflow.callback.event import NodeEndData, UserInputData
+from bisheng.workflow.common.workflow import WorkflowStatus
+from bisheng.workflow.graph.workflow import Workflow
+from bisheng.workflow.nodes.base import BaseNode
+
+
+def build_node(node_id: str, node_type: str, params: dict, v: int = 2) -> dict:
+    return {
+        'id': node_id,
+        'data': {
+            'id': node_id,
+            'type': node_type,
+            'name': node_id,
+            'v': v,
+            'tab': {'value': 'form_input'} if node_type == 'input' else {},
+            'group_params': [{
+                'name': '',
+                'params': [{'key': key, 'value': value} for key, value in params.items()]
+            }],
+        }
+    }
+
+
+def build_edge(source: str, target: str, source_handle: str = None) -> dict:
+    return {
+        'id': f'{source}_{target}',
+        'source': source,
+        'sourceHandle': source_handle or f'{source}_handle',
+        'target': target,
+        'targetHandle': f'{target}_handle',
+    }
+
+
+# 开始 -> 表单输入年龄 -> 代码节点判断是否成年 -> 条件节点, 未成年时回到输入节点重新输入, 成年时结束
+WORKFLOW_DATA = {
+    'nodes': [
+        build_node('start_1', 'start', {
+            'guide_word': '',
+            'guide_question': [],
+            'preset_question': [],
+            'chat_history': 10,
+        }),
+        build_node('input_1', 'input', {
+            'form_input': [{'key': 'age', 'value': '', 'type': 'text'}],
+        }),
+        build_node('code_1', 'code', {
+            'code_input': [{'key': 'age', 'type': 'ref', 'value': 'input_1.age'}],
+            'code': 'def main(age):\n    return {"adult": "yes" if int(age) >= 18 else "no"}\n',
+            'code_output': [{'key': 'adult', 'type': 'str'}],
+        }),
+        build_node('condition_1', 'condition', {
+            'condition': [{
+                'id': 'case_adult',
+                'operator': 'and',
+                'conditions': [{
+                    'id': 'condition_adult',
+                    'left_var': 'code_1.adult',
+                    'comparison_operation': 'equals',
+                    'right_value_type': 'input',
+                    'right_value': 'yes',
+                }],
+            }],
+        }),
+        build_node('end_1', 'end', {}),
+    ],
+    'edges': [
+        build_edge('start_1', 'input_1'),
+        build_edge('input_1', 'code_1'),
+        build_edge('code_1', 'condition_1'),
+        build_edge('condition_1', 'end_1', 'case_adult'),
+        build_edge('condition_1', 'input_1', 'right_handle'),
+    ],
+}
+
+
+class RecordCallback(BaseCallback):
+
+    def __init__(self):
+        super().__init__()
+        self.user_inputs: List[str] = []
+        self.node_ends: List[str] = []
+
+    def on_user_input(self, data: UserInputData):
+        self.user_inputs.append(data.node_id)
+
+    def on_node_end(self, data: NodeEndData):
+        self.node_ends.append(data.node_id)
+
+
+def new_workflow(workflow_id: str, callback: BaseCallback) -> Workflow:
+    return Workflow(workflow_id, '1', WORKFLOW_DATA, False, 10, 10, callback)
+
+
+def runtime_states(workflow: Workflow) -> dict:
+    return {
+        node_id: {key: value for key, value in node.get_runtime_state().items() if key != 'exec_unique_id'}
+        for node_id, node in workflow.graph_engine.nodes_map.items() if isinstance(node, BaseNode)
+    }
+
+
+def simple_attributes(workflow: Workflow) -> dict:
+    """ 节点实例上所有简单类型的属性, 没有持久化的运行数据恢复后会不一致 """
+    simple_types = (str, int, float, bool, list, dict, type(None))
+    return {
+        node_id: {key: value for key, value in vars(node).items()
+                  if key != 'exec_unique_id' and isinstance(value, simple_types)}
+        for node_id, node in workflow.graph_engine.nodes_map.items() if isinstance(node, BaseNode)
+    }
+
+
+def run_without_pause(workflow_id: str, inputs: List[dict]):
+    callback = RecordCallback()
+    workflow = new_workflow(workflow_id, callback)
+    status, _ = workflow.run()
+    for one in inputs:
+        assert status == WorkflowStatus.INPUT.value
+        status, _ = workflow.run({'input_1': one})
+    return status, workflow, callback
+
+
+def run_with_pause(workflow_id: str, inputs: List[dict]):
+    """ 每次等待输入时导出状态, 收到输入后在新的实例上恢复执行, 模拟 continue_workflow 任务 """
+    callback = RecordCallback()
+    workflow = new_workflow(workflow_id, callback)
+    status, _ = workflow.run()
+    for one in inputs:
+        assert status == WorkflowStatus.INPUT.value
+        state = pickle.loads(pickle.dumps(workflow.dump_state()))
+        workflow = new_workflow(workflow_id, callback)
+        workflow.load_state(state)
+        status, _ = workflow.run({'input_1': one})
+    return status, workflow, callback
+
+
+def test_runtime_state_keys_exist():
+    workflow = new_workflow(uuid.uuid4().hex, RecordCallback())
+    for node_id, node in workflow.graph_engine.nodes_map.items():
+        if not isinstance(node, BaseNode):
+            continue
+        for key in node.runtime_state_keys:
+            assert hasattr(node, key), (node_id, key)
+
+
+def test_pause_resume_same_as_without_pause():
+    inputs = [{'age': '10'}, {'age': '12'}, {'age': '20'}]
+    workflow_id = uuid.uuid4().hex
+    expected_status, expected, expected_callback = run_without_pause(workflow_id, inputs)
+    status, actual, callback = run_with_pause(workflow_id, inputs)
+
+    assert expected_status == status == WorkflowStatus.SUCCESS.value
+    assert callback.user_inputs == expected_callback.user_inputs == ['input_1'] * 3
+    assert callback.node_ends == expected_callback.node_ends
+    assert callback.node_ends[-1] == 'end_1'
+
+    graph_state = actual.graph_engine.graph_state
+    assert graph_state.variables_pool == expected.graph_engine.graph_state.variables_pool
+    assert graph_state.get_variable('code_1', 'adult') == 'yes'
+    assert runtime_states(actual) == runtime_states(expected)
+    assert simple_attributes(actual) == simple_attributes(expected)
+    # 节点的执行次数跨越多次暂停累计, 最大步数的限制才能生效
+    nodes = actual.graph_engine.nodes_map
+    assert nodes['input_1'].current_step == 3
+    assert nodes['condition_1'].route_node({}) == ['end_1']
+
+
+def test_runtime_state_of_undeclared_attributes():
+    """ 节点运行中新增的基础类型属性不需要声明也会持久化, 其他类型的属性和构造参数不会持久化 """
+    workflow = new_workflow(uuid.uuid4().hex, RecordCallback())
+    workflow.run()
+    node = workflow.graph_engine.nodes_map['code_1']
+    node._run_log = {'inputs': [('age', '10')], 'outputs': None}
+    node._client = object()
+    state = pickle.loads(pickle.dumps(workflow.dump_state()))
+
+    workflow = Workflow(uuid.uuid4().hex, '1', WORKFLOW_DATA, False, 5, 10, RecordCallback())
+    workflow.load_state(state)
+    node = workflow.graph_engine.nodes_map['code_1']
+    assert node._run_log == {'inputs': [('age', '10')], 'outputs': None}
+    assert not hasattr(node, '_client')
+    assert node.max_steps == 5
+
+
+def test_max_steps_across_pause():
+    callback = RecordCallback()
+    workflow_id = uuid.uuid4().hex
+    workflow = Workflow(workflow_id, '1', WORKFLOW_DATA, False, 2, 10, callback)
+    status, _ = workflow.run()
+    for age in ['10', '11', '12']:
+        state = pickle.loads(pickle.dumps(workflow.dump_state()))
+        workflow = Workflow(workflow_id, '1', WORKFLOW_DATA, False, 2, 10, callback)
+        workflow.load_state(state)
+        status, reason = workflow.run({'input_1': {'age': age}})
+    # 输入节点在收到输入后才执行, 第三次执行时超过最大步数
+    assert status == WorkflowStatus.FAILED.value, (status, reason)
+    assert 'maximum' in reason
+
+
+if __name__ == '__main__':
+    test_runtime_state_keys_exist()
+    test_pause_resume_same_as_without_pause()
+    test_runtime_state_of_undeclared_attributes()
+    test_max_steps_across_pause()
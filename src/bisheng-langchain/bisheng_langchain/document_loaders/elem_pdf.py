@@ -2,10 +2,13 @@
 """Loads PDF with semantic splilter."""
 import io
 import json
+import math
+import multiprocessing
 import os
 import re
 import time
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from copy import deepcopy
 from typing import List, Optional, Union
 
@@ -197,8 +200,13 @@ class PDFWithSemanticLoader(BasePDFLoader):
                  start: int = 0,
                  n: int = None,
                  html_output_file: str = None,
-                 verbose: bool = False) -> None:
-        """Initialize with a file path."""
+                 verbose: bool = False,
+                 parallelism: int = 1) -> None:
+        """Initialize with a file path.
+
+        With ``parallelism`` > 1 the layout analysis of page batches runs in that many
+        worker processes, the cross-page merging is done afterwards in page order.
+        """
         self.layout_parser = LayoutParser(api_key=layout_api_key, api_base_url=layout_api_url)
         self.with_columns = with_columns
         self.is_join_table = is_join_table
@@ -208,6 +216,7 @@ class PDFWithSemanticLoader(BasePDFLoader):
         self.html_output_file = html_output_file
         self.verbose = verbose
         self.text_elem_sep = text_elem_sep
+        self.parallelism = parallelism
         super().__init__(file_path)
 
     def _get_image_blobs(self, fitz_doc, pdf_reader, n=None, start=0):
@@ -587,23 +596,15 @@ class PDFWithSemanticLoader(BasePDFLoader):
 
         return ''.join(content_page)
 
-    def load(self) -> List[Document]:
-        """Load given path as pages."""
+    def _process_pages(self, start: int, n: int) -> List[list]:
+        """Layout analysis of pages [start, start + n), return the block groups in page order."""
         import pypdfium2
         blob = Blob.from_path(self.file_path)
-        start = self.start
         groups = []
         with blob.as_bytes_io() as file_path:
             fitz_doc = fitz.open(file_path)
             pdf_doc = pypdfium2.PdfDocument(file_path, autoclose=True)
-            max_page = fitz_doc.page_count - start
-            n = self.n if self.n else max_page
-            n = min(n, max_page)
-
             tic = time.time()
-            if self.verbose:
-                print(f'{n} pages need be processed...')
-
             for idx in range(start, start + n):
                 blobs, pages = self._get_image_blobs(fitz_doc, pdf_doc, 1, idx)
                 layout = self.layout_parser.parse(blobs[0])[0]
@@ -622,6 +623,57 @@ class PDFWithSemanticLoader(BasePDFLoader):
                         elapse = round(time.time() - tic, 2)
                         tic = time.time()
                         print(f'process {count} pages used {elapse}sec...')
+        return groups
+
+    @staticmethod
+    def _has_billiard() -> bool:
+        try:
+            import billiard  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def _process_pages_parallel(self, start: int, n: int) -> List[list]:
+        # several batches per worker so that a slow batch does not leave the other workers idle
+        batch_size = max(1, math.ceil(n / (self.parallelism * 4)))
+        batches = [(one, min(batch_size, start + n - one)) for one in range(start, start + n, batch_size)]
+        workers = min(self.parallelism, len(batches))
+        # map keeps the batch order, the merged groups are the same as processing page by page
+        if multiprocessing.current_process().daemon:
+            # daemon processes (e.g. celery prefork workers) can not start children with multiprocessing,
+            # billiard, the multiprocessing fork used by celery, does not have this limit
+            from billiard.pool import Pool
+            with Pool(processes=workers) as pool:
+                results = pool.starmap(self._process_pages, batches)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(self._process_pages, *zip(*batches)))
+        return [group for batch_groups in results for group in batch_groups]
+
+    def load(self) -> List[Document]:
+        """Load given path as pages."""
+        blob = Blob.from_path(self.file_path)
+        start = self.start
+        with blob.as_bytes_io() as file_path:
+            fitz_doc = fitz.open(file_path)
+            max_page = fitz_doc.page_count - start
+            fitz_doc.close()
+        n = self.n if self.n else max_page
+        n = min(n, max_page)
+
+        if self.verbose:
+            print(f'{n} pages need be processed...')
+
+        parallel = self.parallelism > 1 and n > 1
+        if parallel and multiprocessing.current_process().daemon and not self._has_billiard():
+            if self.verbose:
+                print('daemon process can not start workers, process pages serially')
+            parallel = False
+
+        if parallel:
+            groups = self._process_pages_parallel(start, n)
+        else:
+            groups = self._process_pages(start, n)
 
         groups = self._allocate_continuous(groups)
 
@@ -1,9 +1,12 @@
 # flake8: noqa
 """Loads PDF with semantic splilter."""
 import base64
+import json
 import logging
 import os
-from typing import List
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
 
 import requests
 from langchain_community.docstore.document import Document
@@ -53,6 +56,68 @@ def merge_partitions(partitions):
     return content, metadata
 
 
+# must be a multiple of 3, so the base64 of each block can be concatenated directly
+B64_BLOCK_SIZE = 3 * 256 * 1024
+
+
+class B64FileBody:
+    """Streaming JSON request body with the file embedded as base64 in ``b64_data``.
+
+    The file is read and encoded block by block while the request is sent, so the
+    whole file and its base64 copy are never held in memory. The body length is
+    known in advance, the request is sent with Content-Length instead of chunked encoding.
+    """
+
+    def __init__(self, file_path: str, payload: dict):
+        self.file_path = file_path
+        self.prefix = (json.dumps(payload)[:-1] + ', "b64_data": ["').encode('utf-8')
+        self.suffix = b'"]}'
+        file_size = os.path.getsize(file_path)
+        self.length = len(self.prefix) + (file_size + 2) // 3 * 4 + len(self.suffix)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self.prefix
+        with open(self.file_path, 'rb') as f:
+            for block in iter(lambda: f.read(B64_BLOCK_SIZE), b''):
+                yield base64.b64encode(block)
+        yield self.suffix
+
+
+def get_pdf_page_count(file_path: str) -> Optional[int]:
+    try:
+        import fitz
+        with fitz.open(file_path) as doc:
+            return doc.page_count
+    except Exception as e:
+        logger.warning(f'get pdf page count error: {e}')
+        return None
+
+
+def write_sub_pdf(file_path: str, start: int, n: int, output_path: str):
+    """Write the pages [start, start + n) of a pdf into a new pdf."""
+    import fitz
+    with fitz.open(file_path) as doc, fitz.open() as sub_doc:
+        sub_doc.insert_pdf(doc, from_page=start, to_page=start + n - 1)
+        sub_doc.save(output_path)
+
+
+def shift_partition_pages(partitions: List[dict], offset: int) -> List[dict]:
+    """Convert page numbers of a sub pdf to page numbers of the original file.
+
+    The service numbers the pages of every request from the same base, so the page ``p`` of
+    a sub pdf starting at page ``offset`` of the original file is the page ``p + offset``.
+    """
+    if not offset:
+        return partitions
+    for part in partitions:
+        extra_data = part['metadata']['extra_data']
+        extra_data['pages'] = [page + offset for page in extra_data['pages']]
+    return partitions
+
+
 class ElemUnstructuredLoader(BasePDFLoader):
     """Loads a PDF with pypdf and chunks at character level. dummy version
 
@@ -67,8 +132,15 @@ class ElemUnstructuredLoader(BasePDFLoader):
                  start: int = 0,
                  n: int = None,
                  verbose: bool = False,
-                 kwargs: dict = {}) -> None:
-        """Initialize with a file path."""
+                 kwargs: dict = {},
+                 shard_pages: int = 50,
+                 max_concurrency: int = 4) -> None:
+        """Initialize with a file path.
+
+        PDFs with more than ``shard_pages`` pages are split into page ranges which are
+        partitioned concurrently, at most ``max_concurrency`` requests in flight.
+        ``shard_pages=0`` disables sharding.
+        """
         self.unstructured_api_url = unstructured_api_url
         self.unstructured_api_key = unstructured_api_key
         self.headers = {'Content-Type': 'application/json'}
@@ -76,20 +148,33 @@ class ElemUnstructuredLoader(BasePDFLoader):
         self.start = start
         self.n = n
         self.extra_kwargs = kwargs
+        self.shard_pages = shard_pages
+        self.max_concurrency = max_concurrency
         self.partitions = None
         super().__init__(file_path)
 
-    def load(self) -> List[Document]:
-        """Load given path as pages."""
-        b64_data = base64.b64encode(open(self.file_path, 'rb').read()).decode()
-        parameters = {'start': self.start, 'n': self.n}
+    def get_page_ranges(self) -> List[Tuple[int, Optional[int]]]:
+        """Split the pages to parse into (start, n) ranges, a single range if sharding is not needed."""
+        if not self.shard_pages or not self.file_name.lower().endswith('.pdf'):
+            return [(self.start, self.n)]
+        page_count = get_pdf_page_count(self.file_path)
+        if page_count is None:
+            return [(self.start, self.n)]
+        end = page_count if self.n is None else min(page_count, self.start + self.n)
+        if end - self.start <= self.shard_pages:
+            return [(self.start, self.n)]
+        return [(one, min(self.shard_pages, end - one)) for one in range(self.start, end, self.shard_pages)]
+
+    def partition(self, start: int, n: Optional[int], file_path: Optional[str] = None) -> dict:
+        """Partition the pages [start, start + n) of the file, return the response of the service."""
+        parameters = {'start': start, 'n': n}
         parameters.update(self.extra_kwargs)
         payload = dict(filename=os.path.basename(self.file_name),
-                       b64_data=[b64_data],
                        mode='partition',
                        parameters=parameters)
 
-        resp = requests.post(self.unstructured_api_url, headers=self.headers, json=payload)
+        resp = requests.post(self.unstructured_api_url, headers=self.headers,
+                             data=B64FileBody(file_path or self.file_path, payload))
         if resp.status_code != 200:
             raise Exception(
                 f'file partition {os.path.basename(self.file_name)} failed resp={resp.text}')
@@ -98,6 +183,39 @@ class ElemUnstructuredLoader(BasePDFLoader):
         if 200 != resp.get('status_code'):
             logger.info(f'file partition {os.path.basename(self.file_name)} error resp={resp}')
             raise Exception(f'file partition error {os.path.basename(self.file_name)} error resp={resp}')
+        return resp
+
+    def partition_shards(self, page_ranges: List[Tuple[int, Optional[int]]]) -> dict:
+        """Partition page ranges concurrently, merge the partitions in page order.
+
+        Each range is written into its own sub pdf, so every request only uploads its own pages.
+        """
+        logger.info(f'file partition {os.path.basename(self.file_name)} shards={len(page_ranges)}')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # pymupdf is not thread safe, the sub pdfs are written before the concurrent requests
+            shard_files = []
+            for start, n in page_ranges:
+                shard_file = os.path.join(tmp_dir, f'shard_{start}.pdf')
+                write_sub_pdf(self.file_path, start, n, shard_file)
+                shard_files.append(shard_file)
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(page_ranges))),
+                                    thread_name_prefix='unstructured_shard') as executor:
+                results = list(executor.map(lambda one: self.partition(0, None, one), shard_files))
+        partitions = []
+        texts = []
+        for (start, _), resp in zip(page_ranges, results):
+            partitions.extend(shift_partition_pages(resp.get('partitions') or [], start))
+            if resp.get('text'):
+                texts.append(resp['text'])
+        return {'status_code': 200, 'partitions': partitions, 'text': '\n'.join(texts)}
+
+    def load(self) -> List[Document]:
+        """Load given path as pages."""
+        page_ranges = self.get_page_ranges()
+        if len(page_ranges) > 1:
+            resp = self.partition_shards(page_ranges)
+        else:
+            resp = self.partition(*page_ranges[0])
         partitions = resp['partitions']
         if partitions:
             logger.info(f'content_from_partitions')
@@ -1,9 +1,13 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import requests
+import requests.adapters
 from langchain.embeddings.base import Embeddings
 from langchain.utils import get_from_dict_or_env
 from pydantic import model_validator, BaseModel, Field
@@ -27,17 +31,6 @@ def _create_retry_decorator(embeddings: HostEmbeddings) -> Callable[[Any], Any]:
     )
 
 
-def embed_with_retry(embeddings: HostEmbeddings, **kwargs: Any) -> Any:
-    """Use tenacity to retry the embedding call."""
-    retry_decorator = _create_retry_decorator(embeddings)
-
-    @retry_decorator
-    def _embed_with_retry(**kwargs: Any) -> Any:
-        return embeddings.embed(**kwargs)
-
-    return _embed_with_retry(**kwargs)
-
-
 class HostEmbeddings(BaseModel, Embeddings):
     """host embedding models.
     """
@@ -51,7 +44,13 @@ class HostEmbeddings(BaseModel, Embeddings):
 
     embedding_ctx_length: Optional[int] = 6144
     """The maximum number of tokens to embed at once."""
+    max_batch_size: int = 200
     """Maximum number of texts to embed in each batch"""
+    max_batch_tokens: int = 32768
+    """Maximum number of estimated tokens in each batch, a text is counted as
+    min(len(text), embedding_ctx_length) tokens because the model truncates longer input."""
+    max_concurrency: int = 4
+    """Maximum number of batches in flight at the same time."""
     max_retries: Optional[int] = 6
     """Maximum number of retries to make when generating."""
     request_timeout: Optional[Union[float, Tuple[float, float]]] = 200
@@ -76,10 +75,7 @@ class HostEmbeddings(BaseModel, Embeddings):
         except Exception:
             raise Exception(f'Failed to set url ep failed for model {model}')
 
-        try:
-            values['client'] = requests.post
-        except AttributeError:
-            raise ValueError('Try upgrading it with `pip install --upgrade requests`.')
+        values['client'] = _create_session(values.get('max_concurrency', 4))
         return values
 
     @property
@@ -91,56 +87,164 @@ class HostEmbeddings(BaseModel, Embeddings):
         }
         return api_args
 
-    def embed(self, texts: List[str], **kwargs) -> List[List[float]]:
-        emb_type = kwargs.get('type', 'raw')
-        inp = {'texts': texts, 'model': self.model, 'type': emb_type}
+    def _split_batches(self, texts: List[str]) -> List[Tuple[int, int]]:
+        """Split texts into [start, end) ranges by count and token budget."""
+        batches = []
+        start = 0
+        batch_tokens = 0
+        for index, text in enumerate(texts):
+            text_tokens = len(text)
+            if self.embedding_ctx_length:
+                text_tokens = min(text_tokens, self.embedding_ctx_length)
+            if index > start and (index - start >= self.max_batch_size
+                                  or batch_tokens + text_tokens > self.max_batch_tokens):
+                batches.append((start, index))
+                start = index
+                batch_tokens = 0
+            batch_tokens += text_tokens
+        if start < len(texts):
+            batches.append((start, len(texts)))
+        return batches
+
+    def _batch_payload(self, texts: List[str], emb_type: str) -> Dict:
+        payload = {'texts': texts, 'model': self.model, 'type': emb_type}
         if self.verbose:
-            print('payload', inp)
-
-        max_text_to_split = 200
-        outp = None
-
-        start_index = 0
-        len_text = len(texts)
-        while start_index < len_text:
-            inp_local = {
-                'texts': texts[start_index:min(start_index + max_text_to_split, len_text)],
-                'model': self.model,
-                'type': emb_type
-            }
-            try:
-                outp_single = self.client(url=self.url_ep,
-                                          json=inp_local,
-                                          timeout=self.request_timeout).json()
-                if outp is None:
-                    outp = outp_single
-                else:
-                    outp['embeddings'] += outp_single['embeddings']
-            except requests.exceptions.Timeout:
-                raise Exception(f'timeout in host embedding infer, url=[{self.url_ep}]')
-            except Exception as e:
-                raise Exception(f'exception in host embedding infer: [{e}]')
-
-            if outp_single['status_code'] != 200:
-                raise ValueError(f"API returned an error: {outp['status_message']}")
-            start_index += max_text_to_split
+            print('payload', payload)
+        return payload
+
+    def _parse_response(self, outp: Dict, batch_size: int) -> List[List[float]]:
+        if outp.get('status_code') != 200:
+            raise ValueError(f"API returned an error: {outp.get('status_message')}")
+        if len(outp['embeddings']) != batch_size:
+            raise ValueError(f"API returned {len(outp['embeddings'])} embeddings "
+                             f'for {batch_size} texts')
         return outp['embeddings']
 
+    def _embed_batch(self, texts: List[str], emb_type: str) -> List[List[float]]:
+        try:
+            outp = self.client.post(url=self.url_ep,
+                                    json=self._batch_payload(texts, emb_type),
+                                    timeout=self.request_timeout).json()
+        except requests.exceptions.Timeout:
+            raise Exception(f'timeout in host embedding infer, url=[{self.url_ep}]')
+        except Exception as e:
+            raise Exception(f'exception in host embedding infer: [{e}]')
+        return self._parse_response(outp, len(texts))
+
+    async def _aembed_batch(self, client: Any, texts: List[str],
+                            emb_type: str) -> List[List[float]]:
+        import httpx
+        timeout = self.request_timeout
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        try:
+            resp = await client.post(self.url_ep,
+                                     json=self._batch_payload(texts, emb_type),
+                                     timeout=timeout)
+            outp = resp.json()
+        except httpx.TimeoutException:
+            raise Exception(f'timeout in host embedding infer, url=[{self.url_ep}]')
+        except Exception as e:
+            raise Exception(f'exception in host embedding infer: [{e}]')
+        return self._parse_response(outp, len(texts))
+
+    def embed(self, texts: List[str], **kwargs) -> List[List[float]]:
+        emb_type = kwargs.get('type', 'raw')
+        batches = self._split_batches(texts)
+        retry_decorator = _create_retry_decorator(self)
+
+        # only the failed batch is retried
+        @retry_decorator
+        def _embed_batch_with_retry(start: int, end: int) -> List[List[float]]:
+            return self._embed_batch(texts[start:end], emb_type)
+
+        if len(batches) <= 1 or self.max_concurrency <= 1:
+            results = [_embed_batch_with_retry(start, end) for start, end in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency,
+                                                    len(batches))) as executor:
+                results = list(executor.map(lambda one: _embed_batch_with_retry(*one), batches))
+        return [emb for result in results for emb in result]
+
+    async def aembed(self, texts: List[str], **kwargs) -> List[List[float]]:
+        emb_type = kwargs.get('type', 'raw')
+        batches = self._split_batches(texts)
+        retry_decorator = _create_retry_decorator(self)
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+        client = _get_async_client(self.max_concurrency)
+
+        @retry_decorator
+        async def _aembed_batch_with_retry(start: int, end: int) -> List[List[float]]:
+            return await self._aembed_batch(client, texts[start:end], emb_type)
+
+        async def _run(start: int, end: int) -> List[List[float]]:
+            async with semaphore:
+                return await _aembed_batch_with_retry(start, end)
+
+        results = await asyncio.gather(*[_run(start, end) for start, end in batches])
+        return [emb for result in results for emb in result]
+
     def embed_documents(self,
                         texts: List[str],
                         chunk_size: Optional[int] = 0) -> List[List[float]]:
+        """Embed search docs."""
         if not texts:
             return []
-        """Embed search docs."""
         texts = [text for text in texts if text]
-        embeddings = embed_with_retry(self, texts=texts, type='doc')
-        return embeddings
+        return self.embed(texts, type='doc')
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Asynchronous Embed search docs."""
+        if not texts:
+            return []
+        texts = [text for text in texts if text]
+        return await self.aembed(texts, type='doc')
 
     def embed_query(self, text: str) -> List[float]:
-        embeddings = embed_with_retry(self, texts=[text], type='query')
+        embeddings = self.embed([text], type='query')
+        return embeddings[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        embeddings = await self.aembed([text], type='query')
         return embeddings[0]
 
 
+def _create_session(pool_size: int) -> requests.Session:
+    """Keep-alive session shared by all the batches of an embedding instance."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=max(1, pool_size),
+                                            pool_maxsize=max(1, pool_size))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# async clients can only be used in the event loop that created them, so one client is kept per
+# event loop and pool size, it is released together with the event loop
+_async_clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[int, Any]]' = \
+    weakref.WeakKeyDictionary()
+
+
+def _get_async_client(pool_size: int) -> Any:
+    """Keep-alive async client shared by the embedding instances in the current event loop."""
+    import httpx
+    pool_size = max(1, pool_size)
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(pool_size)
+    if client is None:
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        client = httpx.AsyncClient(limits=limits)
+        clients[pool_size] = client
+    return client
+
+
+async def close_async_clients():
+    """Close the async clients of the current event loop, call it on shutdown."""
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
+
+
 class ME5Embedding(HostEmbeddings):
     model: str = 'multi-e5'
     embedding_ctx_length: int = 512
@@ -175,8 +279,5 @@ class CustomHostEmbedding(HostEmbeddings):
         except Exception:
             raise Exception('Failed to set url ep for custom host embedding')
 
-        try:
-            values['client'] = requests.post
-        except AttributeError:
-            raise ValueError('Try upgrading it with `pip install --upgrade requests`.')
+        values['client'] = _create_session(values.get('max_concurrency', 4))
         return values
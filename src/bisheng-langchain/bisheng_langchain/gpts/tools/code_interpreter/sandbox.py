@@ -0,0 +1,296 @@
+import atexit
+import json
+import os
+import select
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'sandbox_worker.py')
+DEFAULT_PRELOAD = ['numpy', 'pandas', 'matplotlib', 'matplotlib.pyplot']
+WORKER_START_TIMEOUT = 120
+
+
+class SandboxTimeout(Exception):
+    """The code did not finish in time, the worker has been killed."""
+
+
+class SandboxWorkerExited(Exception):
+    """The worker process exited while running the code, e.g. killed by the memory or cpu limit."""
+
+
+class SandboxWorker:
+    """A pre-warmed python process which executes code snippets one at a time."""
+
+    def __init__(self, config: Dict):
+        env = dict(os.environ)
+        env['MPLBACKEND'] = 'Agg'
+        self.process = subprocess.Popen(
+            [sys.executable, WORKER_SCRIPT, json.dumps(config)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            env=env,
+            start_new_session=True,
+        )
+        self.ready = False
+        self.tasks = 0
+        self._lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def _read_line(self, timeout: float) -> Dict:
+        ready, _, _ = select.select([self.process.stdout], [], [], max(timeout, 0))
+        if not ready:
+            raise SandboxTimeout()
+        line = self.process.stdout.readline()
+        if not line:
+            self.process.wait()
+            raise SandboxWorkerExited(f'exit code {self.process.returncode}')
+        return json.loads(line)
+
+    def wait_ready(self, timeout: float = WORKER_START_TIMEOUT):
+        if not self.ready:
+            self._read_line(timeout)
+            self.ready = True
+
+    def run(self, request: Dict, timeout: float) -> Dict:
+        deadline = time.monotonic() + timeout
+        # a session worker may be shared by several threads, requests must not interleave on the pipe
+        if not self._lock.acquire(timeout=timeout):
+            raise SandboxTimeout()
+        try:
+            return self._run(request, deadline)
+        finally:
+            self._lock.release()
+
+    def _run(self, request: Dict, deadline: float) -> Dict:
+        self.wait_ready()
+        self.tasks += 1
+        self.last_used = time.monotonic()
+        try:
+            self.process.stdin.write((json.dumps(request, ensure_ascii=False) + '\n').encode('utf-8'))
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            self.process.wait()
+            raise SandboxWorkerExited(f'exit code {self.process.returncode}')
+        return self._read_line(deadline - time.monotonic())
+
+    def kill(self):
+        if self.alive:
+            try:
+                # the worker runs in its own session, kill the child processes started by user code as well
+                os.killpg(self.process.pid, 9)
+            except OSError:
+                self.process.kill()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            logger.warning(f'code interpreter worker {self.process.pid} did not exit')
+
+
+class SandboxPool:
+    """
+    Pool of pre-warmed python workers for the code interpreter.
+    Workers import the common analysis libraries once, so running a snippet only costs an IPC round trip.
+    - A timeout kills the worker and its child processes, a new worker is started in the background.
+    - memory_limit_mb / cpu_limit are applied to each worker with rlimit.
+    - Calls with a session_id run in a dedicated worker and share global variables between calls.
+      At most max_sessions session workers are kept, the least recently used one is killed to make room,
+      and sessions idle longer than session_idle_timeout are killed by the background warm-up thread.
+    - Calls without a session_id get a fresh worker which is killed afterwards, state left by the code
+      (monkeypatched modules, os.environ, threads) never reaches another caller. Set reuse_workers only
+      when all callers of the process trust each other, workers are then reused up to max_tasks_per_worker.
+    """
+
+    def __init__(self,
+                 size: int = 2,
+                 preload: Optional[List[str]] = None,
+                 memory_limit_mb: Optional[int] = 4096,
+                 cpu_limit: Optional[int] = None,
+                 max_tasks_per_worker: int = 100,
+                 session_idle_timeout: float = 1800,
+                 max_sessions: int = 8,
+                 reuse_workers: bool = False):
+        self.size = size
+        self.reuse_workers = reuse_workers
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.session_idle_timeout = session_idle_timeout
+        self.max_sessions = max_sessions
+        # how often the warm-up thread looks for idle sessions
+        self.reap_interval = min(60.0, session_idle_timeout)
+        self.cpu_limit = cpu_limit
+        self.worker_config = {
+            'preload': DEFAULT_PRELOAD if preload is None else preload,
+            'memory_limit_mb': memory_limit_mb,
+        }
+        self._idle: List[SandboxWorker] = []
+        # session workers in least recently used order
+        self._sessions: 'OrderedDict[str, SandboxWorker]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._warm_up_thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def _refill(self):
+        try:
+            while not self._closed:
+                with self._lock:
+                    if len(self._idle) >= self.size:
+                        return
+                worker = SandboxWorker(self.worker_config)
+                with self._lock:
+                    if not self._closed:
+                        self._idle.append(worker)
+                        continue
+                worker.kill()
+        except Exception as e:
+            logger.warning(f'start code interpreter worker error: {e}')
+
+    def _warm_up_loop(self):
+        while not self._closed:
+            self._wake_up.clear()
+            self._expire_sessions()
+            self._refill()
+            self._wake_up.wait(self.reap_interval)
+
+    def warm_up(self):
+        """Start idle workers in the background up to the pool size."""
+        with self._lock:
+            if self._closed:
+                return
+            if self._warm_up_thread is None:
+                self._warm_up_thread = threading.Thread(target=self._warm_up_loop,
+                                                        name='code-interpreter-warm-up',
+                                                        daemon=True)
+                self._warm_up_thread.start()
+        self._wake_up.set()
+
+    def _acquire(self) -> SandboxWorker:
+        worker = None
+        with self._lock:
+            while self._idle:
+                one = self._idle.pop(0)
+                if one.alive:
+                    worker = one
+                    break
+                one.kill()
+        self.warm_up()
+        return worker or SandboxWorker(self.worker_config)
+
+    def _release(self, worker: SandboxWorker):
+        if self.reuse_workers:
+            with self._lock:
+                if (worker.alive and worker.tasks < self.max_tasks_per_worker
+                        and len(self._idle) < self.size):
+                    self._idle.append(worker)
+                    return
+        worker.kill()
+        self.warm_up()
+
+    def _expire_sessions(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, worker in self._sessions.items()
+                       if now - worker.last_used > self.session_idle_timeout]
+            workers = [self._sessions.pop(key) for key in expired]
+        for worker in workers:
+            worker.kill()
+
+    def _session_worker(self, session_id: str) -> SandboxWorker:
+        with self._lock:
+            worker = self._sessions.get(session_id)
+            if worker is not None:
+                self._sessions.move_to_end(session_id)
+        if worker is not None and worker.alive:
+            return worker
+        worker = self._acquire()
+        evicted = []
+        with self._lock:
+            old = self._sessions.pop(session_id, None)
+            if old is not None:
+                evicted.append(old)
+            while self._sessions and len(self._sessions) >= self.max_sessions:
+                evicted.append(self._sessions.popitem(last=False)[1])
+            self._sessions[session_id] = worker
+        for one in evicted:
+            one.kill()
+        return worker
+
+    def execute(self, code: str, work_dir: str, timeout: float, filename: Optional[str] = None,
+                session_id: Optional[str] = None) -> Tuple[int, str, str]:
+        """Run code in a worker, return (returncode, stdout, stderr)."""
+        self._expire_sessions()
+        if session_id:
+            worker = self._session_worker(session_id)
+        else:
+            worker = self._acquire()
+
+        request = {
+            'code': code,
+            'work_dir': work_dir,
+            'filename': filename,
+            'keep_globals': bool(session_id),
+            'cpu_limit': self.cpu_limit,
+        }
+        try:
+            response = worker.run(request, timeout)
+            returncode, stdout, stderr = response['returncode'], response['stdout'], response['stderr']
+        except Exception as e:
+            # the worker state is unknown after any failure, e.g. user code broke the protocol output
+            worker.kill()
+            if session_id:
+                with self._lock:
+                    if self._sessions.get(session_id) is worker:
+                        self._sessions.pop(session_id)
+            self.warm_up()
+            if isinstance(e, SandboxTimeout):
+                raise
+            if isinstance(e, SandboxWorkerExited):
+                return 1, '', f'code interpreter worker exited unexpectedly ({e}), ' \
+                              f'the code may exceed the memory or cpu limit'
+            logger.warning(f'code interpreter worker error: {e!r}')
+            return 1, '', f'code interpreter worker returned an invalid response ({e!r})'
+        if not session_id:
+            self._release(worker)
+        return returncode, stdout, stderr
+
+    def close_session(self, session_id: str):
+        with self._lock:
+            worker = self._sessions.pop(session_id, None)
+        if worker is not None:
+            worker.kill()
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            workers = self._idle + list(self._sessions.values())
+            self._idle = []
+            self._sessions = OrderedDict()
+        self._wake_up.set()
+        for worker in workers:
+            worker.kill()
+
+
+_sandbox_pool: Optional[SandboxPool] = None
+_sandbox_pool_lock = threading.Lock()
+
+
+def get_sandbox_pool(**kwargs) -> SandboxPool:
+    """The process wide sandbox pool, kwargs only take effect when the pool is created."""
+    global _sandbox_pool
+    if _sandbox_pool is None:
+        with _sandbox_pool_lock:
+            if _sandbox_pool is None:
+                _sandbox_pool = SandboxPool(**kwargs)
+                _sandbox_pool.warm_up()
+                atexit.register(_sandbox_pool.shutdown)
+    return _sandbox_pool
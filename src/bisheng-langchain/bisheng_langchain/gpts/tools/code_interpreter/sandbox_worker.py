@@ -0,0 +1,150 @@
+"""Long running python worker used by the code interpreter sandbox pool.
+
+The worker imports the common analysis libraries once at startup and then executes
+code snippets sent by the parent process. It only depends on the standard library so
+it can be started directly with ``python sandbox_worker.py``.
+
+Protocol: one JSON object per line. The parent writes requests to the worker stdin,
+the worker answers on a private copy of its original stdout, the real stdout and
+stderr file descriptors are redirected into temp files while user code runs.
+"""
+import os
+import sys
+import tempfile
+import traceback
+# bound at import time, user code patching the json module must not break the protocol
+from json import dumps as _dumps
+from json import loads as _loads
+
+
+def _set_memory_limit(memory_limit_mb):
+    if not memory_limit_mb:
+        return
+    import resource
+    limit = int(memory_limit_mb) * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _set_cpu_limit(cpu_limit):
+    """RLIMIT_CPU counts the whole process lifetime, so the soft limit is moved forward per request."""
+    if not cpu_limit:
+        return
+    import resource
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(usage.ru_utime + usage.ru_stime) + int(cpu_limit)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _preload(modules):
+    for name in modules:
+        try:
+            __import__(name)
+        except Exception:
+            pass
+    if 'matplotlib.pyplot' in sys.modules:
+        try:
+            import matplotlib
+            matplotlib.rc('font', family='WenQuanYi Zen Hei')
+        except Exception:
+            pass
+
+
+def _read_capture(fp) -> str:
+    fp.seek(0)
+    return fp.read().decode('utf-8', errors='replace')
+
+
+def _close_figures():
+    pyplot = sys.modules.get('matplotlib.pyplot')
+    if pyplot is not None:
+        try:
+            pyplot.close('all')
+        except Exception:
+            pass
+
+
+def run_code(request: dict, session_globals: dict) -> dict:
+    os.chdir(request['work_dir'])
+    # same as running a script file in work_dir, modules next to it can be imported
+    sys.path.insert(0, request['work_dir'])
+    if request.get('keep_globals'):
+        code_globals = session_globals
+    else:
+        code_globals = {'__name__': '__main__', '__builtins__': __builtins__}
+
+    _set_cpu_limit(request.get('cpu_limit'))
+    stdout_fp = tempfile.TemporaryFile()
+    stderr_fp = tempfile.TemporaryFile()
+    saved_stdout, saved_stderr = os.dup(1), os.dup(2)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(stdout_fp.fileno(), 1)
+    os.dup2(stderr_fp.fileno(), 2)
+    returncode = 0
+    try:
+        code = compile(request['code'], request.get('filename') or '<string>', 'exec')
+        exec(code, code_globals)
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            returncode = e.code if isinstance(e.code, int) else 1
+            if not isinstance(e.code, int):
+                print(e.code, file=sys.stderr)
+    except BaseException as e:
+        returncode = 1
+        # skip the frame of run_code, the traceback starts from the user code
+        tb = e.__traceback__.tb_next if e.__traceback__ is not None else None
+        traceback.print_exception(type(e), e, tb or e.__traceback__)
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except Exception:
+            pass
+        os.dup2(saved_stdout, 1)
+        os.dup2(saved_stderr, 2)
+        os.close(saved_stdout)
+        os.close(saved_stderr)
+        _close_figures()
+        if sys.path and sys.path[0] == request['work_dir']:
+            sys.path.pop(0)
+    return {
+        'returncode': returncode,
+        'stdout': _read_capture(stdout_fp),
+        'stderr': _read_capture(stderr_fp),
+    }
+
+
+def main():
+    config = _loads(sys.argv[1]) if len(sys.argv) > 1 else {}
+    # drop the directory of this script from the import path
+    if sys.path and os.path.abspath(sys.path[0]) == os.path.dirname(os.path.abspath(__file__)):
+        sys.path.pop(0)
+    # the protocol channels are private copies of stdin and stdout, user code can not touch them
+    requests = os.fdopen(os.dup(0), 'r', encoding='utf-8')
+    channel = os.fdopen(os.dup(1), 'w', encoding='utf-8')
+    os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+    os.dup2(os.open(os.devnull, os.O_WRONLY), 1)
+
+    _set_memory_limit(config.get('memory_limit_mb'))
+    _preload(config.get('preload', []))
+    channel.write(_dumps({'ready': True}) + '\n')
+    channel.flush()
+
+    session_globals = {'__name__': '__main__', '__builtins__': __builtins__}
+    for line in requests:
+        if not line.strip():
+            continue
+        request = _loads(line)
+        try:
+            response = run_code(request, session_globals)
+        except BaseException:
+            response = {'returncode': 1, 'stdout': '', 'stderr': traceback.format_exc()}
+        channel.write(_dumps(response, ensure_ascii=False) + '\n')
+        channel.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,7 +6,6 @@ import re
 import subprocess
 import sys
 import tempfile
-from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from datetime import timedelta
 from hashlib import md5
 from pathlib import Path
@@ -18,6 +17,8 @@ from langchain_community.tools import Tool
 from pydantic import BaseModel, Field
 from loguru import logger
 
+from bisheng_langchain.gpts.tools.code_interpreter.sandbox import SandboxTimeout, get_sandbox_pool
+
 CODE_BLOCK_PATTERN = r"```(\w*)\n(.*?)\n```"
 DEFAULT_TIMEOUT = 600
 WIN32 = sys.platform == 'win32'
@@ -98,6 +99,8 @@ def execute_code(
     filename: Optional[str] = None,
     work_dir: Optional[str] = None,
     lang: Optional[str] = 'python',
+    session_id: Optional[str] = None,
+    sandbox: Optional[Dict] = None,
 ) -> Tuple[int, str, str]:
     if all((code is None, filename is None)):
         error_msg = f'Either {code=} or {filename=} must be provided.'
@@ -121,33 +124,38 @@ def execute_code(
         with open(filepath, 'w', encoding='utf-8') as fout:
             fout.write(code)
 
-    cmd = [
-        sys.executable if lang.startswith('python') else _cmd(lang),
-        f'.\\{filename}' if WIN32 else filename,
-    ]
-    if WIN32:
-        logger.warning('SIGALRM is not supported on Windows. No timeout will be enforced.')
-        result = subprocess.run(
-            cmd,
-            cwd=work_dir,
-            capture_output=True,
-            text=True,
-        )
+    if lang.startswith('python') and not WIN32:
+        # python代码在预热好的解释器进程内执行, 不需要每次启动新的进程
+        try:
+            returncode, stdout, stderr = get_sandbox_pool(**(sandbox or {})).execute(
+                code if code is not None else Path(filepath).read_text(encoding='utf-8'),
+                work_dir=work_dir,
+                timeout=timeout,
+                filename=filename,
+                session_id=session_id)
+        except SandboxTimeout:
+            if original_filename is None:
+                os.remove(filepath)
+            return 1, TIMEOUT_MSG, None
+        result = subprocess.CompletedProcess(args=filename, returncode=returncode, stdout=stdout, stderr=stderr)
     else:
-        with ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(
-                subprocess.run,
+        cmd = [
+            sys.executable if lang.startswith('python') else _cmd(lang),
+            f'.\\{filename}' if WIN32 else filename,
+        ]
+        try:
+            # 超时后subprocess.run会结束子进程
+            result = subprocess.run(
                 cmd,
                 cwd=work_dir,
                 capture_output=True,
                 text=True,
+                timeout=timeout,
             )
-            try:
-                result = future.result(timeout=timeout)
-            except TimeoutError:
-                if original_filename is None:
-                    os.remove(filepath)
-                return 1, TIMEOUT_MSG, None
+        except subprocess.TimeoutExpired:
+            if original_filename is None:
+                os.remove(filepath)
+            return 1, TIMEOUT_MSG, None
     if original_filename is None:
         os.remove(filepath)
     if result.returncode:
@@ -277,9 +285,17 @@ class CodeInterpreterTool:
         self,
         minio: Dict[str, any],
         files: Dict[str, FileInfo] = None,
+        session_id: Optional[str] = None,
+        sandbox: Optional[Dict] = None,
     ) -> None:
+        """
+        session_id: 相同session_id的调用在同一个解释器进程内执行, 可以使用上次执行留下的变量
+        sandbox: 解释器进程池的配置, 参考SandboxPool的参数
+        """
         self.minio = minio
         self.files = files if files else {}
+        self.session_id = session_id
+        self.sandbox = sandbox
 
     @property
     def file_description(self) -> str:
@@ -311,6 +327,8 @@ class CodeInterpreterTool:
                 code,
                 work_dir=temp_dir.name,
                 lang=lang,
+                session_id=self.session_id,
+                sandbox=self.sandbox,
             )
             logs_all += '\n' + logs
             if exitcode != 0:
@@ -1,5 +1,8 @@
+import copy
+import functools
 import os
-from typing import Any, Dict, Optional, Tuple, Union
+import threading
+from typing import Any, Dict, Optional, Tuple, Type, Union
 
 import httpx
 import yaml
@@ -12,7 +15,7 @@ from bisheng_langchain.vectorstores import ElasticKeywordsSearch, Milvus
 from langchain.chains.llm import LLMChain
 from langchain.chains.question_answering import load_qa_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_core.callbacks import CallbackManagerForChainRun
+from langchain_core.callbacks import AsyncCallbackManagerForChainRun, CallbackManagerForChainRun
 from langchain_core.language_models.base import LanguageModelLike
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
@@ -22,6 +25,61 @@ from langchain_core.vectorstores import VectorStoreRetriever
 from loguru import logger
 
 
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   'config/baseline_v2.yaml')
+
+RETRIEVER_CLASSES = {
+    'KeywordRetriever': KeywordRetriever,
+    'BaselineVectorRetriever': BaselineVectorRetriever,
+    'MixRetriever': MixRetriever,
+    'SmallerChunksVectorRetriever': SmallerChunksVectorRetriever,
+}
+
+# yaml_path -> (mtime, content)
+_config_content_cache: Dict[str, Tuple[float, str]] = {}
+_config_content_lock = threading.Lock()
+
+
+def _read_config_content(yaml_path: str) -> str:
+    """ read the config file only when it is modified """
+    mtime = os.path.getmtime(yaml_path)
+    with _config_content_lock:
+        cached = _config_content_cache.get(yaml_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    with open(yaml_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    with _config_content_lock:
+        _config_content_cache[yaml_path] = (mtime, content)
+    return content
+
+
+@functools.lru_cache(maxsize=16)
+def _parse_config(content: str) -> Dict:
+    return yaml.safe_load(content)
+
+
+@functools.lru_cache(maxsize=16)
+def _build_retriever_templates(content: str) -> Tuple[Tuple[Type, Dict, Dict], ...]:
+    """
+    build the retriever templates of the config, the splitters are stateless and shared
+    by all the retrievers, only the stores are bound per request.
+    return: ((retriever_class, splitter_kwargs, retrieval_kwargs), ...)
+    """
+    templates = []
+    retrievers = copy.deepcopy(_parse_config(content)['retriever']['retrievers'])
+    for retriever in retrievers:
+        retriever_type = retriever.pop('type')
+        if retriever_type not in RETRIEVER_CLASSES:
+            raise ValueError(f'Unknown retriever type: {retriever_type}')
+        splitter_kwargs = {}
+        for key, value in retriever['splitter'].items():
+            splitter_obj = import_by_type(_type='textsplitters', name=value.pop('type'))
+            splitter_kwargs[key] = splitter_obj(**value)
+        templates.append((RETRIEVER_CLASSES[retriever_type], splitter_kwargs, retriever['retrieval']))
+    return tuple(templates)
+
+
 class MultArgsSchemaTool(Tool):
 
     def _to_args_and_kwargs(self, tool_input: Union[str, Dict], tool_call_id: Optional[str]) -> Tuple[Tuple, Dict]:
@@ -48,10 +106,8 @@ class BishengRAGTool:
             )
         self.collection_name = collection_name
 
-        yaml_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                                 'config/baseline_v2.yaml')
-        with open(yaml_path, 'r', encoding='utf-8') as f:
-            self.params = yaml.safe_load(f)
+        config_content = _read_config_content(DEFAULT_CONFIG_PATH)
+        self.params = copy.deepcopy(_parse_config(config_content))
 
         # update params
         max_content = kwargs.get('max_content', 15000)
@@ -118,19 +174,15 @@ class BishengRAGTool:
                 llm_chain=llm_chain,
             )
 
-        # init retriever
+        # init retriever, only bind the stores to the cached templates
         retriever_list = []
-        retrievers = self.params['retriever']['retrievers']
-        for retriever in retrievers:
-            retriever_type = retriever.pop('type')
-            retriever_params = {
-                'vector_store': self.vector_store,
-                'keyword_store': self.keyword_store,
-                'splitter_kwargs': retriever['splitter'],
-                'retrieval_kwargs': retriever['retrieval'],
-            }
+        for retriever_class, splitter_kwargs, retrieval_kwargs in _build_retriever_templates(
+                config_content):
             retriever_list.append(
-                self._post_init_retriever(retriever_type=retriever_type, **retriever_params))
+                retriever_class(vector_store=self.vector_store,
+                                keyword_store=self.keyword_store,
+                                **splitter_kwargs,
+                                **copy.deepcopy(retrieval_kwargs)))
         self.retriever = EnsembleRetriever(retrievers=retriever_list)
 
         # init qa chain
@@ -145,32 +197,6 @@ class BishengRAGTool:
         self.prompt_inputs = prompt.input_variables
         self.qa_chain = create_stuff_documents_chain(llm=self.llm, prompt=prompt)
 
-    def _post_init_retriever(self, retriever_type, **kwargs):
-        retriever_classes = {
-            'KeywordRetriever': KeywordRetriever,
-            'BaselineVectorRetriever': BaselineVectorRetriever,
-            'MixRetriever': MixRetriever,
-            'SmallerChunksVectorRetriever': SmallerChunksVectorRetriever,
-        }
-        if retriever_type not in retriever_classes:
-            raise ValueError(f'Unknown retriever type: {retriever_type}')
-
-        input_kwargs = {}
-        splitter_params = kwargs.pop('splitter_kwargs')
-        for key, value in splitter_params.items():
-            splitter_obj = import_by_type(_type='textsplitters', name=value.pop('type'))
-            input_kwargs[key] = splitter_obj(**value)
-
-        retrieval_params = kwargs.pop('retrieval_kwargs')
-        for key, value in retrieval_params.items():
-            input_kwargs[key] = value
-
-        input_kwargs['vector_store'] = kwargs.pop('vector_store')
-        input_kwargs['keyword_store'] = kwargs.pop('keyword_store')
-
-        retriever_class = retriever_classes[retriever_type]
-        return retriever_class(**input_kwargs)
-
     def file2knowledge(self, file_path, drop_old=True):
         """
         file to knowledge
@@ -212,6 +238,17 @@ class BishengRAGTool:
         # EnsembleRetriever直接检索召回会默认去重
         docs = self.retriever.get_relevant_documents(query=query,
                                                      collection_name=self.collection_name)
+        return self._trim_docs(docs)
+
+    async def aretrieval_and_rerank(self, query):
+        """
+        async retrieval and rerank
+        """
+        docs = await self.retriever.aget_relevant_documents(query=query,
+                                                            collection_name=self.collection_name)
+        return self._trim_docs(docs)
+
+    def _trim_docs(self, docs):
         logger.info(f'retrieval docs origin: {len(docs)}')
 
         # delete redundancy according to max_content
@@ -239,12 +276,26 @@ class BishengRAGTool:
             kwargs = {}
             if run_manager:
                 kwargs['config'] = RunnableConfig(callbacks=[run_manager])
-            tmp_input = {
-                'context': docs,
-            }
-            if 'question' in self.prompt_inputs:
-                tmp_input['question'] = query
-            ans = self.qa_chain.invoke(tmp_input, **kwargs)
+            ans = self.qa_chain.invoke(self._get_qa_input(query, docs), **kwargs)
+        except Exception as e:
+            logger.exception(f'question: {query}\nerror: {e}')
+            ans = str(e)
+        if return_only_outputs:
+            return ans
+        else:
+            return ans, docs
+
+    async def arun(self,
+                   query: str,
+                   return_only_outputs=True,
+                   run_manager: Optional[AsyncCallbackManagerForChainRun] = None) -> Any:
+        docs = await self.aretrieval_and_rerank(query)
+        try:
+            kwargs = {}
+            if run_manager:
+                # 子回调会继承上层的handler, 流式输出的token可以直接推送给调用方
+                kwargs['config'] = RunnableConfig(callbacks=run_manager.get_child())
+            ans = await self.qa_chain.ainvoke(self._get_qa_input(query, docs), **kwargs)
         except Exception as e:
             logger.exception(f'question: {query}\nerror: {e}')
             ans = str(e)
@@ -253,9 +304,13 @@ class BishengRAGTool:
         else:
             return ans, docs
 
-    async def arun(self, query: str, return_only_outputs=True) -> str:
-        rag_answer = self.run(query, return_only_outputs)
-        return rag_answer
+    def _get_qa_input(self, query, docs) -> Dict[str, Any]:
+        qa_input = {
+            'context': docs,
+        }
+        if 'question' in self.prompt_inputs:
+            qa_input['question'] = query
+        return qa_input
 
     @classmethod
     def get_rag_tool(cls, name, description, **kwargs: Any) -> BaseTool:
@@ -263,10 +318,11 @@ class BishengRAGTool:
         class InputArgs(BaseModel):
             query: str = Field(description='question asked by the user.')
 
+        rag_tool = cls(**kwargs)
         return MultArgsSchemaTool(name=name,
                                   description=description,
-                                  func=cls(**kwargs).run,
-                                  coroutine=cls(**kwargs).arun,
+                                  func=rag_tool.run,
+                                  coroutine=rag_tool.arun,
                                   args_schema=InputArgs)
 
 
@@ -19,6 +19,8 @@ messages = [
         HumanMessagePromptTemplate.from_template(human_template),
     ]
 title_extract_prompt = ChatPromptTemplate.from_messages(messages)
+# bump this when the prompt changes, cached titles are keyed by it
+title_extract_prompt_version = '1'
 
 
 def extract_title(llm, text, max_length=7000) -> str:
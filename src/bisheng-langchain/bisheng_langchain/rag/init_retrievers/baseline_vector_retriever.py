@@ -4,6 +4,7 @@ from langchain.text_splitter import TextSplitter
 from langchain_core.documents import Document
 from pydantic import Field
 from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables.config import run_in_executor
 from loguru import logger
 
 
@@ -41,17 +42,32 @@ class BaselineVectorRetriever(BaseRetriever):
             drop_old=drop_old,
         )
 
+    def _switch_collection(self, collection_name: str):
+        self.vector_store = self.vector_store.__class__(
+            collection_name=collection_name,
+            embedding_function=self.vector_store.embedding_func,
+            connection_args=self.vector_store.connection_args,
+        )
+
     def _get_relevant_documents(
         self,
         query: str,
         collection_name: Optional[str] = None,
     ) -> List[Document]:
         if collection_name:
-            self.vector_store = self.vector_store.__class__(
-                collection_name=collection_name,
-                embedding_function=self.vector_store.embedding_func,
-                connection_args=self.vector_store.connection_args,
-            )
+            self._switch_collection(collection_name)
         if self.search_type == 'similarity':
             result = self.vector_store.similarity_search(query, **self.search_kwargs)
         return result
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        collection_name: Optional[str] = None,
+    ) -> List[Document]:
+        if collection_name:
+            # 创建连接是同步操作, 放到线程池中执行
+            await run_in_executor(None, self._switch_collection, collection_name)
+        if self.search_type == 'similarity':
+            result = await self.vector_store.asimilarity_search(query, **self.search_kwargs)
+        return result
@@ -4,6 +4,7 @@ from langchain.text_splitter import TextSplitter
 from langchain_core.documents import Document
 from pydantic import Field
 from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables.config import run_in_executor
 from loguru import logger
 
 
@@ -41,17 +42,31 @@ class KeywordRetriever(BaseRetriever):
             drop_old=drop_old,
         )
 
+    def _switch_collection(self, collection_name: str):
+        self.keyword_store = self.keyword_store.__class__(
+            index_name=collection_name,
+            elasticsearch_url=self.keyword_store.elasticsearch_url,
+            ssl_verify=self.keyword_store.ssl_verify,
+            llm_chain=self.keyword_store.llm_chain)
+
     def _get_relevant_documents(
         self,
         query: str,
         collection_name: Optional[str] = None,
     ) -> List[Document]:
         if collection_name:
-            self.keyword_store = self.keyword_store.__class__(
-                index_name=collection_name,
-                elasticsearch_url=self.keyword_store.elasticsearch_url,
-                ssl_verify=self.keyword_store.ssl_verify,
-                llm_chain=self.keyword_store.llm_chain)
+            self._switch_collection(collection_name)
         if self.search_type == 'similarity':
             result = self.keyword_store.similarity_search(query, **self.search_kwargs)
         return result
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        collection_name: Optional[str] = None,
+    ) -> List[Document]:
+        if collection_name:
+            await run_in_executor(None, self._switch_collection, collection_name)
+        if self.search_type == 'similarity':
+            result = await self.keyword_store.asimilarity_search(query, **self.search_kwargs)
+        return result
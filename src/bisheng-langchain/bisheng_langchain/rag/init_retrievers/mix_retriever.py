@@ -1,3 +1,4 @@
+import asyncio
 from typing import Any, List, Optional
 
 from bisheng_langchain.vectorstores import ElasticKeywordsSearch
@@ -5,6 +6,7 @@ from langchain.text_splitter import TextSplitter
 from langchain_core.documents import Document
 from pydantic import Field
 from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables.config import run_in_executor
 
 
 class MixRetriever(BaseRetriever):
@@ -59,44 +61,69 @@ class MixRetriever(BaseRetriever):
             drop_old=drop_old,
         )
 
+    def _switch_collection(self, collection_name: str):
+        self.keyword_store = self.keyword_store.__class__(
+            index_name=collection_name,
+            elasticsearch_url=self.keyword_store.elasticsearch_url,
+            ssl_verify=self.keyword_store.ssl_verify,
+            llm_chain=self.keyword_store.llm_chain)
+        self.vector_store = self.vector_store.__class__(
+            collection_name=collection_name,
+            embedding_function=self.vector_store.embedding_func,
+            connection_args=self.vector_store.connection_args,
+        )
+
     def _get_relevant_documents(
         self,
         query: str,
         collection_name: Optional[str] = None,
     ) -> List[Document]:
         if collection_name:
-            self.keyword_store = self.keyword_store.__class__(
-                index_name=collection_name,
-                elasticsearch_url=self.keyword_store.elasticsearch_url,
-                ssl_verify=self.keyword_store.ssl_verify,
-                llm_chain=self.keyword_store.llm_chain)
-            self.vector_store = self.vector_store.__class__(
-                collection_name=collection_name,
-                embedding_function=self.vector_store.embedding_func,
-                connection_args=self.vector_store.connection_args,
-            )
+            self._switch_collection(collection_name)
         if self.search_type == 'similarity':
             keyword_docs = self.keyword_store.similarity_search(query,
                                                                 **self.keyword_search_kwargs)
             vector_docs = self.vector_store.similarity_search(query, **self.vector_search_kwargs)
-            if self.combine_strategy == 'keyword_front':
-                return keyword_docs + vector_docs
-            elif self.combine_strategy == 'vector_front':
-                return vector_docs + keyword_docs
-            elif self.combine_strategy == 'mix':
-                combine_docs = []
-                min_len = min(len(keyword_docs), len(vector_docs))
-                for i in range(min_len):
-                    combine_docs.append(keyword_docs[i])
-                    combine_docs.append(vector_docs[i])
-                combine_docs.extend(keyword_docs[min_len:])
-                combine_docs.extend(vector_docs[min_len:])
-                return combine_docs
-            else:
-                raise ValueError(f'Expected combine_strategy to be one of '
-                                 f'(keyword_front, vector_front, mix),'
-                                 f'instead found {self.combine_strategy}')
+            return self._combine_docs(keyword_docs, vector_docs)
         else:
             raise ValueError(
                 f'Expected search_type to be one of (similarity), instead found {self.search_type}'
             )
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        collection_name: Optional[str] = None,
+    ) -> List[Document]:
+        if collection_name:
+            await run_in_executor(None, self._switch_collection, collection_name)
+        if self.search_type == 'similarity':
+            # 关键词检索和向量检索并发执行
+            keyword_docs, vector_docs = await asyncio.gather(
+                self.keyword_store.asimilarity_search(query, **self.keyword_search_kwargs),
+                self.vector_store.asimilarity_search(query, **self.vector_search_kwargs))
+            return self._combine_docs(keyword_docs, vector_docs)
+        else:
+            raise ValueError(
+                f'Expected search_type to be one of (similarity), instead found {self.search_type}'
+            )
+
+    def _combine_docs(self, keyword_docs: List[Document],
+                      vector_docs: List[Document]) -> List[Document]:
+        if self.combine_strategy == 'keyword_front':
+            return keyword_docs + vector_docs
+        elif self.combine_strategy == 'vector_front':
+            return vector_docs + keyword_docs
+        elif self.combine_strategy == 'mix':
+            combine_docs = []
+            min_len = min(len(keyword_docs), len(vector_docs))
+            for i in range(min_len):
+                combine_docs.append(keyword_docs[i])
+                combine_docs.append(vector_docs[i])
+            combine_docs.extend(keyword_docs[min_len:])
+            combine_docs.extend(vector_docs[min_len:])
+            return combine_docs
+        else:
+            raise ValueError(f'Expected combine_strategy to be one of '
+                             f'(keyword_front, vector_front, mix),'
+                             f'instead found {self.combine_strategy}')
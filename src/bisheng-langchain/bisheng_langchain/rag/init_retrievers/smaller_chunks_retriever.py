@@ -5,6 +5,7 @@ from langchain.text_splitter import TextSplitter
 from langchain_core.documents import Document
 from pydantic import Field
 from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables.config import run_in_executor
 
 
 class SmallerChunksVectorRetriever(BaseRetriever):
@@ -65,23 +66,20 @@ class SmallerChunksVectorRetriever(BaseRetriever):
             drop_old=drop_old,
         )
 
-    def _get_relevant_documents(
-        self,
-        query: str,
-        collection_name: Optional[str] = None,
-    ) -> List[Document]:
-        if collection_name:
-            child_vectorstore = self.vector_store.__class__(
-                collection_name=collection_name + 'child',
-                embedding_function=self.vector_store.embedding_func,
-                connection_args=self.vector_store.connection_args,
-            )
-            parent_vectorstore = self.vector_store.__class__(
-                collection_name=collection_name + 'parent',
-                embedding_function=self.vector_store.embedding_func,
-                connection_args=self.vector_store.connection_args,
-            )
-        sub_docs = child_vectorstore.similarity_search(query, **self.child_search_kwargs)
+    def _get_collection_stores(self, collection_name: str):
+        child_vectorstore = self.vector_store.__class__(
+            collection_name=collection_name + 'child',
+            embedding_function=self.vector_store.embedding_func,
+            connection_args=self.vector_store.connection_args,
+        )
+        parent_vectorstore = self.vector_store.__class__(
+            collection_name=collection_name + 'parent',
+            embedding_function=self.vector_store.embedding_func,
+            connection_args=self.vector_store.connection_args,
+        )
+        return child_vectorstore, parent_vectorstore
+
+    def _get_parent_docs(self, parent_vectorstore, sub_docs: List[Document]) -> List[Document]:
         doc_ids, ret = [], []
         for doc in sub_docs:
             doc_id = doc.metadata[self.id_key]
@@ -90,3 +88,24 @@ class SmallerChunksVectorRetriever(BaseRetriever):
                 par_doc = parent_vectorstore.query(expr=f'{self.id_key} == "{doc_id}"')
                 ret.extend(par_doc)
         return ret
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        collection_name: Optional[str] = None,
+    ) -> List[Document]:
+        if collection_name:
+            child_vectorstore, parent_vectorstore = self._get_collection_stores(collection_name)
+        sub_docs = child_vectorstore.similarity_search(query, **self.child_search_kwargs)
+        return self._get_parent_docs(parent_vectorstore, sub_docs)
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        collection_name: Optional[str] = None,
+    ) -> List[Document]:
+        if collection_name:
+            child_vectorstore, parent_vectorstore = await run_in_executor(
+                None, self._get_collection_stores, collection_name)
+        sub_docs = await child_vectorstore.asimilarity_search(query, **self.child_search_kwargs)
+        return await run_in_executor(None, self._get_parent_docs, parent_vectorstore, sub_docs)
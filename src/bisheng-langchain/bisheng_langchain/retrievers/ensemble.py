@@ -3,10 +3,15 @@ Ensemble retriever that ensemble the results of
 multiple retrievers by using weighted  Reciprocal Rank Fusion
 """
 
-from typing import Any, Dict, List
+import asyncio
+import logging
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Optional, Tuple
 
 from langchain_core.documents import Document
 from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables.config import ContextThreadPoolExecutor
 
 from langchain.callbacks.manager import (
     AsyncCallbackManagerForRetrieverRun,
@@ -14,6 +19,8 @@ from langchain.callbacks.manager import (
 )
 from pydantic import model_validator
 
+logger = logging.getLogger(__name__)
+
 
 class EnsembleRetriever(BaseRetriever):
     """Retriever that ensembles the multiple retrievers.
@@ -27,11 +34,15 @@ class EnsembleRetriever(BaseRetriever):
         c: A constant added to the rank, controlling the balance between the importance
             of high-ranked items and the consideration given to lower-ranked items.
             Default is 60.
+        retriever_timeout: Seconds to wait for each retriever. A retriever that fails
+            or times out contributes no documents instead of failing the whole search.
+            Default is None, wait forever.
     """
 
     retrievers: List[BaseRetriever]
     weights: List[float]
     c: int = 60
+    retriever_timeout: Optional[float] = None
 
     @model_validator(mode='before')
     @classmethod
@@ -102,15 +113,36 @@ class EnsembleRetriever(BaseRetriever):
             A list of reranked documents.
         """
 
-        # Get the results of all retrievers.
-        retriever_docs = [
-            retriever.get_relevant_documents(
-                query,
-                callbacks=run_manager.get_child(tag=f"retriever_{i+1}"),
-                **kwagrs,
-            )
-            for i, retriever in enumerate(self.retrievers)
-        ]
+        # Get the results of all retrievers concurrently.
+        executor = ContextThreadPoolExecutor(max_workers=max(1, len(self.retrievers)))
+        try:
+            futures = [
+                executor.submit(self._timed_get_relevant_documents, retriever, query,
+                                run_manager.get_child(tag=f"retriever_{i+1}"), **kwagrs)
+                for i, retriever in enumerate(self.retrievers)
+            ]
+            # all retrievers share one deadline, otherwise the timeouts of sequential waits add up
+            deadline = None
+            if self.retriever_timeout is not None:
+                deadline = time.monotonic() + self.retriever_timeout
+            results = []
+            for future in futures:
+                timeout = None if deadline is None else max(0, deadline - time.monotonic())
+                try:
+                    results.append(future.result(timeout=timeout))
+                except FutureTimeoutError:
+                    results.append(TimeoutError(f'retriever timeout after {self.retriever_timeout}s'))
+                except Exception as e:
+                    results.append(e)
+        finally:
+            # do not wait for the timeout retrievers
+            executor.shutdown(wait=False)
+
+        retriever_docs, messages, error = self._handle_retriever_results(results)
+        for message in messages:
+            run_manager.on_text(message)
+        if error:
+            raise error
 
         # apply rank fusion
         fused_documents = self.weighted_reciprocal_rank(retriever_docs)
@@ -134,21 +166,66 @@ class EnsembleRetriever(BaseRetriever):
             A list of reranked documents.
         """
 
-        # Get the results of all retrievers.
-        retriever_docs = [
-            await retriever.aget_relevant_documents(
-                query,
-                callbacks=run_manager.get_child(tag=f"retriever_{i+1}"),
-                **kwagrs,
-            )
+        # Get the results of all retrievers concurrently.
+        results = await asyncio.gather(*[
+            self._atimed_get_relevant_documents(retriever, query,
+                                                run_manager.get_child(tag=f"retriever_{i+1}"),
+                                                **kwagrs)
             for i, retriever in enumerate(self.retrievers)
-        ]
+        ], return_exceptions=True)
+
+        retriever_docs, messages, error = self._handle_retriever_results(results)
+        for message in messages:
+            await run_manager.on_text(message)
+        if error:
+            raise error
 
         # apply rank fusion
         fused_documents = self.weighted_reciprocal_rank(retriever_docs)
 
         return fused_documents
 
+    @staticmethod
+    def _timed_get_relevant_documents(retriever: BaseRetriever, query: str, callbacks: Any,
+                                      **kwargs: Any) -> tuple:
+        start = time.time()
+        docs = retriever.get_relevant_documents(query, callbacks=callbacks, **kwargs)
+        return time.time() - start, docs
+
+    async def _atimed_get_relevant_documents(self, retriever: BaseRetriever, query: str,
+                                             callbacks: Any, **kwargs: Any) -> tuple:
+        start = time.time()
+        docs = await asyncio.wait_for(
+            retriever.aget_relevant_documents(query, callbacks=callbacks, **kwargs),
+            timeout=self.retriever_timeout)
+        return time.time() - start, docs
+
+    def _handle_retriever_results(
+            self, results: List[Any]) -> Tuple[List[List[Document]], List[str], Optional[BaseException]]:
+        """
+        Turn the (cost, docs) results into doc lists and timing messages. A failed retriever
+        gets an empty list, the error is only returned when all the retrievers failed.
+        """
+        retriever_docs = []
+        messages = []
+        errors = []
+        for i, result in enumerate(results):
+            name = f"retriever_{i+1}"
+            if isinstance(result, BaseException):
+                if isinstance(result, asyncio.TimeoutError):
+                    result = TimeoutError(f'retriever timeout after {self.retriever_timeout}s')
+                logger.warning(f'{name} {type(self.retrievers[i]).__name__} failed: {result}')
+                messages.append(f'{name} failed: {result}\n')
+                errors.append(result)
+                retriever_docs.append([])
+                continue
+            cost, docs = result
+            messages.append(f'{name} cost={cost:.3f}s docs={len(docs)}\n')
+            retriever_docs.append(docs)
+        if errors and len(errors) == len(results):
+            return retriever_docs, messages, errors[0]
+        return retriever_docs, messages, None
+
     def weighted_reciprocal_rank(self, doc_lists: List[List[Document]]) -> List[Document]:
         """
         Perform weighted Reciprocal Rank Fusion on multiple rank lists.
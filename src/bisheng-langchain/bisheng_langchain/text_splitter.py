@@ -3,7 +3,6 @@
 from __future__ import annotations
 
 import bisect
-import copy
 import logging
 import re
 from abc import ABC, abstractmethod
@@ -163,59 +162,35 @@ class ElemCharacterTextSplitter(RecursiveCharacterTextSplitter):
     def create_documents(
             self, texts: List[str], metadatas: Optional[List[dict]] = None
     ) -> List[Document]:
-        """Create documents from a list of texts."""
+        """Create documents from a list of texts.
+
+        The metadata of each chunk is a shallow copy of the document metadata, the document
+        level lists (bboxes, indexes, pages, types) are shared by all chunks instead of deep
+        copied for every chunk; only chunk_bboxes is built per chunk.
+        """
         documents = []
         for i, text in enumerate(texts):
-            index = -1
-            # metadata = copy.deepcopy(_metadatas[i])
-            indexes = metadatas[i].get('indexes', [])
-            pages = metadatas[i].get('pages', [])
-            types = metadatas[i].get('types', [])
-            bboxes = metadatas[i].get('bboxes', [])
-            searcher = IntervalSearch(indexes)
+            metadata = metadatas[i]
+            indexes = metadata.get('indexes', [])
+            pages = metadata.get('pages', [])
+            types = metadata.get('types', [])
+            bboxes = metadata.get('bboxes', [])
             split_texts = self.split_text(text)
+            if not (indexes and bboxes):
+                documents.extend(Document(page_content=chunk, metadata=dict(metadata)) for chunk in split_texts)
+                continue
+
+            searcher = IntervalSearch(indexes)
+            source = metadata.get('source', '')
+            index = -1
             for chunk in split_texts:
-                new_metadata = copy.deepcopy(metadatas[i])
-                if indexes and bboxes:
-                    index = text.find(chunk, index + 1)
-                    inter0 = [index, index + len(chunk) - 1]
-                    norm_inter = searcher.find(inter0)
-                    new_metadata['chunk_bboxes'] = []
-                    for j in range(norm_inter[0], norm_inter[1] + 1):
-                        new_metadata['chunk_bboxes'].append(
-                            {'page': pages[j], 'bbox': bboxes[j]})
-
-                    c = Counter([types[j] for j in norm_inter])
-                    chunk_type = c.most_common(1)[0][0]
-                    new_metadata['chunk_type'] = chunk_type
-                    new_metadata['source'] = metadatas[i].get('source', '')
-
-                # for chunk in split_texts:
-                #     new_metadata = {}
-                #     new_metadata['chunk_type'] = metadata.get('chunk_type', 'paragraph')
-                #     new_metadata['bboxes'] = metadata.get('bboxes', [])
-                #     new_metadata['source'] = metadata.get('source', '')
-                #     # chunk's start index in text
-                #     index = text.find(chunk, index + 1)
-                #     new_metadata['start'] = metadata.get('start', 0) + index
-                #     new_metadata['end'] = metadata.get('start', 0) + index + len(chunk) - 1
-
-                #     if 'page' in metadata:
-                #         new_metadata['page'] = metadata['page'][new_metadata['start']:new_metadata['end']+1]
-                #     if 'token_to_bbox' in metadata:
-                #         new_metadata['token_to_bbox'] = metadata['token_to_bbox'][new_metadata['start']:new_metadata['end']+1]
-
-                #     if 'page' in new_metadata and 'token_to_bbox' in new_metadata:
-                #         box_no_duplicates = set()
-                #         for index in range(len(new_metadata['page'])):
-                #             box_no_duplicates.add(
-                #                 (new_metadata['page'][index], new_metadata['token_to_bbox'][index]))
-
-                #         new_metadata['chunk_bboxes'] = []
-                #         for elem in box_no_duplicates:
-                #             new_metadata['chunk_bboxes'].append(
-                #                 {'page': elem[0], 'bbox': new_metadata['bboxes'][elem[1]]})
-
-                new_doc = Document(page_content=chunk, metadata=new_metadata)
-                documents.append(new_doc)
+                # chunks come in text order, each search starts from the previous chunk,
+                # so locating all chunks scans the text about once
+                index = text.find(chunk, index + 1)
+                start, end = searcher.find([index, index + len(chunk) - 1])
+                new_metadata = dict(metadata)
+                new_metadata['chunk_bboxes'] = [{'page': pages[j], 'bbox': bboxes[j]} for j in range(start, end + 1)]
+                new_metadata['chunk_type'] = Counter([types[start], types[end]]).most_common(1)[0][0]
+                new_metadata['source'] = source
+                documents.append(Document(page_content=chunk, metadata=new_metadata))
         return documents
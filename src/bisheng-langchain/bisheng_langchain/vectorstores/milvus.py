@@ -453,6 +453,7 @@ class Milvus(MilvusLangchain):
         timeout: Optional[int] = None,
         batch_size: int = 1000,
         no_embedding: bool = False,
+        embeddings: Optional[List[List[float]]] = None,
         **kwargs: Any,
     ) -> List[str]:
         """Insert text data into Milvus.
@@ -473,6 +474,8 @@ class Milvus(MilvusLangchain):
                 to None.
             batch_size (int, optional): Batch size to use for insertion.
                 Defaults to 1000.
+            embeddings (Optional[List[List[float]]]): Precomputed vectors of the
+                texts. If given, the texts will not be embedded again.
 
         Raises:
             MilvusException: Failure to add texts
@@ -483,7 +486,13 @@ class Milvus(MilvusLangchain):
         from pymilvus import Collection, MilvusException
 
         texts = list(texts)
-        if not no_embedding:
+        if embeddings is not None:
+            if len(embeddings) != len(texts):
+                raise ValueError('the number of embeddings must match the number of texts')
+            if len(embeddings) == 0:
+                logger.debug('Nothing to insert, skipping.')
+                return []
+        elif not no_embedding:
             try:
                 embeddings = self.embedding_func.embed_documents(texts)
             except NotImplementedError:
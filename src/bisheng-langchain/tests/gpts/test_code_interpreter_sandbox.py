@@ -0,0 +1,136 @@
+import tempfile
+import time
+
+from bisheng_langchain.gpts.tools.code_interpreter.sandbox import SandboxPool, SandboxTimeout
+
+
+def get_pool(**kwargs) -> SandboxPool:
+    # no preloaded libraries, the tests only need the standard library
+    kwargs.setdefault('preload', [])
+    return SandboxPool(size=1, **kwargs)
+
+
+def test_run_code():
+    pool = get_pool()
+    with tempfile.TemporaryDirectory() as work_dir:
+        returncode, stdout, stderr = pool.execute('print(1 + 1)', work_dir, timeout=30)
+        assert (returncode, stdout.strip(), stderr) == (0, '2', '')
+        returncode, stdout, stderr = pool.execute('raise ValueError("boom")', work_dir, timeout=30)
+        assert returncode == 1 and 'ValueError: boom' in stderr
+    pool.shutdown()
+
+
+def test_workers_not_shared_between_calls():
+    pool = get_pool()
+    with tempfile.TemporaryDirectory() as work_dir:
+        code = 'import os, builtins; os.environ["SANDBOX_LEAK"] = "1"; builtins.leak = 1; print(os.getpid())'
+        _, first_pid, _ = pool.execute(code, work_dir, timeout=30)
+        returncode, stdout, _ = pool.execute(
+            'import os, builtins; print(os.environ.get("SANDBOX_LEAK"), hasattr(builtins, "leak"), os.getpid())',
+            work_dir, timeout=30)
+        assert returncode == 0
+        leak_env, leak_builtin, second_pid = stdout.split()
+        assert (leak_env, leak_builtin) == ('None', 'False')
+        assert first_pid.strip() != second_pid
+    pool.shutdown()
+
+
+def test_timeout_kills_worker():
+    pool = get_pool()
+    with tempfile.TemporaryDirectory() as work_dir:
+        try:
+            pool.execute('while True: pass', work_dir, timeout=2)
+            raise AssertionError('timeout expected')
+        except SandboxTimeout:
+            pass
+        assert not pool._sessions
+        assert all(worker.alive for worker in pool._idle)
+        # the pool keeps working after a timeout
+        assert pool.execute('print("ok")', work_dir, timeout=30)[1].strip() == 'ok'
+    pool.shutdown()
+
+
+def test_rlimit_exit():
+    pool = get_pool(memory_limit_mb=512, cpu_limit=1)
+    with tempfile.TemporaryDirectory() as work_dir:
+        returncode, _, stderr = pool.execute('data = bytearray(1024 * 1024 * 1024)', work_dir, timeout=30)
+        assert returncode == 1 and 'MemoryError' in stderr
+        # RLIMIT_CPU kills the worker with SIGXCPU
+        returncode, _, stderr = pool.execute('while True: pass', work_dir, timeout=30)
+        assert returncode == 1 and 'exited unexpectedly' in stderr
+    pool.shutdown()
+
+
+def test_session_reuse():
+    pool = get_pool()
+    with tempfile.TemporaryDirectory() as work_dir:
+        assert pool.execute('x = 41', work_dir, timeout=30, session_id='a')[0] == 0
+        returncode, stdout, _ = pool.execute('print(x + 1)', work_dir, timeout=30, session_id='a')
+        assert (returncode, stdout.strip()) == (0, '42')
+        returncode, _, stderr = pool.execute('print(x)', work_dir, timeout=30, session_id='b')
+        assert returncode == 1 and 'NameError' in stderr
+
+        # a timeout drops the session, the next call starts with empty globals
+        try:
+            pool.execute('while True: pass', work_dir, timeout=2, session_id='a')
+        except SandboxTimeout:
+            pass
+        assert 'a' not in pool._sessions
+        returncode, _, stderr = pool.execute('print(x)', work_dir, timeout=30, session_id='a')
+        assert returncode == 1 and 'NameError' in stderr
+    pool.shutdown()
+
+
+def test_user_code_can_not_break_protocol():
+    pool = get_pool()
+    with tempfile.TemporaryDirectory() as work_dir:
+        code = 'import json; json.dumps = lambda *a, **k: "PWNED"; json.loads = lambda *a, **k: None; y = 1'
+        assert pool.execute(code, work_dir, timeout=30, session_id='a')[0] == 0
+        returncode, stdout, _ = pool.execute('print(y)', work_dir, timeout=30, session_id='a')
+        assert (returncode, stdout.strip()) == (0, '1')
+    pool.shutdown()
+
+
+def test_max_sessions_evicts_least_recently_used():
+    pool = get_pool(max_sessions=2)
+    with tempfile.TemporaryDirectory() as work_dir:
+        pool.execute('x = "a"', work_dir, timeout=30, session_id='a')
+        pool.execute('x = "b"', work_dir, timeout=30, session_id='b')
+        worker_b = pool._sessions['b']
+        # a is used again, b becomes the least recently used session
+        pool.execute('print(x)', work_dir, timeout=30, session_id='a')
+        pool.execute('x = "c"', work_dir, timeout=30, session_id='c')
+        assert list(pool._sessions) == ['a', 'c']
+        assert not worker_b.alive
+        returncode, stdout, _ = pool.execute('print(x)', work_dir, timeout=30, session_id='a')
+        assert (returncode, stdout.strip()) == (0, 'a')
+        returncode, _, stderr = pool.execute('print(x)', work_dir, timeout=30, session_id='b')
+        assert returncode == 1 and 'NameError' in stderr
+        assert len(pool._sessions) == 2
+    pool.shutdown()
+
+
+def test_idle_sessions_reaped_in_background():
+    pool = get_pool(session_idle_timeout=1)
+    with tempfile.TemporaryDirectory() as work_dir:
+        pool.execute('x = 1', work_dir, timeout=30, session_id='a')
+        worker = pool._sessions['a']
+        # no more calls, the warm-up thread kills the idle session
+        for _ in range(50):
+            if not pool._sessions:
+                break
+            time.sleep(0.1)
+        assert not pool._sessions
+        assert not worker.alive
+    pool.shutdown()
+
+
+if __name__ == '__main__':
+    test_run_code()
+    test_workers_not_shared_between_calls()
+    test_timeout_kills_worker()
+    test_rlimit_exit()
+    test_session_reuse()
+    test_user_code_can_not_break_protocol()
+    test_max_sessions_evicts_least_recently_used()
+    test_idle_sessions_reaped_in_background()
@@ -0,0 +1,103 @@
+import copy
+import random
+import time
+from collections import Counter
+
+from bisheng_langchain.text_splitter import ElemCharacterTextSplitter, IntervalSearch
+from langchain.docstore.document import Document
+
+
+def reference_create_documents(splitter, texts, metadatas):
+    """The previous implementation, deep copies the document metadata for every chunk."""
+    documents = []
+    for i, text in enumerate(texts):
+        index = -1
+        indexes = metadatas[i].get('indexes', [])
+        pages = metadatas[i].get('pages', [])
+        types = metadatas[i].get('types', [])
+        bboxes = metadatas[i].get('bboxes', [])
+        searcher = IntervalSearch(indexes)
+        split_texts = splitter.split_text(text)
+        for chunk in split_texts:
+            new_metadata = copy.deepcopy(metadatas[i])
+            if indexes and bboxes:
+                index = text.find(chunk, index + 1)
+                inter0 = [index, index + len(chunk) - 1]
+                norm_inter = searcher.find(inter0)
+                new_metadata['chunk_bboxes'] = []
+                for j in range(norm_inter[0], norm_inter[1] + 1):
+                    new_metadata['chunk_bboxes'].append({'page': pages[j], 'bbox': bboxes[j]})
+
+                c = Counter([types[j] for j in norm_inter])
+                chunk_type = c.most_common(1)[0][0]
+                new_metadata['chunk_type'] = chunk_type
+                new_metadata['source'] = metadatas[i].get('source', '')
+            documents.append(Document(page_content=chunk, metadata=new_metadata))
+    return documents
+
+
+def synthetic_document(rand, page_num, elems_per_page=20):
+    """Text and element metadata shaped like the partitions returned by the unstructured service."""
+    words = ['bisheng', 'knowledge', 'pipeline', '文档', '解析', 'chunk', 'layout', 'table', 'vector']
+    texts, indexes, pages, types, bboxes = [], [], [], [], []
+    offset = 0
+    for page in range(page_num):
+        for _ in range(elems_per_page):
+            elem_type = rand.choice(['Title', 'NarrativeText', 'NarrativeText', 'Table'])
+            text = ' '.join(rand.choice(words) for _ in range(rand.randint(5, 60)))
+            if elem_type == 'Title':
+                text = text[:30]
+            if texts:
+                offset += 1
+            indexes.append([offset, offset + len(text) - 1])
+            pages.append(page)
+            types.append(elem_type)
+            bboxes.append([rand.randint(0, 300), rand.randint(0, 800), rand.randint(300, 600), rand.randint(0, 800)])
+            texts.append(text)
+            offset += len(text)
+    metadata = {'source': 'synthetic.pdf', 'indexes': indexes, 'pages': pages, 'types': types, 'bboxes': bboxes}
+    return '\n'.join(texts), metadata
+
+
+def get_splitter():
+    return ElemCharacterTextSplitter(separators=['\n\n', '\n', ' ', ''],
+                                     separator_rule=['after', 'after', 'after', 'after'],
+                                     chunk_size=500,
+                                     chunk_overlap=50)
+
+
+def test_same_as_reference():
+    rand = random.Random(0)
+    splitter = get_splitter()
+    for page_num in [1, 3, 10]:
+        text, metadata = synthetic_document(rand, page_num)
+        expected = reference_create_documents(splitter, [text], [metadata])
+        actual = splitter.create_documents([text], [metadata])
+        assert [one.page_content for one in actual] == [one.page_content for one in expected]
+        assert [one.metadata for one in actual] == [one.metadata for one in expected]
+
+    plain = splitter.create_documents(['no element metadata ' * 100], [{'source': 'a.txt'}])
+    assert plain == reference_create_documents(splitter, ['no element metadata ' * 100], [{'source': 'a.txt'}])
+
+
+def test_benchmark_large_document():
+    rand = random.Random(1)
+    splitter = get_splitter()
+    text, metadata = synthetic_document(rand, 2000)
+    print(f'chars={len(text)} elements={len(metadata["indexes"])}')
+
+    start = time.perf_counter()
+    actual = splitter.create_documents([text], [metadata])
+    cost = time.perf_counter() - start
+    print(f'create_documents chunks={len(actual)} cost={cost:.2f}s')
+
+    # the deep copy version is quadratic, only run it on a part of the document
+    part_text, part_metadata = synthetic_document(random.Random(1), 50)
+    start = time.perf_counter()
+    reference_create_documents(splitter, [part_text], [part_metadata])
+    print(f'reference on 50 pages cost={time.perf_counter() - start:.2f}s')
+
+
+if __name__ == '__main__':
+    test_same_as_reference()
+    test_benchmark_large_document()
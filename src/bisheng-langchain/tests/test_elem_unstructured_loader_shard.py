@@ -0,0 +1,104 @@
+import base64
+import json
+import os
+import tempfile
+from unittest import mock
+
+import fitz
+from bisheng_langchain.document_loaders import elem_unstrcutured_loader
+from bisheng_langchain.document_loaders.elem_unstrcutured_loader import ElemUnstructuredLoader
+
+PAGE_NUM = 8
+# pages without any text, the second shard only has text on its last page
+EMPTY_PAGES = {4, 5}
+
+
+def generate_pdf(file_path):
+    doc = fitz.open()
+    for page_index in range(PAGE_NUM):
+        page = doc.new_page()
+        if page_index not in EMPTY_PAGES:
+            page.insert_text((72, 72), f'title of page {page_index}')
+            page.insert_text((72, 120), f'body of page {page_index}')
+    doc.save(file_path)
+    doc.close()
+
+
+class FakeResponse(object):
+    status_code = 200
+
+    def __init__(self, data):
+        self.data = data
+        self.text = json.dumps(data)
+
+    def json(self):
+        return self.data
+
+
+class FakePartitionService(object):
+    """Partitions the uploaded pdf page by page, pages are numbered from 0 within the uploaded file."""
+
+    def __init__(self):
+        self.upload_sizes = []
+
+    def post(self, url, headers=None, data=None):
+        body = b''.join(data)
+        self.upload_sizes.append(len(body))
+        payload = json.loads(body)
+        start, n = payload['parameters']['start'], payload['parameters']['n']
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as f:
+            f.write(base64.b64decode(payload['b64_data'][0]))
+            f.flush()
+            doc = fitz.open(f.name)
+            end = doc.page_count if n is None else min(doc.page_count, start + n)
+            partitions = []
+            for page_index in range(start, end):
+                for x0, y0, x1, y1, text, _, _ in doc.load_page(page_index).get_text('blocks'):
+                    text = text.strip()
+                    partitions.append({
+                        'type': 'Title' if text.startswith('title') else 'NarrativeText',
+                        'text': text,
+                        'metadata': {
+                            'extra_data': {
+                                'pages': [page_index],
+                                'bboxes': [[x0, y0, x1, y1]],
+                                'indexes': [[0, len(text) - 1]],
+                                'types': ['Paragraph'],
+                            }
+                        }
+                    })
+            doc.close()
+        return FakeResponse({'status_code': 200, 'partitions': partitions})
+
+
+def load(file_path, start, shard_pages):
+    service = FakePartitionService()
+    loader = ElemUnstructuredLoader('test.pdf', file_path, unstructured_api_url='http://fake',
+                                    start=start, shard_pages=shard_pages, max_concurrency=2)
+    with mock.patch.object(elem_unstrcutured_loader.requests, 'post', service.post):
+        docs = loader.load()
+    return docs[0], service
+
+
+def test_sharded_merge_same_as_single_request():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, 'test.pdf')
+        generate_pdf(file_path)
+        for start in [0, 1]:
+            expected, single_service = load(file_path, start, shard_pages=0)
+            actual, shard_service = load(file_path, start, shard_pages=3)
+            assert len(single_service.upload_sizes) == 1
+            assert len(shard_service.upload_sizes) == 3
+            # every shard only uploads its own pages
+            assert max(shard_service.upload_sizes) < single_service.upload_sizes[0]
+
+            assert actual.page_content == expected.page_content
+            assert actual.metadata['pages'] == expected.metadata['pages']
+            assert actual.metadata['bboxes'] == expected.metadata['bboxes']
+            assert actual.metadata['indexes'] == expected.metadata['indexes']
+            assert actual.metadata['pages'] == sorted(actual.metadata['pages'])
+            assert set(actual.metadata['pages']) == set(range(start, PAGE_NUM)) - EMPTY_PAGES
+
+
+if __name__ == '__main__':
+    test_sharded_merge_same_as_single_request()
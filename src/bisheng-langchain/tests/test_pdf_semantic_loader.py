@@ -0,0 +1,123 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+import pytest
+
+fitz = pytest.importorskip('fitz')
+
+from bisheng_langchain.document_loaders import PDFWithSemanticLoader  # noqa: E402
+from langchain_community.docstore.document import Document
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+PARAGRAPHS_PER_PAGE = 12
+LINES_PER_PARAGRAPH = 3
+LINE_HEIGHT = 14
+PARAGRAPH_HEIGHT = LINES_PER_PARAGRAPH * LINE_HEIGHT + 20
+
+
+class FakeLayoutParser(object):
+    """Returns the paragraph regions of the generated pdf, no layout service needed."""
+
+    def parse(self, blob):
+        layout = []
+        for i in range(PARAGRAPHS_PER_PAGE):
+            y0 = 40 + i * PARAGRAPH_HEIGHT
+            y1 = y0 + LINES_PER_PARAGRAPH * LINE_HEIGHT + 4
+            # the first region of each page is a title
+            category_id = 3 if i == 0 else 4
+            layout.append({'bbox': [30, y0, 565, y0, 565, y1, 30, y1], 'category_id': category_id})
+        return [Document(page_content=json.dumps(layout), metadata={})]
+
+
+def generate_pdf(file_path, page_num):
+    doc = fitz.open()
+    for page_index in range(page_num):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        for i in range(PARAGRAPHS_PER_PAGE):
+            y0 = 40 + i * PARAGRAPH_HEIGHT
+            lines = [f'page {page_index} paragraph {i} line {j} ' + 'lorem ipsum dolor sit amet ' * 3
+                     for j in range(LINES_PER_PARAGRAPH)]
+            page.insert_textbox(fitz.Rect(40, y0, 555, y0 + LINES_PER_PARAGRAPH * LINE_HEIGHT + 4),
+                                '\n'.join(lines), fontsize=9)
+    doc.save(file_path)
+    doc.close()
+
+
+def get_loader(file_path, parallelism):
+    loader = PDFWithSemanticLoader(file_path, parallelism=parallelism)
+    loader.layout_parser = FakeLayoutParser()
+    return loader
+
+
+def normalize_groups(groups):
+    """Blocks are (x0, y0, x1, y1, text, line bboxes, label), convert the numpy values to compare them."""
+    return [[[np.asarray(one).tolist() if isinstance(one, (np.ndarray, np.generic)) else one for one in block]
+             for block in blocks] for blocks in groups]
+
+
+def load(file_path, parallelism):
+    loader = get_loader(file_path, parallelism)
+    start = time.perf_counter()
+    docs = loader.load()
+    return docs, time.perf_counter() - start
+
+
+def test_parallel_same_as_serial():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, 'generated.pdf')
+        generate_pdf(file_path, 20)
+        serial_docs, _ = load(file_path, 1)
+        parallel_docs, _ = load(file_path, 4)
+        assert serial_docs[0].page_content
+        assert serial_docs[0].page_content == parallel_docs[0].page_content
+        assert serial_docs[0].metadata == parallel_docs[0].metadata
+
+        # the blocks carry the bboxes, text and labels of every page, in page order
+        for start, n in [(0, 20), (3, 11)]:
+            serial_groups = get_loader(file_path, 1)._process_pages(start, n)
+            parallel_groups = get_loader(file_path, 4)._process_pages_parallel(start, n)
+            assert len(serial_groups) == n
+            assert normalize_groups(serial_groups) == normalize_groups(parallel_groups)
+
+
+def load_in_daemon(file_path, queue):
+    docs, _ = load(file_path, 4)
+    queue.put(docs[0].page_content)
+
+
+def test_parallel_in_daemon_process():
+    # celery prefork workers are daemon processes, multiprocessing can not start children there
+    pytest.importorskip('billiard')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, 'generated.pdf')
+        generate_pdf(file_path, 8)
+        serial_docs, _ = load(file_path, 1)
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=load_in_daemon, args=(file_path, queue), daemon=True)
+        process.start()
+        page_content = queue.get(timeout=120)
+        process.join()
+        assert page_content == serial_docs[0].page_content
+
+
+@pytest.mark.skipif(not os.getenv('BISHENG_BENCHMARK'), reason='slow, set BISHENG_BENCHMARK=1 to run')
+def test_benchmark_parallelism():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, 'generated.pdf')
+        generate_pdf(file_path, 300)
+        serial_docs, serial_cost = load(file_path, 1)
+        print(f'300 pages parallelism=1 cost={serial_cost:.2f}s')
+        for parallelism in [2, 4, 8]:
+            docs, cost = load(file_path, parallelism)
+            assert docs[0].page_content == serial_docs[0].page_content
+            print(f'300 pages parallelism={parallelism} cost={cost:.2f}s speedup={serial_cost / cost:.2f}x')
+
+
+if __name__ == '__main__':
+    test_parallel_same_as_serial()
+    test_parallel_in_daemon_process()
+    test_benchmark_parallelism()